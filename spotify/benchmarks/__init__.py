@@ -0,0 +1,29 @@
+"""
+Benchmarks for the Spotify data app.
+
+Run them from the ``spotify`` directory, for example::
+
+    python -m benchmarks.album_ingestion
+"""
+import os
+
+
+def setup_django(database=":memory:"):
+    """
+    Configure Django with the test settings and an in-memory database, or
+    the sqlite file ``database``.
+
+    Migrations are skipped, the same as with ``pytest --nomigrations``.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings.test_settings")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ.setdefault("DJANGO_ALLOWED_HOSTS", "localhost")
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.DATABASES["default"]["NAME"] = database
+    django.setup()
+    settings.MIGRATION_MODULES = {"spotify_app": None}
+    call_command("migrate", run_syncdb=True, verbosity=0)
@@ -0,0 +1,108 @@
+"""
+Wall-clock time of album ingestion with and without concurrent fetching.
+
+Spotify is replaced by a fake ``app_requests_url`` which sleeps for the given
+latency before answering, so the numbers show how much of the upstream
+waiting overlaps::
+
+    python -m benchmarks.album_ingestion --tracks 120 --latency 0.1
+"""
+import argparse
+import time
+from unittest.mock import Mock, patch
+
+from benchmarks import setup_django
+
+
+FEATURES = ("danceability", "speechiness", "acousticness", "valence",
+            "instrumentalness", "energy", "liveness")
+
+
+def fake_spotify(album_id, tracks_number, latency):
+    """
+    Return a stand-in for ``tasks.app_requests_url`` and
+    ``tasks.cached_requests_url`` answering like Spotify.
+    """
+    from spotify_app.api_endpoints import API_ENDPOINTS
+    from spotify_app.tasks import ALBUM_TRACKS_LIMIT
+
+    artist = {"id": "bench-artist", "name": "Benchmark Artist"}
+    track_ids = ["{}-{}".format(album_id, number) for number in range(tracks_number)]
+
+    def ids_from(url):
+        return url.split("ids=")[1].split(",")
+
+    def app_requests_url(url, endpoint=None):
+        time.sleep(latency)
+        if url.startswith(API_ENDPOINTS["several_tracks"]):
+            return {"tracks": [
+                {"id": track_id, "name": track_id, "artists": [artist]}
+                for track_id in ids_from(url)
+            ]}
+        if url.startswith(API_ENDPOINTS["several_audio_features"]):
+            return {"audio_features": [
+                dict(id=track_id, **{name: 0.5 for name in FEATURES})
+                for track_id in ids_from(url)
+            ]}
+        if "/tracks?" in url:
+            offset = int(url.rsplit("offset=", 1)[1])
+            page = track_ids[offset:offset + ALBUM_TRACKS_LIMIT]
+            return {"items": [{"id": track_id} for track_id in page]}
+        return {
+            "id": album_id,
+            "name": album_id,
+            "artists": [artist],
+            "images": [{}, {"url": "https://dummy.url.com"}],
+            "tracks": {
+                "items": [{"id": track_id} for track_id in track_ids[:ALBUM_TRACKS_LIMIT]],
+                "total": tracks_number,
+            },
+        }
+
+    return app_requests_url
+
+
+def run(concurrency, tracks_number, latency, repeat):
+    from django.test import override_settings
+
+    from spotify_app import tasks
+    from spotify_app.models import Album, Artist
+    from spotify_app.services import create_album_tracks_and_features
+
+    timings = []
+    for number in range(repeat):
+        album_id = "bench-album-{}".format(number)
+        fake = Mock(side_effect=fake_spotify(album_id, tracks_number, latency))
+        with patch.object(tasks, "app_requests_url", fake), \
+                patch.object(tasks, "cached_requests_url", fake), \
+                override_settings(SPOTIFY_FETCH_CONCURRENCY=concurrency):
+            start = time.perf_counter()
+            create_album_tracks_and_features(Mock(), album_id)
+            timings.append(time.perf_counter() - start)
+        Album.objects.all().delete()
+        Artist.objects.all().delete()
+    return min(timings), fake.call_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tracks", type=int, default=120, help="tracks on the album")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per Spotify call")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent requests")
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    setup_django()
+
+    sequential, calls = run(1, args.tracks, args.latency, args.repeat)
+    concurrent, _ = run(args.concurrency, args.tracks, args.latency, args.repeat)
+
+    print("album of {} tracks, {} Spotify calls, {:.0f} ms latency each".format(
+        args.tracks, calls, args.latency * 1000))
+    print("sequential:            {:8.1f} ms".format(sequential * 1000))
+    print("concurrent (limit {:>2}): {:8.1f} ms".format(args.concurrency, concurrent * 1000))
+    print("speed-up:              {:8.2f}x".format(sequential / concurrent))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Peak memory of the catalogue export as the number of tracks grows.
+
+Every export runs in a fresh process over a sqlite file filled beforehand,
+streamed the way ``export/tracks.csv`` serves it and, for comparison,
+built whole in memory from model instances::
+
+    python -m benchmarks.catalogue_export --rows 10000 50000 200000
+"""
+import argparse
+import csv
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import setup_django
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def export_streaming():
+    from spotify_app.exports import export_catalogue
+
+    _, chunks = export_catalogue("tracks", "csv", {})
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+    return size
+
+
+def export_in_memory():
+    from spotify_app.models import FEATURES_NAMES, Track
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for track in list(Track.objects.select_related("artist").order_by("id")):
+        writer.writerow(
+            [track.id, track.name, track.artist_id, track.artist.name]
+            + [getattr(track, name) for name in FEATURES_NAMES]
+        )
+    return len(buffer.getvalue())
+
+
+def child(mode, database, rows):
+    setup_django(database)
+    if mode == "fill":
+        from benchmarks.similar_tracks import fill_db
+        fill_db(rows)
+        return
+
+    before = peak_rss_mb()
+    start = time.perf_counter()
+    size = export_streaming() if mode == "streaming" else export_in_memory()
+    print(time.perf_counter() - start, size, before, peak_rss_mb())
+
+
+def run_child(mode, database, rows):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.catalogue_export", "--child", mode, "--db", database, "--rows", str(rows)],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return [float(value) for value in output]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 200000], help="tracks in the db")
+    parser.add_argument("--child", choices=["fill", "streaming", "in-memory"], help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.db, args.rows[0])
+        return
+
+    print("{:>9} {:>10} {:>12} {:>12} {:>12}".format("tracks", "export", "seconds", "RSS growth", "peak RSS"))
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            database = os.path.join(directory, "tracks-{}.sqlite3".format(rows))
+            run_child("fill", database, rows)
+            for mode in ("streaming", "in-memory"):
+                seconds, size, before, peak = run_child(mode, database, rows)
+                print("{:>9} {:>10} {:>12.2f} {:>9.1f} MB {:>9.1f} MB".format(
+                    rows, mode, seconds, peak - before, peak))
+
+
+if __name__ == "__main__":
+    main()
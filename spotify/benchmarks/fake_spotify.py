@@ -0,0 +1,350 @@
+"""
+Stand-in for the Spotify Web API and accounts service, to load test the
+app without network.
+
+Albums, tracks, audio features, artists, search results, new releases
+and recently played tracks are generated from their ids, the same in
+every run with the same ``--seed``. API calls are answered after
+``--latency`` seconds, some of them with a 503 or a 429 at the given
+rates; token grants are always answered at once::
+
+    python -m benchmarks.fake_spotify --port 8900 --latency 0.05 --error-rate 0.01 --throttle-rate 0.01
+
+Point the app at it with ``SPOTIFY_API_BASE_URL`` and
+``SPOTIFY_ACCOUNTS_BASE_URL``. ``GET /__stats`` returns the requests
+served by endpoint and by status, ``POST /__reset`` clears them.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FEATURES_NAMES = ("danceability", "energy", "speechiness", "acousticness", "instrumentalness", "liveness", "valence")
+
+
+class Catalogue:
+    """
+    Spotify objects generated from their ids.
+
+    Albums named ``album-<n>`` belong to artist ``artist-<n % artists>``,
+    so an artist's albums are the albums which list the artist, and the
+    tracks of an album are ``<album id>-<position>``. Other ids get an
+    artist drawn at random from the id.
+    """
+
+    PAGE_SIZE = 50
+    MAX_ALBUM_TRACKS = 120
+
+    def __init__(self, seed=0, artists=500):
+        self.seed = seed
+        self.artists = artists
+
+    def random(self, *key):
+        return random.Random(":".join(str(part) for part in (self.seed,) + key))
+
+    @staticmethod
+    def number(object_id):
+        match = re.search(r"(\d+)$", object_id)
+        return int(match.group(1)) if match else None
+
+    def artist_ref(self, artist_id):
+        return {"id": artist_id, "name": "Artist {}".format(artist_id), "type": "artist"}
+
+    def artist(self, artist_id):
+        rng = self.random("artist", artist_id)
+        return dict(
+            self.artist_ref(artist_id),
+            popularity=rng.randint(0, 100),
+            genres=rng.sample(["rock", "pop", "jazz", "metal", "folk", "techno", "soul"], 2),
+            followers={"total": rng.randint(0, 10 ** 6)},
+        )
+
+    def album_artist_id(self, album_id):
+        number = self.number(album_id)
+        if number is None:
+            number = self.random("album-artist", album_id).randrange(self.artists)
+        return "artist-{}".format(number % self.artists)
+
+    def album_track_ids(self, album_id):
+        total = self.random("album", album_id).randint(1, self.MAX_ALBUM_TRACKS)
+        return ["{}-{}".format(album_id, number) for number in range(total)]
+
+    def simplified_album(self, album_id):
+        return {
+            "id": album_id,
+            "name": "Album {}".format(album_id),
+            "album_type": "album",
+            "artists": [self.artist_ref(self.album_artist_id(album_id))],
+            "images": [
+                {"url": "https://i.scdn.co/image/{}-{}".format(album_id, size), "height": size, "width": size}
+                for size in (640, 300, 64)
+            ],
+            "release_date": "20{:02d}-01-01".format(self.random("album", album_id).randint(0, 24)),
+            "total_tracks": len(self.album_track_ids(album_id)),
+        }
+
+    def album_tracks(self, album_id, offset=0, limit=PAGE_SIZE):
+        track_ids = self.album_track_ids(album_id)
+        return {
+            "items": [self.track(track_id) for track_id in track_ids[offset:offset + limit]],
+            "total": len(track_ids),
+            "limit": limit,
+            "offset": offset,
+        }
+
+    def album(self, album_id):
+        return dict(self.simplified_album(album_id), tracks=self.album_tracks(album_id))
+
+    def artist_albums(self, artist_id):
+        number = self.number(artist_id) or 0
+        count = self.random("artist-albums", artist_id).randint(1, 20)
+        album_ids = ["album-{}".format(number % self.artists + index * self.artists) for index in range(count)]
+        return {"items": [self.simplified_album(album_id) for album_id in album_ids], "total": count}
+
+    def track(self, track_id):
+        rng = self.random("track", track_id)
+        album_id, _, position = track_id.rpartition("-")
+        if album_id and position.isdigit():
+            artist_id = self.album_artist_id(album_id)
+        else:
+            artist_id = "artist-{}".format(rng.randrange(self.artists))
+        return {
+            "id": track_id,
+            "name": "Track {}".format(track_id),
+            "artists": [self.artist_ref(artist_id)],
+            "duration_ms": rng.randint(60000, 600000),
+            "popularity": rng.randint(0, 100),
+            "type": "track",
+        }
+
+    def audio_features(self, track_id):
+        rng = self.random("audio-features", track_id)
+        features = {name: round(rng.random(), 3) for name in FEATURES_NAMES}
+        return dict(
+            features,
+            id=track_id,
+            key=rng.randint(0, 11),
+            mode=rng.randint(0, 1),
+            loudness=round(rng.uniform(-30, 0), 3),
+            tempo=round(rng.uniform(60, 200), 3),
+            time_signature=4,
+            type="audio_features",
+        )
+
+    def search(self, query, limit=20):
+        rng = self.random("search", query)
+        total = rng.randint(0, 200)
+        artist_ids = ["artist-{}".format(rng.randrange(self.artists)) for _ in range(min(limit, total))]
+        return {"artists": {"items": [self.artist(artist_id) for artist_id in artist_ids], "total": total}}
+
+    def new_releases(self, limit=20):
+        numbers = self.random("new-releases").sample(range(100000), limit)
+        return {"albums": {"items": [self.simplified_album("album-{}".format(number)) for number in numbers],
+                           "total": limit}}
+
+    def recently_played(self, user, limit=20):
+        rng = self.random("recently-played", user)
+        return {"items": [
+            {"track": self.track("album-{}-{}".format(rng.randrange(100000), rng.randrange(10))),
+             "played_at": "2020-01-01T00:00:00Z"}
+            for _ in range(limit)
+        ]}
+
+
+def several(ids, build):
+    return [build(object_id) for object_id in ids.split(",") if object_id]
+
+
+# Endpoint name, path and the answer built from the catalogue, the path
+# groups and the query string.
+ROUTES = [
+    ("album_tracks", r"/v1/albums/([^/]+)/tracks",
+     lambda c, album_id, query: c.album_tracks(
+         album_id, int(query.get("offset", 0)), int(query.get("limit", Catalogue.PAGE_SIZE)))),
+    ("album", r"/v1/albums/([^/]+)", lambda c, album_id, query: c.album(album_id)),
+    ("several_tracks", r"/v1/tracks",
+     lambda c, query: {"tracks": several(query.get("ids", ""), c.track)}),
+    ("track", r"/v1/tracks/([^/]+)", lambda c, track_id, query: c.track(track_id)),
+    ("several_audio_features", r"/v1/audio-features",
+     lambda c, query: {"audio_features": several(query.get("ids", ""), c.audio_features)}),
+    ("track_audio_feature", r"/v1/audio-features/([^/]+)", lambda c, track_id, query: c.audio_features(track_id)),
+    ("search", r"/v1/search", lambda c, query: c.search(query.get("q", ""))),
+    ("artist_albums", r"/v1/artists/([^/]+)/albums", lambda c, artist_id, query: c.artist_albums(artist_id)),
+    ("artist", r"/v1/artists/([^/]+)", lambda c, artist_id, query: c.artist(artist_id)),
+    ("new_releases", r"/v1/browse/new-releases", lambda c, query: c.new_releases()),
+    ("user_recently_played", r"/v1/me/player/recently-played", lambda c, query: c.recently_played("me")),
+]
+ROUTES = [(name, re.compile("^{}/?$".format(path)), answer) for name, path, answer in ROUTES]
+
+
+def route(catalogue, path, query):
+    """
+    Return the endpoint name of the API path and a function building its
+    answer, or None for an unknown path.
+    """
+    for name, pattern, answer in ROUTES:
+        match = pattern.match(path)
+        if match:
+            return name, lambda: answer(catalogue, *match.groups(), query)
+    return None
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=()):
+        body = json.dumps(data).encode()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        if self.endpoint is not None:
+            self.server.count(self.endpoint, status)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.endpoint = None
+        if url.path == "/__stats":
+            return self.send_json(200, self.server.stats())
+        self.endpoint = "unknown"
+
+        found = route(self.server.catalogue, url.path, query)
+        if found is None:
+            return self.send_json(404, {"error": {"status": 404, "message": "Service not found"}})
+        self.endpoint, answer = found
+
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self.send_json(401, {"error": {"status": 401, "message": "No token provided"}})
+        fault = self.server.fault()
+        if fault == 429:
+            return self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                  [("Retry-After", str(self.server.retry_after))])
+        if fault == 503:
+            return self.send_json(503, {"error": {"status": 503, "message": "Service unavailable"}})
+        self.send_json(200, answer())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {name: values[0] for name, values in parse_qs(self.rfile.read(length).decode()).items()}
+        self.endpoint = None
+        if url.path == "/__reset":
+            self.server.reset()
+            return self.send_json(200, {})
+        self.endpoint = "token"
+        if url.path != "/api/token":
+            self.endpoint = "unknown"
+            return self.send_json(404, {"error": "not_found"})
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            return self.send_json(400, {"error": "invalid_client"})
+
+        grant_type = form.get("grant_type")
+        if grant_type not in ("authorization_code", "refresh_token", "client_credentials"):
+            return self.send_json(400, {"error": "unsupported_grant_type"})
+        token = {"access_token": self.server.new_token(), "token_type": "Bearer", "expires_in": 3600}
+        if grant_type == "authorization_code":
+            token["refresh_token"] = self.server.new_token()
+        self.send_json(200, token)
+
+
+class FakeSpotify(ThreadingHTTPServer):
+    """
+    HTTP server answering like Spotify, one thread per connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, seed=0, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1):
+        super().__init__(address, FakeSpotifyHandler)
+        self.catalogue = Catalogue(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._statuses = Counter()
+
+    def fault(self):
+        """
+        Wait for the latency, then return the error status to answer with,
+        if any.
+        """
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+            draw = self._random.random()
+        time.sleep(delay)
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+    def new_token(self):
+        with self._lock:
+            return "fake-token-{}".format(next(self._tokens))
+
+    def count(self, endpoint, status):
+        with self._lock:
+            self._requests[endpoint] += 1
+            self._statuses[str(status)] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self._requests), "statuses": dict(self._statuses)}
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self._statuses.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--seed", type=int, default=0, help="generates a different catalogue")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every API answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API calls answered 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of API calls answered 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of the 429 answers")
+    args = parser.parse_args()
+
+    server = FakeSpotify(
+        (args.host, args.port), seed=args.seed, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+    )
+    print("Fake Spotify listening on http://{}:{}".format(*server.server_address), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
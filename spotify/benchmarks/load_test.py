@@ -0,0 +1,232 @@
+"""
+Requests per second, latency percentiles and Spotify calls of each view,
+with the app served against ``benchmarks.fake_spotify``, no network needed.
+
+The fake API and the app run in processes of their own, the app with the
+test settings over a sqlite file and a threaded WSGI server. Albums are
+ingested from the fake API first, then every view is loaded in turn by
+``--concurrency`` logged in users::
+
+    python -m benchmarks.load_test --requests 300 --concurrency 8 --latency 0.02
+
+Spotify calls per request are read from the fake API's counters, so a
+cached view shows well under one.
+"""
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import numpy as np
+import requests
+
+from benchmarks import setup_django
+from benchmarks.fake_spotify import Catalogue
+
+VIEWS = (
+    "index", "recently_played", "search", "artist", "album", "track",
+    "similar_tracks", "tracks_table", "albums_table",
+)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def album_ids(albums):
+    return ["album-{}".format(number) for number in range(albums)]
+
+
+def serve(database, port, albums):
+    """
+    Ingest the albums, then serve the app until killed.
+    """
+    setup_django(database)
+    from django.core.wsgi import get_wsgi_application
+
+    from spotify_app.ingest import ALBUMS, Checkpoint, ingest
+
+    # One at a time, sqlite allows a single writer.
+    _, errors = ingest(ALBUMS, album_ids(albums), Checkpoint(None), concurrency=1)
+    if errors:
+        raise SystemExit("Ingesting albums from the fake API failed: {!r}".format(errors))
+
+    server = make_server("127.0.0.1", port, get_wsgi_application(), ThreadingWSGIServer, QuietHandler)
+    print("ready", flush=True)
+    server.serve_forever()
+
+
+def view_paths(albums, seed):
+    catalogue = Catalogue(seed)
+    track_ids = [track_id for album_id in album_ids(albums) for track_id in catalogue.album_track_ids(album_id)]
+    return {
+        "index": lambda number: "/",
+        "recently_played": lambda number: "/recently_played/",
+        "search": lambda number: "/search/?q=artist{}".format(number % 50),
+        "artist": lambda number: "/artist/artist-{}/".format(number % 50),
+        "album": lambda number: "/album/album-{}/".format(number % albums),
+        "track": lambda number: "/track/{}/".format(track_ids[number % len(track_ids)]),
+        "similar_tracks": lambda number: "/track/{}/similar/".format(track_ids[number % len(track_ids)]),
+        "tracks_table": lambda number: "/tracks_table/",
+        "albums_table": lambda number: "/albums_table/",
+    }
+
+
+def log_in(app_url, number):
+    session = requests.Session()
+    resp = session.get("{}/callback/q?code=load-test-{}".format(app_url, number), allow_redirects=False)
+    if resp.status_code != 302:
+        raise SystemExit("Logging in failed with {}".format(resp.status_code))
+    return session
+
+
+def spotify_calls(fake_url):
+    requests_by_endpoint = requests.get(fake_url + "/__stats").json()["requests"]
+    return sum(count for endpoint, count in requests_by_endpoint.items() if endpoint != "token")
+
+
+def load_view(app_url, fake_url, sessions, path, requests_number):
+    """
+    Send ``requests_number`` GETs of ``path(number)``, one user per thread.
+    """
+    numbers = itertools.count()
+    latencies = []
+    errors = []
+
+    def user(session):
+        while True:
+            number = next(numbers)
+            if number >= requests_number:
+                return
+            start = time.perf_counter()
+            resp = session.get(app_url + path(number), allow_redirects=False)
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code not in (200, 202, 304):
+                errors.append(resp.status_code)
+
+    calls_before = spotify_calls(fake_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        for future in [executor.submit(user, session) for session in sessions]:
+            future.result()
+    elapsed = time.perf_counter() - start
+    calls = spotify_calls(fake_url) - calls_before
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "requests": requests_number,
+        "rps": requests_number / elapsed,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+        "errors": len(errors),
+        "spotify_calls_per_request": calls / requests_number,
+    }
+
+
+def wait_for(url, process, seconds=30):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("{} exited with {}".format(" ".join(process.args), process.returncode))
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise SystemExit("{} did not answer in {} seconds".format(url, seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--views", nargs="+", choices=VIEWS, default=list(VIEWS))
+    parser.add_argument("--requests", type=int, default=200, help="requests per view")
+    parser.add_argument("--concurrency", type=int, default=8, help="users sending requests at the same time")
+    parser.add_argument("--albums", type=int, default=20, help="albums ingested before the run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake API takes to answer")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float,
+                        help="Spotify requests per second allowed to the app, SPOTIFY_RATE_LIMIT by default")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.db, args.port, args.albums)
+        return
+
+    fake_port, app_port = free_port(), free_port()
+    fake_url = "http://127.0.0.1:{}".format(fake_port)
+    app_url = "http://127.0.0.1:{}".format(app_port)
+    env = dict(
+        os.environ,
+        SPOTIFY_API_BASE_URL=fake_url,
+        SPOTIFY_ACCOUNTS_BASE_URL=fake_url,
+        DJANGO_ALLOWED_HOSTS="127.0.0.1 localhost",
+    )
+    if args.rate_limit:
+        env["SPOTIFY_RATE_LIMIT"] = str(args.rate_limit)
+
+    with tempfile.TemporaryDirectory() as directory:
+        fake = subprocess.Popen([
+            sys.executable, "-m", "benchmarks.fake_spotify", "--port", str(fake_port), "--seed", str(args.seed),
+            "--latency", str(args.latency), "--jitter", str(args.jitter),
+            "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+        ], stdout=subprocess.DEVNULL)
+        app = None
+        try:
+            wait_for(fake_url + "/__stats", fake)
+            app = subprocess.Popen([
+                sys.executable, "-m", "benchmarks.load_test", "--serve", "--port", str(app_port),
+                "--db", os.path.join(directory, "load-test.sqlite3"), "--albums", str(args.albums),
+            ], env=env, stdout=subprocess.PIPE, text=True)
+            if app.stdout.readline().strip() != "ready":
+                raise SystemExit("The app did not start")
+
+            sessions = [log_in(app_url, number) for number in range(args.concurrency)]
+            paths = view_paths(args.albums, args.seed)
+            results = {}
+            print("{:>16} {:>9} {:>9} {:>9} {:>9} {:>9} {:>7} {:>13}".format(
+                "view", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms", "errors", "Spotify/req"))
+            for view in args.views:
+                result = results[view] = load_view(app_url, fake_url, sessions, paths[view], args.requests)
+                print("{:>16} {requests:>9} {rps:>9.1f} {p50_ms:>9.1f} {p95_ms:>9.1f} {p99_ms:>9.1f} {errors:>7} "
+                      "{spotify_calls_per_request:>13.2f}".format(view, **result))
+        finally:
+            for process in (app, fake):
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
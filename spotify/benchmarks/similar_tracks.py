@@ -0,0 +1,111 @@
+"""
+Latency of the similar tracks lookup, in memory against a scan in the db.
+
+The db is filled with tracks with random audio features. The in-memory
+lookup goes through ``NearestTracks``, the scan orders every track by
+its distance in SQL::
+
+    python -m benchmarks.similar_tracks --tracks 1000000
+"""
+import argparse
+import random
+import time
+
+from benchmarks import setup_django
+
+
+def fill_db(tracks_number, batch_size=10000):
+    from spotify_app.models import FEATURES_NAMES, Artist, Track
+
+    artist = Artist.objects.create(id="bench-artist", name="Benchmark Artist")
+    for start in range(0, tracks_number, batch_size):
+        Track.objects.bulk_create([
+            Track(
+                id="bench-{}".format(number),
+                name="Track {}".format(number),
+                artist=artist,
+                artist_name=artist.name,
+                **{name: random.randint(0, 1000) / 1000 for name in FEATURES_NAMES}
+            )
+            for number in range(start, min(start + batch_size, tracks_number))
+        ])
+
+
+def orm_scan(vector, k, exclude):
+    from django.db.models import ExpressionWrapper, F, IntegerField
+
+    from spotify_app.models import FEATURES_NAMES, Track
+
+    distance = sum(
+        (F(name) - round(value * 1000)) * (F(name) - round(value * 1000))
+        for name, value in zip(FEATURES_NAMES, vector)
+    )
+    tracks = (
+        Track.objects.filter(danceability__isnull=False)
+        .exclude(id__in=exclude)
+        .annotate(distance=ExpressionWrapper(distance, output_field=IntegerField()))
+        .order_by("distance")
+        .values_list("id", "distance")[:k]
+    )
+    return [(track_id, (distance ** 0.5) / 1000) for track_id, distance in tracks]
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return (
+        timings[len(timings) // 2] * 1000,
+        timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000,
+    )
+
+
+def measure(lookup, queries):
+    timings = []
+    for vector, exclude in queries:
+        start = time.perf_counter()
+        lookup(vector, exclude)
+        timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tracks", type=int, default=100000, help="tracks in the db")
+    parser.add_argument("--k", type=int, default=10, help="similar tracks per lookup")
+    parser.add_argument("--queries", type=int, default=1000, help="in-memory lookups")
+    parser.add_argument("--scans", type=int, default=20, help="lookups scanning the db")
+    args = parser.parse_args()
+
+    setup_django()
+    from spotify_app.analytics import FeatureMatrix, NearestTracks
+
+    start = time.perf_counter()
+    fill_db(args.tracks)
+    fill_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = FeatureMatrix().load()
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    index = NearestTracks(matrix).sync()
+    build_time = time.perf_counter() - start
+
+    def query(number):
+        track_id = random.choice(matrix.ids)
+        return [float(value) for value in matrix.vector(track_id)], [track_id]
+
+    in_memory = measure(lambda vector, exclude: index.query(vector, args.k, exclude),
+                        [query(number) for number in range(args.queries)])
+    scan = measure(lambda vector, exclude: orm_scan(vector, args.k, exclude),
+                   [query(number) for number in range(args.scans)])
+
+    print("{} tracks, {} similar per lookup".format(args.tracks, args.k))
+    print("filling the db:  {:10.1f} ms".format(fill_time * 1000))
+    print("loading matrix:  {:10.1f} ms".format(load_time * 1000))
+    print("building index:  {:10.1f} ms".format(build_time * 1000))
+    print("                 {:>10} {:>10}".format("p50 ms", "p99 ms"))
+    print("index lookup:    {:10.2f} {:10.2f}".format(*in_memory))
+    print("ORM scan:        {:10.2f} {:10.2f}".format(*scan))
+
+
+if __name__ == "__main__":
+    main()
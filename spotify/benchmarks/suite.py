@@ -0,0 +1,261 @@
+"""
+Micro-benchmarks of album ingestion, album features, the selectors and
+the template renders, over catalogues of growing size.
+
+Spotify is answered in process by ``benchmarks.fake_spotify``, with no
+latency. The catalogue grows in one in-memory db from one size to the
+next. The results are written as JSON and, given a baseline written by
+an earlier run on the same machine, compared with it: a benchmark whose
+median is slower by more than ``--threshold`` fails the run::
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json --tracks 1000 100000
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks import setup_django
+from benchmarks.fake_spotify import Catalogue, route
+
+ALBUM_TRACKS = 60
+TRACKS_PER_ALBUM = 10
+# Changes smaller than this are noise whatever the threshold.
+MIN_DELTA_MS = 0.2
+
+# Every ingestion collects a new album, across all catalogue sizes.
+ingested_albums = itertools.count()
+
+
+class SuiteCatalogue(Catalogue):
+    """
+    Albums of ``ALBUM_TRACKS`` tracks, so every ingestion does the same work.
+    """
+
+    def album_track_ids(self, album_id):
+        return ["{}-{}".format(album_id, number) for number in range(ALBUM_TRACKS)]
+
+
+def mocked_api(catalogue):
+    """
+    Stand-in for ``tasks.app_requests_url`` answering from the catalogue.
+    """
+    def app_requests_url(url, endpoint=None):
+        parts = urlsplit(url)
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        _, answer = route(catalogue, parts.path, query)
+        return answer()
+    return app_requests_url
+
+
+def fill_catalogue(start, end, batch_size=10000):
+    """
+    Add the tracks numbered from start to end, in albums of
+    ``TRACKS_PER_ALBUM`` tracks with their features, ten albums per artist.
+    """
+    from spotify_app.models import FEATURES_NAMES, Album, Artist, Track
+    from spotify_app.services import reconcile_albums_features
+
+    rng = random.Random(start)
+    through = Album.tracks.through
+    for batch_start in range(start, end, batch_size):
+        numbers = range(batch_start, min(batch_start + batch_size, end))
+        album_numbers = range(numbers[0] // TRACKS_PER_ALBUM, (numbers[-1] // TRACKS_PER_ALBUM) + 1)
+        Artist.objects.bulk_create([
+            Artist(id="suite-artist-{}".format(number), name="Artist {}".format(number))
+            for number in sorted({album // 10 for album in album_numbers})
+        ], ignore_conflicts=True)
+        Album.objects.bulk_create([
+            Album(id="suite-album-{}".format(number), name="Album {}".format(number),
+                  artist_id="suite-artist-{}".format(number // 10), artist_name="Artist {}".format(number // 10),
+                  image="https://i.scdn.co/image/suite")
+            for number in album_numbers
+        ], ignore_conflicts=True)
+        Track.objects.bulk_create([
+            Track(
+                id="suite-track-{}".format(number),
+                name="Track {}".format(number),
+                artist_id="suite-artist-{}".format(number // TRACKS_PER_ALBUM // 10),
+                artist_name="Artist {}".format(number // TRACKS_PER_ALBUM // 10),
+                **{name: rng.randint(0, 1000) / 1000 for name in FEATURES_NAMES}
+            )
+            for number in numbers
+        ])
+        through.objects.bulk_create([
+            through(album_id="suite-album-{}".format(number // TRACKS_PER_ALBUM),
+                    track_id="suite-track-{}".format(number))
+            for number in numbers
+        ])
+    # The through rows went in without signals, the sums are set in one go.
+    reconcile_albums_features(fix=True)
+
+
+def build_benchmarks():
+    """
+    Return the benchmarks by name, as functions timed one call at a time.
+    """
+    from django.template.loader import render_to_string
+
+    from spotify_app import tasks
+    from spotify_app.models import Album
+    from spotify_app.selectors import get_album_details, get_albums_table, get_tracks_table
+    from spotify_app.services import create_album_tracks_and_features, update_albums_totals
+
+    request = SimpleNamespace(session={"access_token": "suite"})
+    album = Album.objects.prefetch_related("tracks").get(id="suite-album-0")
+    track_ids = [track.id for track in album.tracks.all()]
+
+    def ingest_album():
+        create_album_tracks_and_features(request, "ingested-{}".format(next(ingested_albums)))
+
+    def album_features_totals():
+        # Tracks taken away from the album's sums and added back.
+        update_albums_totals([album.id], track_ids, sign=-1)
+        update_albums_totals([album.id], track_ids, sign=1)
+
+    def album_details():
+        details = get_album_details(request, album.id)
+        list(details["tracks"])
+        return details
+
+    def tracks_table(sort, direction=None):
+        def page():
+            table = get_tracks_table(sort=sort, direction=direction)
+            list(table["tracks"])
+            return table
+        return page
+
+    def albums_table():
+        table = get_albums_table(sort="valence", direction="desc")
+        list(table["albums"])
+        return table
+
+    details = album_details()
+    table = tracks_table("name")()
+
+    benchmarks = {
+        "ingest_album": ingest_album,
+        "album_features_totals": album_features_totals,
+        "album_details": album_details,
+        "tracks_table_by_name": tracks_table("name"),
+        "tracks_table_by_energy_desc": tracks_table("energy", "desc"),
+        "albums_table_by_valence_desc": albums_table,
+        "render_album_content": lambda: render_to_string("album_content.html", details),
+        "render_tracks_table": lambda: render_to_string("tracks_table.html", table),
+    }
+    api = mocked_api(SuiteCatalogue())
+    patches = [
+        patch.object(tasks, "app_requests_url", api),
+        patch.object(tasks, "cached_requests_url", api),
+    ]
+    return benchmarks, patches
+
+
+def time_calls(function, repeat):
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "repeat": repeat,
+    }
+
+
+def run(sizes, repeat, only=None):
+    results = {}
+    filled = 0
+    for size in sorted(sizes):
+        fill_catalogue(filled, size)
+        filled = size
+        benchmarks, patches = build_benchmarks()
+        results[str(size)] = {}
+        for mocked in patches:
+            mocked.start()
+        try:
+            for name, function in benchmarks.items():
+                if only and name not in only:
+                    continue
+                result = results[str(size)][name] = time_calls(function, repeat)
+                print("{:>9} {:<30} {:>10.3f} ms".format(size, name, result["median_ms"]), flush=True)
+        finally:
+            for mocked in patches:
+                mocked.stop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print every benchmark against the baseline and return the regressions.
+    """
+    regressions = []
+    print("\n{:>9} {:<30} {:>12} {:>12} {:>8}".format("tracks", "benchmark", "median ms", "baseline ms", "change"))
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            median, base = result["median_ms"], before["median_ms"]
+            change = median / base - 1 if base else 0
+            regressed = change > threshold and median - base > MIN_DELTA_MS
+            if regressed:
+                regressions.append((size, name, change))
+            print("{:>9} {:<30} {:>12.3f} {:>12.3f} {:>+7.0%}{}".format(
+                size, name, median, base, change, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="catalogue sizes, in tracks")
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per benchmark")
+    parser.add_argument("--only", nargs="+", help="names of the benchmarks to run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="slow-down of the median, as a fraction, counted as a regression")
+    args = parser.parse_args()
+
+    # Read before the run, the output may replace it.
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+
+    setup_django()
+    import django
+
+    results = run(args.tracks, args.repeat, args.only)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "machine": platform.platform(),
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "results": results,
+            }, output, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n{} benchmark(s) slower than the baseline by more than {:.0%}".format(
+                len(regressions), args.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
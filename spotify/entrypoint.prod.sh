@@ -11,4 +11,7 @@ then
     echo "PostgreSQL started"
 fi
 
+# The default cache backend keeps its entries in this table; a no-op once it exists.
+python manage.py createcachetable
+
 exec "$@"
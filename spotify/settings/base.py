@@ -33,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "spotify_app.middleware.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -40,14 +41,19 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "spotify_app.middleware.SpotifyRateLimitedMiddleware",
 ]
 
+# The toolbar middleware is sync-only, outside of DEBUG it would force
+# every request under ASGI into a thread.
+if DEBUG:
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = "spotify_project.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "spotify_app.instrumentation.DjangoTemplates",
         "DIRS": [os.path.join(BASE_DIR, "templates")],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -63,6 +69,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "spotify_project.wsgi.application"
+ASGI_APPLICATION = "spotify_project.asgi.application"
 
 
 # Database
@@ -80,6 +87,33 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Shared by all workers, the table is made with `manage.py createcachetable`.
+# It holds Spotify responses, rendered pages, tokens, the rate limiter and
+# counters. Django's db, file and locmem caches drop 1/CACHE_CULL_FREQUENCY
+# of their keys once they hold CACHE_MAX_ENTRIES, so the limit is set well
+# above what the catalogue needs; memcached takes no such options.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "spotify_cache"),
+    }
+}
+if "memcached" not in CACHES["default"]["BACKEND"]:
+    CACHES["default"]["OPTIONS"] = {
+        "MAX_ENTRIES": int(os.environ.get("CACHE_MAX_ENTRIES", default=200000)),
+        "CULL_FREQUENCY": int(os.environ.get("CACHE_CULL_FREQUENCY", default=10)),
+    }
+
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -134,3 +168,108 @@ logging.config.dictConfig(
         "loggers": {'spotify_app': {"level": "DEBUG", "handlers": ["console"]}, },
     }
 )
+
+
+# Spotify API HTTP client
+# Connections are pooled per worker process and kept alive between calls.
+# The hosts are only changed to load test against benchmarks.fake_spotify.
+
+SPOTIFY_API_BASE_URL = os.environ.get("SPOTIFY_API_BASE_URL", default="https://api.spotify.com")
+SPOTIFY_ACCOUNTS_BASE_URL = os.environ.get("SPOTIFY_ACCOUNTS_BASE_URL", default="https://accounts.spotify.com")
+
+SPOTIFY_HTTP_POOL_SIZE = int(os.environ.get("SPOTIFY_HTTP_POOL_SIZE", default=10))
+SPOTIFY_HTTP_CONNECT_TIMEOUT = float(os.environ.get("SPOTIFY_HTTP_CONNECT_TIMEOUT", default=3.05))
+SPOTIFY_HTTP_READ_TIMEOUT = float(os.environ.get("SPOTIFY_HTTP_READ_TIMEOUT", default=10))
+SPOTIFY_HTTP_RETRIES = int(os.environ.get("SPOTIFY_HTTP_RETRIES", default=3))
+SPOTIFY_HTTP_BACKOFF_FACTOR = float(os.environ.get("SPOTIFY_HTTP_BACKOFF_FACTOR", default=0.3))
+
+# Maximum number of independent Spotify requests run at the same time
+# while ingesting an album.
+SPOTIFY_FETCH_CONCURRENCY = int(os.environ.get("SPOTIFY_FETCH_CONCURRENCY", default=8))
+
+# Async client used by the views served under ASGI (spotify_project/asgi.py).
+# A single event loop keeps many upstream calls in flight at once.
+SPOTIFY_ASYNC_VIEWS = int(os.environ.get("SPOTIFY_ASYNC_VIEWS", default=0))
+SPOTIFY_ASYNC_HTTP_POOL_SIZE = int(os.environ.get("SPOTIFY_ASYNC_HTTP_POOL_SIZE", default=100))
+
+# Seconds for which Spotify responses are served from the cache, per endpoint.
+# Afterwards they are revalidated with If-None-Match / If-Modified-Since for
+# another SPOTIFY_CACHE_STALE_TTL seconds before being dropped.
+SPOTIFY_CACHE_TTL = {
+    "new_releases": 60 * 60,
+    "search": 60 * 60,
+    "artist": 6 * 60 * 60,
+    "artist_albums": 6 * 60 * 60,
+    "album": 24 * 60 * 60,
+}
+SPOTIFY_CACHE_STALE_TTL = int(os.environ.get("SPOTIFY_CACHE_STALE_TTL", default=7 * 24 * 60 * 60))
+
+# Token bucket shared by all workers for requests to Spotify: requests per
+# second, burst size, the longest a request may wait for its slot, the
+# random delay added after a 429 Retry-After and how many 429s a request
+# retries before giving up. Its state lives in the default cache: on the db
+# cache a reservation costs a few queries and workers may race for a slot,
+# point the cache at memcached when many workers call Spotify.
+SPOTIFY_RATE_LIMIT = float(os.environ.get("SPOTIFY_RATE_LIMIT", default=10))
+SPOTIFY_RATE_LIMIT_BURST = int(os.environ.get("SPOTIFY_RATE_LIMIT_BURST", default=20))
+SPOTIFY_RATE_LIMIT_MAX_WAIT = float(os.environ.get("SPOTIFY_RATE_LIMIT_MAX_WAIT", default=10))
+SPOTIFY_RATE_LIMIT_JITTER = float(os.environ.get("SPOTIFY_RATE_LIMIT_JITTER", default=1))
+SPOTIFY_RATE_LIMIT_RETRIES = int(os.environ.get("SPOTIFY_RATE_LIMIT_RETRIES", default=2))
+
+# Background ingestion of albums and tracks missing from the db: how many
+# times a job is tried, seconds before the first retry (doubled on every
+# next one), the longest a single run may take and how often an idle
+# worker looks for new jobs.
+SPOTIFY_INGESTION_MAX_ATTEMPTS = int(os.environ.get("SPOTIFY_INGESTION_MAX_ATTEMPTS", default=3))
+SPOTIFY_INGESTION_RETRY_DELAY = float(os.environ.get("SPOTIFY_INGESTION_RETRY_DELAY", default=10))
+SPOTIFY_INGESTION_TIME_LIMIT = int(os.environ.get("SPOTIFY_INGESTION_TIME_LIMIT", default=300))
+SPOTIFY_INGESTION_POLL_INTERVAL = float(os.environ.get("SPOTIFY_INGESTION_POLL_INTERVAL", default=1))
+
+# Only one worker at a time collects a given album/track: the lease it
+# holds expires after this many seconds if the worker dies, the others
+# wait at most SPOTIFY_INGESTION_WAIT seconds for its result.
+SPOTIFY_INGESTION_LEASE = int(os.environ.get("SPOTIFY_INGESTION_LEASE", default=SPOTIFY_INGESTION_TIME_LIMIT + 60))
+SPOTIFY_INGESTION_WAIT = float(os.environ.get("SPOTIFY_INGESTION_WAIT", default=30))
+
+# Similar tracks are looked up in memory, over the audio features of every
+# track. Tracks collected since are read in at most this many seconds later.
+SPOTIFY_SIMILAR_TRACKS_REFRESH = float(os.environ.get("SPOTIFY_SIMILAR_TRACKS_REFRESH", default=30))
+SPOTIFY_SIMILAR_TRACKS_DEFAULT = int(os.environ.get("SPOTIFY_SIMILAR_TRACKS_DEFAULT", default=10))
+SPOTIFY_SIMILAR_TRACKS_MAX = int(os.environ.get("SPOTIFY_SIMILAR_TRACKS_MAX", default=50))
+
+# Catalogue exports are read from the db and written out this many rows
+# at a time, whatever their size.
+SPOTIFY_EXPORT_CHUNK_SIZE = int(os.environ.get("SPOTIFY_EXPORT_CHUNK_SIZE", default=2000))
+
+# Albums, or batches of tracks, collected at the same time by
+# `manage.py ingest`.
+SPOTIFY_INGEST_CONCURRENCY = int(os.environ.get("SPOTIFY_INGEST_CONCURRENCY", default=4))
+
+# Rendered album and track details are cached for this many seconds and
+# dropped as soon as the album/track changes. One worker renders a missing
+# page at a time: it holds the lease for at most SPOTIFY_FRAGMENT_LEASE
+# seconds, the others wait at most SPOTIFY_FRAGMENT_WAIT seconds for it.
+SPOTIFY_FRAGMENT_TTL = int(os.environ.get("SPOTIFY_FRAGMENT_TTL", default=24 * 60 * 60))
+SPOTIFY_FRAGMENT_LEASE = int(os.environ.get("SPOTIFY_FRAGMENT_LEASE", default=10))
+SPOTIFY_FRAGMENT_WAIT = float(os.environ.get("SPOTIFY_FRAGMENT_WAIT", default=2))
+
+# Seconds for which browsers, and nginx for the tables, reuse a page
+# before asking again with If-None-Match / If-Modified-Since.
+SPOTIFY_TABLES_MAX_AGE = int(os.environ.get("SPOTIFY_TABLES_MAX_AGE", default=60))
+SPOTIFY_DETAILS_MAX_AGE = int(os.environ.get("SPOTIFY_DETAILS_MAX_AGE", default=300))
+
+# Spotify access tokens last an hour; they are refreshed this many seconds
+# before they expire, so the session can outlive them (SESSION_COOKIE_AGE).
+# One request refreshes a token at a time: it holds the lease for at most
+# SPOTIFY_TOKEN_REFRESH_LEASE seconds, the others wait at most
+# SPOTIFY_TOKEN_REFRESH_WAIT seconds for the new token.
+SESSION_COOKIE_AGE = int(os.environ.get("SESSION_COOKIE_AGE", default=14 * 24 * 60 * 60))
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.environ.get("SPOTIFY_TOKEN_REFRESH_MARGIN", default=300))
+SPOTIFY_TOKEN_REFRESH_LEASE = int(os.environ.get("SPOTIFY_TOKEN_REFRESH_LEASE", default=10))
+SPOTIFY_TOKEN_REFRESH_WAIT = float(os.environ.get("SPOTIFY_TOKEN_REFRESH_WAIT", default=5))
+
+# Every request is timed: SQL queries, Spotify calls, template renders and
+# total, sent back in a Server-Timing header and logged. The totals of each
+# view are kept by every worker process and served on /metrics/ in the
+# Prometheus text format.
+SPOTIFY_REQUEST_TIMING = int(os.environ.get("SPOTIFY_REQUEST_TIMING", default=1))
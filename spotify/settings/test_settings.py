@@ -6,3 +6,9 @@ DATABASES = {
         'NAME': ':memory:',
     }
 }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -0,0 +1,338 @@
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.db.models import ExpressionWrapper, F, IntegerField
+
+from .models import FEATURES_NAMES, Album, Track
+
+# Rows saved by transactions which committed late are picked up by reading
+# again everything saved this long before the last refresh.
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def raw_features():
+    # The stored thousandths, without turning every value into a Decimal.
+    return {
+        "raw_" + name: ExpressionWrapper(F(name), output_field=IntegerField())
+        for name in FEATURES_NAMES
+    }
+
+
+class FeatureMatrix:
+    """
+    Audio features of every track in one float32 array.
+
+    Row ``i`` of ``values`` holds the features of track ``ids[i]`` in the
+    order of FEATURES_NAMES. The first use loads every track with features
+    in one streaming query; ``refresh()`` then reads only the tracks and
+    albums saved since the previous refresh. ``load()`` starts over, which
+    also drops deleted tracks.
+    """
+
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = []
+        self.index = {}
+        self.values = np.empty((0, len(FEATURES_NAMES)), dtype=np.float32)
+        self.albums = {}
+        self._album_groups = None
+        self._tracks_until = None
+        self._albums_until = None
+        self._refreshed_at = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self):
+        with self._lock:
+            self._reset()
+            self._refresh()
+        return self
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+        return self
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.refresh()
+        return self
+
+    def refresh_if_older(self, seconds):
+        """
+        Refresh unless the last refresh is less than ``seconds`` old.
+        """
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= seconds:
+            self.refresh()
+        return self
+
+    def _refresh(self):
+        self._refresh_tracks()
+        self._refresh_albums()
+        self._refreshed_at = time.monotonic()
+        self.loaded = True
+
+    def _refresh_tracks(self):
+        tracks = Track.objects.filter(danceability__isnull=False)
+        if self._tracks_until is not None:
+            tracks = tracks.filter(updated_at__gte=self._tracks_until - REFRESH_OVERLAP)
+        rows = tracks.annotate(**raw_features()).values_list("id", "updated_at", *raw_features())
+
+        ids, chunks, chunk, until = [], [], [], self._tracks_until
+        for track_id, updated_at, *features in rows.iterator(chunk_size=self.chunk_size):
+            ids.append(track_id)
+            chunk.append(features)
+            if until is None or updated_at > until:
+                until = updated_at
+            if len(chunk) == self.chunk_size:
+                chunks.append(np.array(chunk, dtype=np.float32))
+                chunk = []
+        chunks.append(np.array(chunk, dtype=np.float32).reshape(-1, len(FEATURES_NAMES)))
+        new_values = np.concatenate(chunks) / np.float32(1000)
+
+        known = [self.index.get(track_id) for track_id in ids]
+        updated = [number for number, row in enumerate(known) if row is not None]
+        added = [number for number, row in enumerate(known) if row is None]
+
+        # Readers keep the arrays they got, so changes go to copies.
+        values = self.values.copy() if updated else self.values
+        if updated:
+            values[[known[number] for number in updated]] = new_values[updated]
+        if added:
+            for number in added:
+                self.index[ids[number]] = len(self.ids)
+                self.ids.append(ids[number])
+            values = np.concatenate([values, new_values[added]])
+            self._album_groups = None
+        self.values = values
+        self._tracks_until = until
+
+    def _refresh_albums(self):
+        albums = Album.objects.all()
+        if self._albums_until is not None:
+            albums = albums.filter(updated_at__gte=self._albums_until - REFRESH_OVERLAP)
+        memberships = (
+            Album.tracks.through.objects
+            .filter(album__in=albums.values("id"))
+            .values_list("album_id", "track_id", "album__updated_at")
+            .order_by("album_id")
+        )
+
+        changed, until = {}, self._albums_until
+        for album_id, track_id, updated_at in memberships.iterator(chunk_size=self.chunk_size):
+            changed.setdefault(album_id, []).append(track_id)
+            if until is None or updated_at > until:
+                until = updated_at
+        if changed:
+            self.albums.update(changed)
+            self._album_groups = None
+        self._albums_until = until
+
+    def _groups(self):
+        """
+        Album ids, plus the album number and the track row of every album
+        track with features.
+        """
+        if self._album_groups is None:
+            album_ids, album_numbers, track_rows = [], [], []
+            for album_id, track_ids in self.albums.items():
+                rows = [self.index[track_id] for track_id in track_ids if track_id in self.index]
+                if rows:
+                    album_numbers.extend([len(album_ids)] * len(rows))
+                    track_rows.extend(rows)
+                    album_ids.append(album_id)
+            self._album_groups = (
+                album_ids,
+                np.array(album_numbers, dtype=np.intp),
+                np.array(track_rows, dtype=np.intp),
+            )
+        return self._album_groups
+
+    def as_dict(self, vector):
+        return {name: float(value) for name, value in zip(FEATURES_NAMES, vector)}
+
+    def vector(self, track_id):
+        row = self.index.get(track_id)
+        return None if row is None else self.values[row]
+
+    def rows(self, track_ids):
+        return np.array([self.index[track_id] for track_id in track_ids if track_id in self.index], dtype=np.intp)
+
+    def column_means(self):
+        return self.values.mean(axis=0)
+
+    def column_min(self):
+        return self.values.min(axis=0)
+
+    def column_max(self):
+        return self.values.max(axis=0)
+
+    def stats(self):
+        """
+        Count, mean, min and max of every feature over all tracks.
+        """
+        if not len(self):
+            return {"count": 0}
+        return {
+            "count": len(self),
+            "mean": self.as_dict(self.column_means()),
+            "min": self.as_dict(self.column_min()),
+            "max": self.as_dict(self.column_max()),
+        }
+
+    def zscores(self, track_ids=None):
+        """
+        Standard scores of the tracks' features against the whole catalogue.
+
+        A feature with the same value for every track scores 0.
+        """
+        values = self.values
+        std = values.std(axis=0)
+        std[std == 0] = 1
+        if track_ids is not None:
+            values = values[self.rows(track_ids)]
+        return (values - self.column_means()) / std
+
+    def album_means(self):
+        """
+        Mean features of every album over its tracks with features.
+        """
+        album_ids, album_numbers, track_rows = self._groups()
+        if not album_ids:
+            return {}
+        counts = np.bincount(album_numbers, minlength=len(album_ids))
+        sums = np.zeros((len(album_ids), len(FEATURES_NAMES)), dtype=np.float64)
+        np.add.at(sums, album_numbers, self.values[track_rows])
+        means = (sums / counts[:, None]).astype(np.float32)
+        return dict(zip(album_ids, means))
+
+
+class NearestTracks:
+    """
+    Nearest tracks by audio features, over the rows of a FeatureMatrix.
+
+    The tracks are split, on the median of their widest feature, into
+    leaves of at most ``leaf_size`` tracks stored next to each other. A
+    query visits the leaves in order of the distance to their bounding
+    box and stops once no leaf left can hold a closer track, so it reads
+    a few leaves instead of the whole catalogue.
+
+    ``sync()`` picks up the rows the matrix added or changed since the
+    leaves were built. They are searched one by one alongside the leaves
+    until they reach ``rebuild_ratio`` of the indexed tracks, then the
+    leaves are built again.
+    """
+
+    def __init__(self, matrix, leaf_size=1024, rebuild_ratio=0.05):
+        self.matrix = matrix
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self._lock = threading.Lock()
+        self._synced = None
+        self._built = None
+        self._state = None
+
+    def sync(self):
+        with self._lock:
+            values = self.matrix.values
+            if values is self._synced:
+                return self
+            built = self._built
+            if built is None:
+                self._build(values)
+            else:
+                changed = np.flatnonzero((values[:len(built)] != built).any(axis=1))
+                pending = np.concatenate([changed, np.arange(len(built), len(values))])
+                if len(pending) > self.rebuild_ratio * len(built):
+                    self._build(values)
+                else:
+                    _, points, rows, starts, ends, low, high, _, _ = self._state
+                    stale = np.zeros(len(built), dtype=bool)
+                    stale[changed] = True
+                    self._state = (values, points, rows, starts, ends, low, high, stale[rows], pending)
+            self._synced = values
+        return self
+
+    def _build(self, values):
+        rows = np.arange(len(values), dtype=np.intp)
+        leaves = []
+        stack = [(0, len(values))]
+        while stack:
+            start, end = stack.pop()
+            if end - start <= self.leaf_size:
+                if end > start:
+                    leaves.append((start, end))
+                continue
+            part = values[rows[start:end]]
+            dim = np.argmax(part.max(axis=0) - part.min(axis=0))
+            middle = (end - start) // 2
+            rows[start:end] = rows[start:end][np.argpartition(part[:, dim], middle)]
+            stack.extend([(start, start + middle), (start + middle, end)])
+
+        points = values[rows]
+        starts = np.array([start for start, _ in leaves], dtype=np.intp)
+        ends = np.array([end for _, end in leaves], dtype=np.intp)
+        if leaves:
+            low = np.array([points[start:end].min(axis=0) for start, end in leaves])
+            high = np.array([points[start:end].max(axis=0) for start, end in leaves])
+        else:
+            low = high = np.empty((0, values.shape[1]), dtype=np.float32)
+        stale = np.zeros(len(values), dtype=bool)
+        pending = np.empty(0, dtype=np.intp)
+        self._state = (values, points, rows, starts, ends, low, high, stale, pending)
+        self._built = values
+
+    def query(self, vector, k=10, exclude=()):
+        """
+        Return the ``k`` tracks closest to ``vector`` as (id, distance)
+        pairs, closest first, leaving out the ids in ``exclude``.
+        """
+        if self._state is None:
+            self.sync()
+        values, points, rows, starts, ends, low, high, stale, pending = self._state
+        ids = self.matrix.ids
+        vector = np.asarray(vector, dtype=np.float32)
+        wanted = k + len(exclude)
+
+        # Pending rows are searched first, so the leaves start pruning
+        # with their distances already known.
+        best = ((values[pending] - vector) ** 2).sum(axis=1)
+        best_rows, best = self._closest(pending, best, wanted)
+
+        gaps = np.maximum(low - vector, 0) + np.maximum(vector - high, 0)
+        bounds = (gaps ** 2).sum(axis=1)
+        for leaf in np.argsort(bounds):
+            if len(best) == wanted and bounds[leaf] > best.max():
+                break
+            start, end = starts[leaf], ends[leaf]
+            distances = ((points[start:end] - vector) ** 2).sum(axis=1)
+            fresh = ~stale[start:end]
+            best_rows, best = self._closest(
+                np.concatenate([best_rows, rows[start:end][fresh]]),
+                np.concatenate([best, distances[fresh]]),
+                wanted,
+            )
+
+        order = np.argsort(best, kind="stable")
+        exclude = set(exclude)
+        nearest = [(ids[row], float(np.sqrt(best[number]))) for number, row in zip(order, best_rows[order])]
+        return [(track_id, distance) for track_id, distance in nearest if track_id not in exclude][:k]
+
+    @staticmethod
+    def _closest(rows, distances, k):
+        if len(distances) <= k:
+            return rows, distances
+        keep = np.argpartition(distances, k - 1)[:k]
+        return rows[keep], distances[keep]
+
+
+feature_matrix = FeatureMatrix()
+nearest_tracks = NearestTracks(feature_matrix)
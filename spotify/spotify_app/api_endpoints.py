@@ -4,12 +4,13 @@
 import base64
 import json
 import os
-
-import requests
+import time
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
+from .client import spotify_client
+
 
 # API Credentials
 mykeys_file = os.path.join(settings.BASE_DIR, "mykeys.json")
@@ -24,9 +25,9 @@ BASE64 = base64.b64encode(bytes(client_id + ":" + client_secret, "ascii"))
 BASE64 = BASE64.decode("ascii")
 
 # Spotify URLS
-SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
-SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
-SPOTIFY_API_BASE_URL = "https://api.spotify.com"
+SPOTIFY_AUTH_URL = "{}/authorize".format(settings.SPOTIFY_ACCOUNTS_BASE_URL)
+SPOTIFY_TOKEN_URL = "{}/api/token".format(settings.SPOTIFY_ACCOUNTS_BASE_URL)
+SPOTIFY_API_BASE_URL = settings.SPOTIFY_API_BASE_URL
 API_VERSION = "v1"
 
 # Server-side Parameters
@@ -58,6 +59,34 @@ def user_context(request):  # pragma: no cover
     return ctx
 
 
+class TokenRequestError(Exception):
+    """
+    Spotify refused to give an access token.
+    """
+
+
+def request_token(payload):
+    """
+    Send a grant to the token endpoint and return its answer, with the
+    ``expires_at`` time of the access token added.
+    """
+    headers = {"Authorization": "Basic {}".format(BASE64)}
+    post_request = spotify_client.post(SPOTIFY_TOKEN_URL, data=payload, headers=headers)
+    response_data = json.loads(post_request.text)
+    if post_request.status_code != 200 or "access_token" not in response_data:
+        raise TokenRequestError(response_data.get("error", post_request.status_code))
+    response_data["expires_at"] = time.time() + response_data["expires_in"]
+    return response_data
+
+
+def save_token_to_session(session, token):
+    # Spotify may keep the refresh token and leave it out of the answer.
+    session["access_token"] = token["access_token"]
+    if token.get("refresh_token"):
+        session["refresh_token"] = token["refresh_token"]
+    session["token_expires_at"] = token["expires_at"]
+
+
 def save_access_token_to_client_session(request):
 
     # get token from URL
@@ -68,16 +97,10 @@ def save_access_token_to_client_session(request):
         "code": auth_token,
         "redirect_uri": REDIRECT_URI,
     }
-    headers = {"Authorization": "Basic {}".format(BASE64)}
-    post_request = requests.post(
-        SPOTIFY_TOKEN_URL, data=code_payload, headers=headers
-    )
-    response_data = json.loads(post_request.text)
 
-    # save token to session
-    request.session["access_token"] = response_data["access_token"]
-    request.session["refresh_token"] = response_data["refresh_token"]
-    request.session.set_expiry(response_data["expires_in"])
+    # save token to session, which lives for SESSION_COOKIE_AGE: the token
+    # is refreshed when it expires
+    save_token_to_session(request.session, request_token(code_payload))
 
 
 SPOTIFY_API_URL = "{}/{}".format(SPOTIFY_API_BASE_URL, API_VERSION)
@@ -95,10 +118,19 @@ API_ENDPOINTS = dict(
         ("new_releases", "{}/{}/{}".format(SPOTIFY_API_URL, "browse", "new-releases")),
         # https://api.spotify.com/v1/albums/{id}
         ("album", "{}/{}/".format(SPOTIFY_API_URL, "albums")),
+        # https://api.spotify.com/v1/albums/{id}/tracks
+        (
+            "album_tracks",
+            ("{}/albums/".format(SPOTIFY_API_URL), "/tracks?limit=50&offset="),
+        ),
         # https://api.spotify.com/v1/tracks/{id}
         ("track", "{}/{}/".format(SPOTIFY_API_URL, "tracks")),
+        # https://api.spotify.com/v1/tracks?ids={ids}
+        ("several_tracks", "{}/tracks?ids=".format(SPOTIFY_API_URL)),
         # https://api.spotify.com/v1/audio-features/{id}
         ("track_audio_feature", "{}/audio-features/".format(SPOTIFY_API_URL)),
+        # https://api.spotify.com/v1/audio-features?ids={ids}
+        ("several_audio_features", "{}/audio-features?ids=".format(SPOTIFY_API_URL)),
         # https://api.spotify.com/v1/search
         ("search", ("{}/search?q=".format(SPOTIFY_API_URL), "&type=artist")),
         # https://api.spotify.com/v1/artists/{id}
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SpotifyAppConfig(AppConfig):
     name = 'spotify_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,133 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .api_endpoints import API_ENDPOINTS
+from .client import async_spotify_client
+from .tokens import TokenRefused, app_token, forget_token, token_manager
+from .tasks import (
+    SEVERAL_AUDIO_FEATURES_LIMIT,
+    SEVERAL_TRACKS_LIMIT,
+    authorization_headers,
+    bearer_headers,
+    chunked,
+    lookup_cached_response,
+    revalidation_headers,
+    update_cached_response
+)
+
+# Async versions of the functions in tasks.py, used by the views served
+# under ASGI. Independent requests are sent at the same time.
+
+
+async def get_response(request, url, headers=None):
+    resp = await async_spotify_client.get(url, headers=await sync_to_async(authorization_headers)(request, headers))
+    if resp.status_code == 401 and await sync_to_async(token_manager.refresh)(request.session):
+        resp = await async_spotify_client.get(url, headers=await sync_to_async(authorization_headers)(request, headers))
+    if resp.status_code == 401:
+        await sync_to_async(forget_token)(request.session)
+        raise TokenRefused(url)
+    return resp
+
+
+async def get_app_response(url, headers=None):
+    access_token = await sync_to_async(app_token.get)()
+    resp = await async_spotify_client.get(url, headers=bearer_headers(access_token, headers))
+    if resp.status_code == 401:
+        access_token = await sync_to_async(app_token.get)(stale_token=access_token)
+        resp = await async_spotify_client.get(url, headers=bearer_headers(access_token, headers))
+    return resp
+
+
+async def requests_url(request, url):
+    resp = await get_response(request, url)
+    return resp.json()
+
+
+async def app_requests_url(url):
+    resp = await get_app_response(url)
+    return resp.json()
+
+
+async def cached_requests_url(url, endpoint):
+    ttl = settings.SPOTIFY_CACHE_TTL.get(endpoint)
+    if not ttl:
+        return await app_requests_url(url)
+
+    entry, fresh = await sync_to_async(lookup_cached_response)(url)
+    if fresh:
+        return entry["data"]
+    resp = await get_app_response(url, revalidation_headers(entry))
+    return await sync_to_async(update_cached_response)(url, ttl, entry, resp)
+
+
+async def get_new_releases(request):
+    url = API_ENDPOINTS["new_releases"]
+    results = await cached_requests_url(url, "new_releases")
+    return results["albums"]["items"]
+
+
+async def get_user_recently_played(request):
+    url = API_ENDPOINTS["user_recently_played"]
+    results = await requests_url(request, url)
+    return [item["track"] for item in results["items"]]
+
+
+async def get_album(request, album_id):
+    url = API_ENDPOINTS["album"] + album_id
+    return await cached_requests_url(url, "album")
+
+
+async def get_album_tracks(request, album_id, offset):
+    url = API_ENDPOINTS["album_tracks"][0] + album_id + API_ENDPOINTS["album_tracks"][1] + str(offset)
+    results = await app_requests_url(url)
+    return results["items"]
+
+
+async def get_track(request, track_id):
+    url = API_ENDPOINTS["track"] + track_id
+    return await app_requests_url(url)
+
+
+async def get_track_audio_features(request, track_id):
+    url = API_ENDPOINTS["track_audio_feature"] + track_id
+    return await app_requests_url(url)
+
+
+async def get_several_tracks(request, track_ids):
+    results = await asyncio.gather(*[
+        app_requests_url(API_ENDPOINTS["several_tracks"] + ",".join(chunk))
+        for chunk in chunked(track_ids, SEVERAL_TRACKS_LIMIT)
+    ])
+    return [track for result in results for track in result["tracks"] if track]
+
+
+async def get_several_tracks_audio_features(request, track_ids):
+    results = await asyncio.gather(*[
+        app_requests_url(API_ENDPOINTS["several_audio_features"] + ",".join(chunk))
+        for chunk in chunked(track_ids, SEVERAL_AUDIO_FEATURES_LIMIT)
+    ])
+    return [features for result in results for features in result["audio_features"] if features]
+
+
+async def get_search_results(request, searching):
+    url = API_ENDPOINTS["search"][0] + searching + API_ENDPOINTS["search"][1]
+    results = await cached_requests_url(url, "search")
+    artists = results['artists']['items']
+    found_total = results['artists']['total']
+    return artists, found_total
+
+
+async def get_artist(request, artist_id):
+    url = API_ENDPOINTS['artist'] + artist_id
+    return await cached_requests_url(url, "artist")
+
+
+async def get_artist_and_albums(request, artist_id):
+    url = API_ENDPOINTS["artist_albums"][0] + artist_id + API_ENDPOINTS["artist_albums"][1]
+    artist, results = await asyncio.gather(
+        get_artist(request, artist_id),
+        cached_requests_url(url, "artist_albums"),
+    )
+    return artist['name'], results["items"]
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import threading
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from .instrumentation import spotify_call
+from .ratelimit import SpotifyRateLimited, rate_limiter
+
+
+class SpotifyClient:
+    """
+    Process-wide HTTP client for the Spotify Web API.
+
+    Keeps one ``requests.Session`` per worker process, so connections
+    to api.spotify.com stay open between calls instead of paying a TLS
+    handshake every time. The session is rebuilt after a fork, so gunicorn
+    workers never share sockets with the master process.
+
+    With a ``rate_limiter`` every request waits for its slot first, and
+    a 429 answer blocks all workers for its ``Retry-After`` before the
+    request is tried again.
+
+    ``requests_sent`` counts the GET requests sent by this process.
+    """
+
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=10, timeout=(3.05, 10), retries=3, backoff_factor=0.3,
+                 rate_limiter=None, throttle_retries=2):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = rate_limiter
+        self.throttle_retries = throttle_retries
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._count_lock = threading.Lock()
+        self.requests_sent = 0
+
+    def _count_request(self):
+        with self._count_lock:
+            self.requests_sent += 1
+
+    def _build_session(self):
+        retry = Retry(
+            total=self.retries,
+            status_forcelist=self.RETRY_STATUSES,
+            backoff_factor=self.backoff_factor,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def session(self):
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._build_session()
+                    self._pid = pid
+        return self._session
+
+    def get(self, url, headers=None, **kwargs):
+        with spotify_call():
+            return self._get(url, headers, **kwargs)
+
+    def _get(self, url, headers=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        if self.rate_limiter is None:
+            self._count_request()
+            return self.session.get(url, headers=headers, **kwargs)
+
+        for _ in range(self.throttle_retries + 1):
+            self.rate_limiter.acquire()
+            self._count_request()
+            resp = self.session.get(url, headers=headers, **kwargs)
+            if resp.status_code != 429:
+                return resp
+            retry_after = self.rate_limiter.throttled(resp.headers.get("Retry-After"))
+        raise SpotifyRateLimited(retry_after)
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        with spotify_call():
+            return self.session.post(url, data=data, headers=headers, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+
+class AsyncSpotifyClient:
+    """
+    Async counterpart of ``SpotifyClient`` for the views served under ASGI.
+
+    Keeps one ``httpx.AsyncClient`` per event loop, so a worker running
+    a single loop shares its pool of keep-alive connections between all
+    requests in flight. The client is closed in its loop when the loop
+    shuts down its async generators, as ``asyncio.run`` does before
+    closing it; under WSGI each request runs in a loop of its own, so
+    it gets a client of its own too. Responses with a 5xx status are
+    retried and the rate limiter is used the same way as in the sync
+    client.
+    """
+
+    RETRY_STATUSES = SpotifyClient.RETRY_STATUSES
+
+    def __init__(self, pool_size=100, timeout=(3.05, 10), retries=3, backoff_factor=0.3,
+                 rate_limiter=None, throttle_retries=2, transport=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.rate_limiter = rate_limiter
+        self.throttle_retries = throttle_retries
+        self.transport = transport
+        self._clients = {}
+
+    def _build_client(self):
+        connect_timeout, read_timeout = self.timeout
+        transport = self.transport or httpx.AsyncHTTPTransport(
+            retries=self.retries,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            ),
+        )
+        return httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def get_client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            client = self._build_client()
+            closer = self._close_with_loop(client)
+            # Started, the generator is closed by loop.shutdown_asyncgens().
+            await closer.__anext__()
+            self._clients[loop] = (client, closer)
+        return self._clients[loop][0]
+
+    async def _close_with_loop(self, client):
+        try:
+            yield
+        finally:
+            self._clients.pop(asyncio.get_running_loop(), None)
+            await client.aclose()
+
+    async def get(self, url, headers=None):
+        with spotify_call():
+            return await self._get(url, headers)
+
+    async def _get(self, url, headers=None):
+        attempt = throttled = 0
+        while True:
+            if self.rate_limiter is not None:
+                wait = await sync_to_async(self.rate_limiter.reserve)()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            resp = await (await self.get_client()).get(url, headers=headers)
+
+            if resp.status_code == 429 and self.rate_limiter is not None:
+                retry_after = await sync_to_async(self.rate_limiter.throttled)(resp.headers.get("Retry-After"))
+                throttled += 1
+                if throttled > self.throttle_retries:
+                    raise SpotifyRateLimited(retry_after)
+            elif resp.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+                attempt += 1
+            else:
+                return resp
+
+    async def close(self):
+        """
+        Close the client of the running loop.
+        """
+        entry = self._clients.get(asyncio.get_running_loop())
+        if entry is not None:
+            await entry[1].aclose()
+
+
+spotify_client = SpotifyClient(
+    pool_size=settings.SPOTIFY_HTTP_POOL_SIZE,
+    timeout=(settings.SPOTIFY_HTTP_CONNECT_TIMEOUT, settings.SPOTIFY_HTTP_READ_TIMEOUT),
+    retries=settings.SPOTIFY_HTTP_RETRIES,
+    backoff_factor=settings.SPOTIFY_HTTP_BACKOFF_FACTOR,
+    rate_limiter=rate_limiter,
+    throttle_retries=settings.SPOTIFY_RATE_LIMIT_RETRIES,
+)
+
+async_spotify_client = AsyncSpotifyClient(
+    pool_size=settings.SPOTIFY_ASYNC_HTTP_POOL_SIZE,
+    timeout=(settings.SPOTIFY_HTTP_CONNECT_TIMEOUT, settings.SPOTIFY_HTTP_READ_TIMEOUT),
+    retries=settings.SPOTIFY_HTTP_RETRIES,
+    backoff_factor=settings.SPOTIFY_HTTP_BACKOFF_FACTOR,
+    rate_limiter=rate_limiter,
+    throttle_retries=settings.SPOTIFY_RATE_LIMIT_RETRIES,
+)
@@ -1,10 +1,29 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import redirect
 
+from .tokens import TokenRefused, token_manager
+
 
 def token_validation(function):
     def wrap(request, *args, **kwargs):
-        if 'access_token' not in request.session:
+        if 'access_token' not in request.session or not token_manager.ensure_fresh(request.session):
             return redirect('callback')
-        else:
+        try:
             return function(request, *args, **kwargs)
+        except TokenRefused:
+            return redirect('callback')
+    return wrap
+
+
+def async_token_validation(function):
+    async def wrap(request, *args, **kwargs):
+        if (
+            not await sync_to_async(request.session.__contains__)('access_token')
+            or not await sync_to_async(token_manager.ensure_fresh)(request.session)
+        ):
+            return redirect('callback')
+        try:
+            return await function(request, *args, **kwargs)
+        except TokenRefused:
+            return redirect('callback')
     return wrap
@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+from .analytics import raw_features
+from .models import FEATURES_NAMES, Album, Track
+
+# Columns read for every kind of export, with the names they get in it.
+EXPORTS = {
+    "tracks": (Track, ("id", "name", "artist_id", "artist__name")),
+    "albums": (Album, ("id", "name", "artist_id", "artist__name", "image")),
+}
+EXPORT_FORMATS = ("csv", "ndjson")
+
+
+class ExportFilterError(Exception):
+    """
+    Filters of an export which cannot be applied.
+    """
+
+
+def export_header(kind):
+    _, columns = EXPORTS[kind]
+    return [column.replace("__name", "") for column in columns] + list(FEATURES_NAMES)
+
+
+def export_filters(params):
+    """
+    Turn ``artist`` and ``<feature>_min`` / ``<feature>_max`` parameters
+    into queryset filters.
+    """
+    filters = {}
+    if params.get("artist"):
+        filters["artist_id"] = params["artist"]
+    for name in FEATURES_NAMES:
+        for bound, lookup in (("min", "gte"), ("max", "lte")):
+            param = f"{name}_{bound}"
+            if params.get(param) in (None, ""):
+                continue
+            try:
+                value = Decimal(params[param])
+            except InvalidOperation:
+                raise ExportFilterError(f"{param} is not a number.")
+            if not 0 <= value <= 1:
+                raise ExportFilterError(f"{param} is not between 0 and 1.")
+            filters[f"{name}__{lookup}"] = value
+    return filters
+
+
+def export_rows(kind, filters, chunk_size=None):
+    """
+    Yield the matching rows as tuples, features in thousandths, reading
+    ``chunk_size`` of them from the db at a time.
+    """
+    model, columns = EXPORTS[kind]
+    rows = (
+        model.objects
+        .filter(**filters)
+        .annotate(**raw_features())
+        .values_list(*columns, *raw_features())
+        .order_by("id")
+    )
+    return rows.iterator(chunk_size=chunk_size or settings.SPOTIFY_EXPORT_CHUNK_SIZE)
+
+
+def thousandths(value):
+    return "" if value is None else "%d.%03d" % divmod(value, 1000)
+
+
+def stream_csv(kind, rows, batch_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_header(kind))
+    features_start = len(EXPORTS[kind][1])
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row[:features_start] + tuple(map(thousandths, row[features_start:])))
+        if number % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(kind, rows, batch_size):
+    header = export_header(kind)
+    features_start = len(EXPORTS[kind][1])
+    lines = []
+    for row in rows:
+        features = [None if value is None else value / 1000 for value in row[features_start:]]
+        lines.append(json.dumps(dict(zip(header, row[:features_start] + tuple(features)))))
+        if len(lines) == batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def export_catalogue(kind, export_format, filters, chunk_size=None):
+    """
+    Return the content type and the chunks of the export, made while they
+    are read so only one batch of rows is in memory at a time.
+    """
+    chunk_size = chunk_size or settings.SPOTIFY_EXPORT_CHUNK_SIZE
+    rows = export_rows(kind, filters, chunk_size)
+    if export_format == "csv":
+        return "text/csv", stream_csv(kind, rows, chunk_size)
+    return "application/x-ndjson", stream_ndjson(kind, rows, chunk_size)
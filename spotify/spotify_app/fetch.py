@@ -0,0 +1,89 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connection
+
+from .ratelimit import SpotifyRateLimited
+
+LOG = logging.getLogger(__name__)
+
+
+class FetchError(Exception):
+    """
+    One or more of the concurrent Spotify requests failed.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        details = ", ".join("{}: {!r}".format(key, exc) for key, exc in errors.items())
+        super().__init__("{} Spotify request(s) failed ({})".format(len(errors), details))
+
+
+def _call(function, args):
+    """
+    Run a call in a worker thread, which is done with its db connection
+    once the call returns.
+    """
+    try:
+        return function(*args)
+    finally:
+        connection.close()
+
+
+def _collect(outcomes):
+    """
+    Sort the outcomes, functions returning or raising the result under
+    their key, into the results and the errors.
+    """
+    results, errors = {}, {}
+    for key, outcome in outcomes.items():
+        try:
+            results[key] = outcome()
+        except Exception as exc:
+            errors[key] = exc
+    return results, errors
+
+
+def _fetch_serially(calls):
+    return _collect({key: partial(function, *args) for key, (function, args) in calls.items()})
+
+
+def _fetch_in_threads(calls, max_workers):
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as executor:
+        futures = {
+            key: executor.submit(contextvars.copy_context().run, _call, function, args)
+            for key, (function, args) in calls.items()
+        }
+    return _collect({key: future.result for key, future in futures.items()})
+
+
+def fetch_concurrently(calls, max_workers=None):
+    """
+    Run independent Spotify requests at the same time.
+
+    ``calls`` maps a key to a ``(function, args)`` pair and the results
+    are returned under the same keys. At most ``max_workers`` requests
+    (SPOTIFY_FETCH_CONCURRENCY by default) are in flight at once. Every
+    call runs to completion before failures are raised together as
+    a single ``FetchError``, or as ``SpotifyRateLimited`` with the longest
+    wait when Spotify throttled any of them. The calls see the context
+    variables of the caller, so they are timed in its request.
+    """
+    if max_workers is None:
+        max_workers = settings.SPOTIFY_FETCH_CONCURRENCY
+    if max_workers <= 1 or len(calls) <= 1:
+        results, errors = _fetch_serially(calls)
+    else:
+        results, errors = _fetch_in_threads(calls, max_workers)
+
+    if errors:
+        LOG.warning("%s of %s Spotify requests failed", len(errors), len(calls))
+        retry_after = [exc.retry_after for exc in errors.values() if isinstance(exc, SpotifyRateLimited)]
+        if retry_after:
+            # The 503 page and the worker's next try wait for Retry-After.
+            raise SpotifyRateLimited(max(retry_after)) from FetchError(errors)
+        raise FetchError(errors)
+    return results
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.safestring import mark_safe
+
+from .models import CatalogueVersion
+from .singleflight import SingleFlight, SingleFlightTimeout
+
+FRAGMENT_PREFIX = "spotify:fragment:"
+FRAGMENT_STATS_PREFIX = "spotify:fragment-stats:"
+FRAGMENT_STATS = ("hits", "misses", "timeouts")
+
+# Bump whenever the fragment templates or their context change, so pages
+# cached by the previous code are not served any more.
+FRAGMENT_VERSION = 1
+
+fragment_flight = SingleFlight(
+    "spotify:fragment-lease:",
+    lease=settings.SPOTIFY_FRAGMENT_LEASE,
+    wait=settings.SPOTIFY_FRAGMENT_WAIT,
+    poll_interval=0.05,
+)
+
+
+def fragment_key(kind, object_id):
+    return f"{FRAGMENT_PREFIX}v{FRAGMENT_VERSION}:{kind}:{object_id}"
+
+
+def count_fragment_event(name):
+    key = FRAGMENT_STATS_PREFIX + name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_fragment_stats():
+    stats = cache.get_many([FRAGMENT_STATS_PREFIX + name for name in FRAGMENT_STATS])
+    return {name: stats.get(FRAGMENT_STATS_PREFIX + name, 0) for name in FRAGMENT_STATS}
+
+
+def cached_fragment(kind, object_id, render):
+    """
+    Return the rendered HTML of the album/track, from the cache when it is
+    there.
+
+    ``render()`` returns the HTML, or None when there is nothing to cache
+    yet. Only one worker at a time renders a missing fragment, the others
+    wait for it; a worker which waits for too long renders it itself.
+    """
+    key = fragment_key(kind, object_id)
+    html = cache.get(key)
+    if html is not None:
+        count_fragment_event("hits")
+        return mark_safe(html)
+
+    def build():
+        count_fragment_event("misses")
+        html = render()
+        if html is not None:
+            cache.set(key, html, settings.SPOTIFY_FRAGMENT_TTL)
+        return html
+
+    try:
+        html = fragment_flight.do(key, build, ready=lambda: cache.get(key))
+    except SingleFlightTimeout:
+        count_fragment_event("timeouts")
+        html = render()
+    return None if html is None else mark_safe(html)
+
+
+def invalidate_fragments(kind, object_ids):
+    """
+    Drop the cached fragments of the albums/tracks.
+
+    They are dropped again once the transaction commits, so a page
+    rendered from the old rows in between does not stay cached.
+    """
+    keys = [fragment_key(kind, object_id) for object_id in object_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_catalogue_version():
+    """
+    Counter of the changes to the stored catalogue which leave no newer
+    ``updated_at`` behind: deleted rows and renamed artists.
+    """
+    return CatalogueVersion.objects.filter(pk=1).values_list("version", flat=True).first() or 0
+
+
+def bump_catalogue_version():
+    """
+    Count a change, in the transaction making it. Kept in the db, the
+    cache may drop it and hand out an ETag of a stale table again.
+    """
+    if not CatalogueVersion.objects.filter(pk=1).update(version=F("version") + 1):
+        _, created = CatalogueVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+        if not created:
+            CatalogueVersion.objects.filter(pk=1).update(version=F("version") + 1)
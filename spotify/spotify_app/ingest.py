@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+from django.db import connection
+
+from . import services
+from .client import spotify_client
+from .models import Album, Track
+from .tasks import SEVERAL_TRACKS_LIMIT, chunked
+
+LOG = logging.getLogger(__name__)
+
+ALBUMS = "albums"
+TRACKS = "tracks"
+EXISTING_LOOKUP_SIZE = 1000
+
+
+def parse_id(line):
+    """
+    Return the Spotify id in a line holding an id, a ``spotify:album:<id>``
+    URI or an open.spotify.com link, None for blank and ``#`` lines.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    return line.split("?")[0].rstrip("/").replace(":", "/").rsplit("/", 1)[-1]
+
+
+def read_ids(lines):
+    """
+    Ids in the order they come, each only once.
+    """
+    ids = (parse_id(line) for line in lines)
+    return list(dict.fromkeys(object_id for object_id in ids if object_id))
+
+
+def missing_ids(kind, ids):
+    """
+    Leave out the ids already in the db.
+    """
+    model = Album if kind == ALBUMS else Track
+    existing = set()
+    for chunk in chunked(ids, EXISTING_LOOKUP_SIZE):
+        existing.update(model.objects.filter(id__in=chunk).values_list("id", flat=True))
+    return [object_id for object_id in ids if object_id not in existing]
+
+
+class Checkpoint:
+    """
+    File listing the ids already ingested, one per line.
+
+    Ids are appended as soon as they are saved, so an interrupted run
+    started again skips them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as checkpoint:
+                self.done = {line.strip() for line in checkpoint if line.strip()}
+
+    def mark(self, ids):
+        self.done.update(ids)
+        if not self.path:
+            return
+        with open(self.path, "a") as checkpoint:
+            checkpoint.writelines(object_id + "\n" for object_id in ids)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+
+
+class IngestStats:
+    """
+    Throughput of a bulk ingestion: ids done, Spotify requests sent and
+    db rows written per second since ``start``.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.ids = 0
+        self.failed = 0
+        self.rows = 0
+        self._lock = threading.Lock()
+        self._requests_start = spotify_client.requests_sent
+        self._start = time.monotonic()
+
+    def count_rows(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper in every worker thread.
+        result = execute(sql, params, many, context)
+        if sql.lstrip()[:6].upper() in ("INSERT", "UPDATE"):
+            with self._lock:
+                self.rows += max(context["cursor"].rowcount, 0)
+        return result
+
+    @property
+    def api_calls(self):
+        return spotify_client.requests_sent - self._requests_start
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._start, 1e-9)
+        return (
+            f"{self.ids}/{self.total} ids, {self.failed} failed, "
+            f"{self.ids / elapsed:.1f} ids/s, {self.api_calls / elapsed:.1f} API calls/s, "
+            f"{self.rows / elapsed:.1f} db rows/s"
+        )
+
+
+def ingest_batch(kind, request, ids, stats):
+    with connection.execute_wrapper(stats.count_rows):
+        try:
+            if kind == ALBUMS:
+                services.get_or_create_album(request, ids[0])
+            else:
+                services.create_tracks_and_features(request, ids)
+        finally:
+            # Worker threads do not outlive the run, nor should their connections.
+            connection.close()
+
+
+def ingest(kind, ids, checkpoint, concurrency=4, report=None, report_interval=5):
+    """
+    Collect from Spotify the albums/tracks with the given ids which are
+    neither in the db nor in the checkpoint.
+
+    Albums are collected one per worker thread, tracks in batches as big
+    as a single Spotify request allows, with at most ``concurrency``
+    batches at a time. ``report`` is called with the stats every
+    ``report_interval`` seconds and at the end. Returns the stats and the
+    errors by id; failed ids stay out of the checkpoint.
+    """
+    ids = missing_ids(kind, [object_id for object_id in ids if object_id not in checkpoint.done])
+    batches = [[object_id] for object_id in ids] if kind == ALBUMS else list(chunked(ids, SEVERAL_TRACKS_LIMIT))
+    # Catalogue calls are sent with the app token, no visitor's token is needed.
+    request = SimpleNamespace(session={})
+    stats = IngestStats(len(ids))
+    errors = {}
+
+    reported = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        batches = iter(batches)
+        running = {}
+        while True:
+            while len(running) < concurrency * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                running[executor.submit(ingest_batch, kind, request, batch, stats)] = batch
+            if not running:
+                break
+
+            finished, _ = wait(running, timeout=report_interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                batch = running.pop(future)
+                stats.ids += len(batch)
+                try:
+                    future.result()
+                except Exception as exc:
+                    LOG.warning("Ingesting %s %s failed: %r", kind, ", ".join(batch), exc)
+                    stats.failed += len(batch)
+                    errors.update(dict.fromkeys(batch, exc))
+                else:
+                    checkpoint.mark(batch)
+
+            if report is not None and time.monotonic() - reported >= report_interval:
+                report(stats)
+                reported = time.monotonic()
+
+    if report is not None:
+        report(stats)
+    return stats, errors
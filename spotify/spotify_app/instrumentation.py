@@ -0,0 +1,228 @@
+"""
+Where a request spends its time: SQL queries, Spotify calls and template
+renders, timed while ``RequestTimingMiddleware`` has a request open, and
+their per-view totals in the Prometheus text format.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates
+from django.template.backends.django import Template, reraise
+
+# Upper bounds, in seconds, of the buckets of the request duration histogram.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Counters served next to the histogram, by view: (name, help, attribute).
+VIEW_COUNTERS = (
+    ("db_queries_total", "SQL queries run.", "db_queries"),
+    ("db_seconds_total", "Time spent in SQL queries.", "db_time"),
+    ("spotify_calls_total", "Calls to the Spotify API.", "spotify_calls"),
+    ("spotify_seconds_total", "Time spent waiting for the Spotify API.", "spotify_time"),
+    ("template_seconds_total", "Time spent rendering templates.", "template_time"),
+)
+METRICS_PREFIX = "spotify_app_"
+
+_current = contextvars.ContextVar("spotify_request_timings", default=None)
+
+
+class RequestTimings:
+    """
+    What one request spent, in seconds, and its number of SQL queries and
+    Spotify calls. Shared with the threads of ``fetch_concurrently``, so
+    the time of calls made at the same time adds up.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.total = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.spotify_calls = 0
+        self.spotify_time = 0.0
+        self.template_time = 0.0
+        self.rendering = False
+        self._lock = threading.Lock()
+
+    def add_query(self, duration):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += duration
+
+    def add_spotify_call(self, duration):
+        with self._lock:
+            self.spotify_calls += 1
+            self.spotify_time += duration
+
+    def server_timing(self):
+        """
+        Value of the Server-Timing header, durations in milliseconds.
+        """
+        return ", ".join([
+            'db;dur={:.1f};desc="{} queries"'.format(self.db_time * 1000, self.db_queries),
+            'spotify;dur={:.1f};desc="{} calls"'.format(self.spotify_time * 1000, self.spotify_calls),
+            "template;dur={:.1f}".format(self.template_time * 1000),
+            "total;dur={:.1f}".format(self.total * 1000),
+        ])
+
+
+def start_request():
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def finish_request():
+    """
+    Stop timing the open request and return its timings, or None.
+    """
+    timings = _current.get()
+    if timings is not None:
+        _current.set(None)
+        timings.total = time.perf_counter() - timings.start
+    return timings
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper, counting the queries of the open request.
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(time.perf_counter() - start)
+
+
+def install_query_timer(connection):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@contextmanager
+def spotify_call():
+    """
+    Count the Spotify call made in the block, waits for the rate limiter
+    and retries included, in the open request.
+    """
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_spotify_call(time.perf_counter() - start)
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        # Templates rendered while rendering another are in its time already.
+        if timings is None or timings.rendering:
+            return super().render(context, request)
+        timings.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timings.template_time += time.perf_counter() - start
+            timings.rendering = False
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """
+    The Django template backend, with the renders timed.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ViewMetrics:
+    """
+    Totals of the timed requests of this process, by view.
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def _new_totals(self):
+        totals = {attribute: 0 for _, _, attribute in VIEW_COUNTERS}
+        totals.update(buckets=[0] * (len(self.buckets) + 1), count=0, sum=0.0, responses={})
+        return totals
+
+    def record(self, view, status, timings):
+        with self._lock:
+            totals = self._views.get(view)
+            if totals is None:
+                totals = self._views[view] = self._new_totals()
+            totals["buckets"][bisect.bisect_left(self.buckets, timings.total)] += 1
+            totals["count"] += 1
+            totals["sum"] += timings.total
+            totals["responses"][status] = totals["responses"].get(status, 0) + 1
+            for _, _, attribute in VIEW_COUNTERS:
+                totals[attribute] += getattr(timings, attribute)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def exposition(self):
+        """
+        The totals in the Prometheus text format.
+        """
+        with self._lock:
+            views = {
+                view: dict(totals, buckets=list(totals["buckets"]), responses=dict(totals["responses"]))
+                for view, totals in sorted(self._views.items())
+            }
+
+        name = METRICS_PREFIX + "request_duration_seconds"
+        lines = [
+            "# HELP {} Time to answer a request.".format(name),
+            "# TYPE {} histogram".format(name),
+        ]
+        for view, totals in views.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), totals["buckets"]):
+                cumulative += count
+                lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(name, _label(view), bound, cumulative))
+            lines.append('{}_sum{{view="{}"}} {!r}'.format(name, _label(view), totals["sum"]))
+            lines.append('{}_count{{view="{}"}} {}'.format(name, _label(view), totals["count"]))
+
+        name = METRICS_PREFIX + "responses_total"
+        lines += ["# HELP {} Responses sent, by status.".format(name), "# TYPE {} counter".format(name)]
+        for view, totals in views.items():
+            for status, count in sorted(totals["responses"].items()):
+                lines.append('{}{{view="{}",status="{}"}} {}'.format(name, _label(view), status, count))
+
+        for counter, help_text, attribute in VIEW_COUNTERS:
+            name = METRICS_PREFIX + counter
+            lines += ["# HELP {} {}".format(name, help_text), "# TYPE {} counter".format(name)]
+            for view, totals in views.items():
+                lines.append('{}{{view="{}"}} {!r}'.format(name, _label(view), totals[attribute]))
+        return "\n".join(lines) + "\n"
+
+
+view_metrics = ViewMetrics()
@@ -0,0 +1,155 @@
+import logging
+import signal
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import IngestionJob
+from .ratelimit import SpotifyRateLimited
+from .services import get_or_create_album, get_or_create_track
+
+LOG = logging.getLogger(__name__)
+
+# Extra time a claimed job stays locked after its time limit, before
+# another worker may assume the one running it is gone.
+LOCK_GRACE_PERIOD = 60
+
+
+class JobTimeout(Exception):
+    """
+    The job ran longer than SPOTIFY_INGESTION_TIME_LIMIT.
+    """
+
+
+def enqueue_ingestion(kind, object_id):
+    """
+    Queue the album or track to be collected by the worker.
+
+    Returns the job already queued for the object if there is one, a job
+    which failed or is done (but the object is gone) is queued again.
+    """
+    job, created = IngestionJob.objects.get_or_create(kind=kind, object_id=object_id)
+    if created or job.status not in (IngestionJob.DONE, IngestionJob.FAILED):
+        return job
+
+    changes = dict(status=IngestionJob.PENDING, attempts=0, error="", run_after=timezone.now())
+    IngestionJob.objects.filter(pk=job.pk).update(updated_at=timezone.now(), **changes)
+    for name, value in changes.items():
+        setattr(job, name, value)
+    return job
+
+
+def claim_job():
+    """
+    Take the next job due and lock it for this worker.
+
+    A running job whose lock expired is taken again too. Returns None
+    when there is nothing to do.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            IngestionJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=IngestionJob.PENDING, run_after__lte=now)
+                | Q(status=IngestionJob.RUNNING, locked_until__lt=now)
+            )
+            .order_by("run_after")
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = IngestionJob.RUNNING
+        job.attempts += 1
+        job.locked_until = now + timedelta(seconds=settings.SPOTIFY_INGESTION_TIME_LIMIT + LOCK_GRACE_PERIOD)
+        job.save(update_fields=["status", "attempts", "locked_until", "updated_at"])
+    return job
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Raise JobTimeout in the block after ``seconds``.
+
+    Relies on SIGALRM, so the limit only applies in the main thread of
+    the worker; elsewhere the expiring lock is the only limit.
+    """
+    if not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def timeout(signum, frame):
+        raise JobTimeout("Job exceeded the time limit of {}s".format(seconds))
+
+    previous = signal.signal(signal.SIGALRM, timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+JOB_HANDLERS = {
+    IngestionJob.ALBUM: get_or_create_album,
+    IngestionJob.TRACK: get_or_create_track,
+}
+
+
+def retry_delay(job, exc):
+    if isinstance(exc, SpotifyRateLimited):
+        return exc.retry_after
+    return settings.SPOTIFY_INGESTION_RETRY_DELAY * 2 ** (job.attempts - 1)
+
+
+def run_job(job):
+    """
+    Run a claimed job and record how it went.
+
+    A failed job is tried again later with a growing delay, until it
+    runs out of attempts.
+    """
+    # Catalogue calls are sent with the app token, no visitor's token is needed.
+    request = SimpleNamespace(session={})
+    try:
+        with time_limit(settings.SPOTIFY_INGESTION_TIME_LIMIT):
+            JOB_HANDLERS[job.kind](request, job.object_id)
+    except Exception as exc:
+        job.error = repr(exc)
+        if job.attempts < settings.SPOTIFY_INGESTION_MAX_ATTEMPTS:
+            job.status = IngestionJob.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=retry_delay(job, exc))
+            LOG.warning("Ingestion of %s failed, retrying: %r", job, exc)
+        else:
+            job.status = IngestionJob.FAILED
+            LOG.error("Ingestion of %s failed for good: %r", job, exc)
+    else:
+        job.status = IngestionJob.DONE
+        job.error = ""
+    job.locked_until = None
+    job.save(update_fields=["status", "error", "run_after", "locked_until", "updated_at"])
+    return job
+
+
+def run_next_job():
+    """
+    Claim and run one job, returns it or None when the queue is empty.
+    """
+    job = claim_job()
+    if job is None:
+        return None
+    if job.attempts > settings.SPOTIFY_INGESTION_MAX_ATTEMPTS:
+        # Its lock expired on every attempt, the worker running it died.
+        job.status = IngestionJob.FAILED
+        job.error = job.error or "Worker lost the job"
+        job.locked_until = None
+        job.save(update_fields=["status", "error", "locked_until", "updated_at"])
+        return job
+    return run_job(job)
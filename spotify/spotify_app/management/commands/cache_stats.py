@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from spotify_app.fragments import get_fragment_stats
+from spotify_app.ratelimit import get_rate_limit_stats
+from spotify_app.tasks import get_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show the counters of the Spotify response cache, the rate limiter and the page fragments cache."
+
+    def handle(self, *args, **options):
+        for title, stats in (
+            ("Spotify responses", get_cache_stats()),
+            ("Rate limiting", get_rate_limit_stats()),
+            ("Album and track pages", get_fragment_stats()),
+        ):
+            self.stdout.write(f"{title}: " + ", ".join(f"{name} {value}" for name, value in stats.items()))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from spotify_app.exports import EXPORT_FORMATS, EXPORTS, ExportFilterError, export_catalogue, export_filters
+from spotify_app.models import FEATURES_NAMES
+
+
+class Command(BaseCommand):
+    help = "Dump the stored tracks or albums as CSV or NDJSON, a chunk of rows at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(EXPORTS))
+        parser.add_argument("format", choices=EXPORT_FORMATS)
+        parser.add_argument("-o", "--output", help="File to write instead of the standard output.")
+        parser.add_argument("--artist", help="Only rows of the artist with this id.")
+        parser.add_argument(
+            "--min", nargs=2, action="append", default=[], metavar=("FEATURE", "VALUE"),
+            help=f"Only rows with the feature at least VALUE, one of: {', '.join(FEATURES_NAMES)}.",
+        )
+        parser.add_argument(
+            "--max", nargs=2, action="append", default=[], metavar=("FEATURE", "VALUE"),
+            help="Only rows with the feature at most VALUE.",
+        )
+        parser.add_argument("--chunk-size", type=int, help="Rows read from the db at a time.")
+
+    def handle(self, *args, **options):
+        params = {"artist": options["artist"]}
+        for bound in ("min", "max"):
+            for name, value in options[bound]:
+                if name not in FEATURES_NAMES:
+                    raise CommandError(f"Unknown feature {name}.")
+                params[f"{name}_{bound}"] = value
+        try:
+            filters = export_filters(params)
+        except ExportFilterError as exc:
+            raise CommandError(str(exc))
+
+        _, chunks = export_catalogue(options["kind"], options["format"], filters, options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
@@ -0,0 +1,53 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from spotify_app.ingest import ALBUMS, TRACKS, Checkpoint, ingest, read_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Collect from Spotify the albums or tracks with the ids listed in a file, or on stdin, "
+        "with the app's client-credentials token."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=[ALBUMS, TRACKS])
+        parser.add_argument("path", nargs="?", default="-", help="File with one id, URI or link per line.")
+        parser.add_argument(
+            "--checkpoint",
+            help="File listing the ids done, to resume from. <path>.checkpoint by default, none for stdin.",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=settings.SPOTIFY_INGEST_CONCURRENCY,
+            help="Albums, or batches of tracks, collected at the same time.",
+        )
+        parser.add_argument(
+            "--report-interval", type=float, default=5, help="Seconds between throughput reports.",
+        )
+
+    def handle(self, *args, **options):
+        if options["path"] == "-":
+            ids = read_ids(sys.stdin)
+            checkpoint_path = options["checkpoint"]
+        else:
+            with open(options["path"]) as lines:
+                ids = read_ids(lines)
+            checkpoint_path = options["checkpoint"] or options["path"] + ".checkpoint"
+        checkpoint = Checkpoint(checkpoint_path)
+
+        stats, errors = ingest(
+            options["kind"], ids, checkpoint,
+            concurrency=options["concurrency"],
+            report=lambda stats: self.stdout.write(stats.report()),
+            report_interval=options["report_interval"],
+        )
+        skipped = len(ids) - stats.total
+        self.stdout.write(f"Skipped {skipped} ids already collected.")
+        if errors:
+            self.stdout.write(self.style.WARNING(
+                f"{len(errors)} ids failed, run the command again to retry them."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Ingested {stats.ids} {options['kind']}."))
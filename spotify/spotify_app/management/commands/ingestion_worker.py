@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from spotify_app.jobs import run_next_job
+from spotify_app.models import IngestionJob
+
+
+class Command(BaseCommand):
+    help = "Collect the albums and tracks queued by the detail views."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Exit when the queue is empty instead of waiting for new jobs.",
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=settings.SPOTIFY_INGESTION_POLL_INTERVAL,
+            help="Seconds to wait before looking at an empty queue again.",
+        )
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                close_old_connections()
+                job = run_next_job()
+                if job is None:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                processed += 1
+                if job.status == IngestionJob.DONE:
+                    self.stdout.write(self.style.SUCCESS(f"Collected {job.kind} {job.object_id}."))
+                else:
+                    self.stdout.write(self.style.WARNING(
+                        f"Collecting {job.kind} {job.object_id} failed ({job.status}): {job.error}"
+                    ))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Processed {processed} jobs.")
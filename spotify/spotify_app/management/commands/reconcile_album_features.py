@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from spotify_app.services import reconcile_albums_features
+
+
+class Command(BaseCommand):
+    help = "Check the running feature sums of every album against its tracks and fix the drifted ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="only count the drifted albums")
+
+    def handle(self, *args, **options):
+        drifted = reconcile_albums_features(fix=not options["check"])
+        if options["check"]:
+            self.stdout.write(f"{drifted} albums drifted.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {drifted} drifted albums."))
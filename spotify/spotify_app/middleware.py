@@ -0,0 +1,58 @@
+import logging
+import math
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.shortcuts import render
+from django.utils.deprecation import MiddlewareMixin
+
+from .instrumentation import finish_request, start_request, view_metrics
+from .ratelimit import SpotifyRateLimited
+
+LOG = logging.getLogger(__name__)
+
+
+class RequestTimingMiddleware(MiddlewareMixin):
+    """
+    Time the SQL queries, Spotify calls and template renders of every
+    request. The timings go out in a Server-Timing header and a log line,
+    and are added to the view's totals served on /metrics/.
+    """
+
+    def __init__(self, get_response=None):
+        if not settings.SPOTIFY_REQUEST_TIMING:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_request(self, request):
+        start_request()
+
+    def process_response(self, request, response):
+        timings = finish_request()
+        if timings is None:
+            return response
+        # Unresolved paths are not labelled one by one, there is no end to them.
+        view = request.resolver_match.view_name if request.resolver_match else "unresolved"
+        response["Server-Timing"] = timings.server_timing()
+        view_metrics.record(view, response.status_code, timings)
+        LOG.info(
+            "request view=%s method=%s status=%s total_ms=%.1f db_queries=%d db_ms=%.1f "
+            "spotify_calls=%d spotify_ms=%.1f template_ms=%.1f",
+            view, request.method, response.status_code, timings.total * 1000, timings.db_queries,
+            timings.db_time * 1000, timings.spotify_calls, timings.spotify_time * 1000,
+            timings.template_time * 1000,
+        )
+        return response
+
+
+class SpotifyRateLimitedMiddleware(MiddlewareMixin):
+    """
+    Answer with 503 and Retry-After while Spotify is throttling us,
+    instead of a server error.
+    """
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, SpotifyRateLimited):
+            response = render(request, "rate_limited.html", status=503)
+            response["Retry-After"] = str(math.ceil(exception.retry_after))
+            return response
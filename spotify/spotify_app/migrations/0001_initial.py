@@ -0,0 +1,154 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Album',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, unique=True)),
+                ('name', models.CharField(max_length=128)),
+                ('image', models.URLField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AlbumFeatures',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Artist',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, unique=True)),
+                ('name', models.CharField(max_length=128)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Features',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('danceability', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('speechiness', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('acousticness', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('valence', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('instrumentalness', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('energy', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('liveness', models.DecimalField(decimal_places=3, max_digits=4)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('album', 'Album'), ('track', 'Track')], max_length=8)),
+                ('object_id', models.CharField(max_length=32)),
+                ('status', models.CharField(
+                    choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')],
+                    default='pending',
+                    max_length=8,
+                )),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('access_token', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.CharField(max_length=32, primary_key=True, serialize=False, unique=True)),
+                ('name', models.CharField(max_length=128)),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spotify_app.artist')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrackFeatures',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('features', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spotify_app.features')),
+                ('track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spotify_app.track')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ingestionjob',
+            index=models.Index(fields=['status', 'run_after'], name='ingestion_job_due_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingestionjob',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_ingestion_job'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['danceability', 'id'], name='features_danceability_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['speechiness', 'id'], name='features_speechiness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['acousticness', 'id'], name='features_acousticness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['valence', 'id'], name='features_valence_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['instrumentalness', 'id'], name='features_instrumentalness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['energy', 'id'], name='features_energy_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='features',
+            index=models.Index(fields=['liveness', 'id'], name='features_liveness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='artist',
+            index=models.Index(fields=['name'], name='artist_name_idx'),
+        ),
+        migrations.AddField(
+            model_name='albumfeatures',
+            name='album',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spotify_app.album'),
+        ),
+        migrations.AddField(
+            model_name='albumfeatures',
+            name='features',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spotify_app.features'),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='artist',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='spotify_app.artist'),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='tracks',
+            field=models.ManyToManyField(to='spotify_app.Track'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['name', 'id'], name='track_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['name', 'id'], name='album_name_idx'),
+        ),
+    ]
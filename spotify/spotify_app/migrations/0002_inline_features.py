@@ -0,0 +1,140 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:26
+
+from django.db import migrations, models
+import spotify_app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='acousticness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='danceability',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='energy',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='instrumentalness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='liveness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='speechiness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='valence',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='acousticness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='danceability',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='energy',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='instrumentalness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='liveness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='speechiness',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='valence',
+            field=spotify_app.models.FeatureField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['danceability', 'id'], name='album_danceability_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['speechiness', 'id'], name='album_speechiness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['acousticness', 'id'], name='album_acousticness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['valence', 'id'], name='album_valence_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['instrumentalness', 'id'], name='album_instrumentalness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['energy', 'id'], name='album_energy_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['liveness', 'id'], name='album_liveness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['danceability', 'id'], name='track_danceability_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['speechiness', 'id'], name='track_speechiness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['acousticness', 'id'], name='track_acousticness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['valence', 'id'], name='track_valence_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['instrumentalness', 'id'], name='track_instrumentalness_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['energy', 'id'], name='track_energy_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['liveness', 'id'], name='track_liveness_idx'),
+        ),
+    ]
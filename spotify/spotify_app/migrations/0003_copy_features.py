@@ -0,0 +1,61 @@
+from django.db import migrations
+
+FEATURES_NAMES = (
+    "danceability",
+    "speechiness",
+    "acousticness",
+    "valence",
+    "instrumentalness",
+    "energy",
+    "liveness",
+)
+BATCH_SIZE = 2000
+
+
+def copy_features(apps, schema_editor):
+    """
+    Move the features of every track and album onto its own row.
+    """
+    for model_name, link_name, owner in (
+        ("Track", "TrackFeatures", "track_id"),
+        ("Album", "AlbumFeatures", "album_id"),
+    ):
+        model = apps.get_model("spotify_app", model_name)
+        links = apps.get_model("spotify_app", link_name).objects.select_related("features").order_by("pk")
+
+        batch = []
+        for link in links.iterator(chunk_size=BATCH_SIZE):
+            obj = model(pk=getattr(link, owner))
+            for name in FEATURES_NAMES:
+                setattr(obj, name, getattr(link.features, name))
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                model.objects.bulk_update(batch, FEATURES_NAMES)
+                batch = []
+        model.objects.bulk_update(batch, FEATURES_NAMES)
+
+
+def restore_features(apps, schema_editor):
+    Features = apps.get_model("spotify_app", "Features")
+    for model_name, link_name, owner in (
+        ("Track", "TrackFeatures", "track_id"),
+        ("Album", "AlbumFeatures", "album_id"),
+    ):
+        model = apps.get_model("spotify_app", model_name)
+        link_model = apps.get_model("spotify_app", link_name)
+
+        objects = model.objects.exclude(danceability=None).only(*FEATURES_NAMES)
+        for obj in objects.iterator(chunk_size=BATCH_SIZE):
+            features = Features.objects.create(**{name: getattr(obj, name) for name in FEATURES_NAMES})
+            link_model.objects.create(features=features, **{owner: obj.pk})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0002_inline_features'),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_features, restore_features),
+    ]
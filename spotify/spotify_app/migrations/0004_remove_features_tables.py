@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0003_copy_features'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='albumfeatures',
+            name='album',
+        ),
+        migrations.RemoveField(
+            model_name='albumfeatures',
+            name='features',
+        ),
+        migrations.RemoveField(
+            model_name='trackfeatures',
+            name='features',
+        ),
+        migrations.RemoveField(
+            model_name='trackfeatures',
+            name='track',
+        ),
+        migrations.DeleteModel(
+            name='AlbumFeatures',
+        ),
+        migrations.DeleteModel(
+            name='Features',
+        ),
+        migrations.DeleteModel(
+            name='TrackFeatures',
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0005_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='acousticness_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='danceability_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='energy_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='features_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='instrumentalness_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='liveness_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='speechiness_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='valence_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
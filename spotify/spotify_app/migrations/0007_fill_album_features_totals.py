@@ -0,0 +1,50 @@
+from django.db import migrations
+from django.db.models import BigIntegerField, Count, Sum
+
+FEATURES_NAMES = (
+    "danceability",
+    "speechiness",
+    "acousticness",
+    "valence",
+    "instrumentalness",
+    "energy",
+    "liveness",
+)
+BATCH_SIZE = 2000
+
+
+def fill_totals(apps, schema_editor):
+    """
+    Count and sum the features of every album's tracks with one grouped query.
+    """
+    Album = apps.get_model("spotify_app", "Album")
+    totals = (
+        Album.tracks.through.objects
+        .filter(track__danceability__isnull=False)
+        .values("album")
+        .annotate(
+            features_count=Count("track"),
+            **{name + "_sum": Sum("track__" + name, output_field=BigIntegerField()) for name in FEATURES_NAMES}
+        )
+        .order_by("album")
+    )
+    fields = ["features_count"] + [name + "_sum" for name in FEATURES_NAMES]
+
+    batch = []
+    for row in totals.iterator(chunk_size=BATCH_SIZE):
+        batch.append(Album(pk=row.pop("album"), **row))
+        if len(batch) == BATCH_SIZE:
+            Album.objects.bulk_update(batch, fields)
+            batch = []
+    Album.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0006_album_features_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0007_fill_album_features_totals'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='ingestionjob',
+            name='access_token',
+        ),
+    ]
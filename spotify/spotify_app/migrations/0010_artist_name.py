@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:32
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_artist_names(apps, schema_editor):
+    """
+    Copy the name of every track's and album's artist with one update each.
+    """
+    Artist = apps.get_model("spotify_app", "Artist")
+    artist_name = Subquery(Artist.objects.filter(pk=OuterRef("artist_id")).values("name")[:1])
+    for model_name in ("Track", "Album"):
+        apps.get_model("spotify_app", model_name).objects.update(artist_name=artist_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spotify_app', '0009_catalogue_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='artist_name',
+            field=models.CharField(default='', max_length=128),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='artist_name',
+            field=models.CharField(default='', max_length=128),
+        ),
+        migrations.RunPython(copy_artist_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['artist_name', 'id'], name='album_artist_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='track',
+            index=models.Index(fields=['artist_name', 'id'], name='track_artist_name_idx'),
+        ),
+    ]
@@ -1,4 +1,91 @@
+from decimal import ROUND_HALF_UP, Decimal
+
 from django.db import models
+from django.utils import timezone
+
+FEATURES_NAMES = (
+    "danceability",
+    "speechiness",
+    "acousticness",
+    "valence",
+    "instrumentalness",
+    "energy",
+    "liveness",
+)
+FEATURES_SUMS = tuple(f"{name}_sum" for name in FEATURES_NAMES)
+
+
+class FeatureField(models.PositiveSmallIntegerField):
+    """
+    Audio feature in the range 0 to 1, three decimal places.
+
+    Stored as thousandths in a small integer, read as a ``Decimal`` like
+    the ``DecimalField(4, 3)`` it replaces.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        # Averages come back as floats.
+        return Decimal(round(value)).scaleb(-3)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        return Decimal(str(value)).quantize(Decimal("0.001"), ROUND_HALF_UP)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return int((Decimal(str(value)) * 1000).to_integral_value(ROUND_HALF_UP))
+
+
+class WithFeatures(models.Model):
+    """
+    Audio features of a track, or their average over an album's tracks.
+
+    Null until the features are known.
+    """
+
+    danceability = FeatureField(null=True)
+    speechiness = FeatureField(null=True)
+    acousticness = FeatureField(null=True)
+    valence = FeatureField(null=True)
+    instrumentalness = FeatureField(null=True)
+    energy = FeatureField(null=True)
+    liveness = FeatureField(null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def has_features(self):
+        return self.danceability is not None
+
+    @property
+    def get_fields_names(self):
+        return list(FEATURES_NAMES)
+
+    @property
+    def get_features(self):
+        dict_of_features = {
+            f: getattr(self, f) for f in self.get_fields_names
+        }
+        return dict_of_features
+
+    def get_features_for_chart(self):
+        if not self.has_features:
+            return []
+        return [int(feat.scaleb(2)) for feat in self.get_features.values()]
+
+
+def features_indexes(prefix):
+    # Catalogue tables are sorted by any feature, with the id breaking ties.
+    return [
+        models.Index(fields=[name, "id"], name=f"{prefix}_{name}_idx")
+        for name in FEATURES_NAMES
+    ]
 
 
 class Artist(models.Model):
@@ -9,11 +96,14 @@ class Artist(models.Model):
     id = models.CharField(max_length=32, primary_key=True, unique=True)
     name = models.CharField(max_length=128)
 
+    class Meta:
+        indexes = [models.Index(fields=["name"], name="artist_name_idx")]
+
     def __str__(self):
         return f"{self.name}"
 
 
-class Track(models.Model):
+class Track(WithFeatures):
     """
     Model for single track.
     """
@@ -21,12 +111,21 @@ class Track(models.Model):
     id = models.CharField(max_length=32, primary_key=True, unique=True)
     name = models.CharField(max_length=128)
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
+    # Copy of ``artist.name``, for the artist sort of the table to page
+    # through an index. Kept in step by spotify_app.signals.
+    artist_name = models.CharField(max_length=128, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["name", "id"], name="track_name_idx"),
+            models.Index(fields=["artist_name", "id"], name="track_artist_name_idx"),
+        ] + features_indexes("track")
 
     def __str__(self):
         return f"{self.name} - {self.artist.name}"
 
 
-class Album(models.Model):
+class Album(WithFeatures):
     """
     Model for single album.
     """
@@ -36,47 +135,80 @@ class Album(models.Model):
     image = models.URLField(null=True)
 
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
+    # See ``Track.artist_name``.
+    artist_name = models.CharField(max_length=128, default="")
     tracks = models.ManyToManyField(Track)
 
+    # Running totals behind the features: how many tracks have features
+    # and the sum of every feature over them, in thousandths. Kept in step
+    # with ``tracks`` by spotify_app.signals.
+    features_count = models.PositiveIntegerField(default=0)
+    danceability_sum = models.BigIntegerField(default=0)
+    speechiness_sum = models.BigIntegerField(default=0)
+    acousticness_sum = models.BigIntegerField(default=0)
+    valence_sum = models.BigIntegerField(default=0)
+    instrumentalness_sum = models.BigIntegerField(default=0)
+    energy_sum = models.BigIntegerField(default=0)
+    liveness_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["name", "id"], name="album_name_idx"),
+            models.Index(fields=["artist_name", "id"], name="album_artist_name_idx"),
+        ] + features_indexes("album")
+
     def __str__(self):
         return f"{self.name} - {self.artist.name}"
 
 
-class Features(models.Model):
+class CatalogueVersion(models.Model):
     """
-    additional features for track/albums
+    Single row counting the changes to the stored catalogue which leave
+    no newer ``updated_at`` behind: deleted rows and renamed artists.
     """
 
-    danceability = models.DecimalField(max_digits=4, decimal_places=3)
-    speechiness = models.DecimalField(max_digits=4, decimal_places=3)
-    acousticness = models.DecimalField(max_digits=4, decimal_places=3)
-    valence = models.DecimalField(max_digits=4, decimal_places=3)
-    instrumentalness = models.DecimalField(max_digits=4, decimal_places=3)
-    energy = models.DecimalField(max_digits=4, decimal_places=3)
-    liveness = models.DecimalField(max_digits=4, decimal_places=3)
+    version = models.PositiveBigIntegerField(default=0)
 
-    @property
-    def get_fields_names(self):
-        return [f.name for f in Features._meta.fields if f.name != 'id']
 
-    @property
-    def get_features(self):
-        dict_of_features = {
-            f: getattr(self, f) for f in self.get_fields_names
-        }
-        return dict_of_features
-
-    def get_features_for_chart(self):  # pragma: no cover
-        return [int(feat * 100) for feat in self.get_features.values()]
-
-
-class TrackFeatures(models.Model):
-
-    track = models.ForeignKey(Track, on_delete=models.CASCADE)
-    features = models.ForeignKey(Features, on_delete=models.CASCADE)
+class IngestionJob(models.Model):
+    """
+    Album or track to collect from Spotify in the background.
 
+    There is one job per object, so visitors hitting the same missing
+    album share the job. A worker claims it until ``locked_until``, after
+    which a job left behind by a dead worker is picked up again.
+    """
 
-class AlbumFeatures(models.Model):
+    ALBUM = "album"
+    TRACK = "track"
+    KINDS = ((ALBUM, "Album"), (TRACK, "Track"))
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    kind = models.CharField(max_length=8, choices=KINDS)
+    object_id = models.CharField(max_length=32)
+    status = models.CharField(max_length=8, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "object_id"], name="unique_ingestion_job"),
+        ]
+        indexes = [models.Index(fields=["status", "run_after"], name="ingestion_job_due_idx")]
 
-    album = models.ForeignKey(Album, on_delete=models.CASCADE)
-    features = models.ForeignKey(Features, on_delete=models.CASCADE)
+    def __str__(self):
+        return f"{self.kind} {self.object_id} ({self.status})"
@@ -0,0 +1,128 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+LOG = logging.getLogger(__name__)
+
+RATE_LIMIT_PREFIX = "spotify:ratelimit:"
+RATE_LIMIT_STATE_KEY = RATE_LIMIT_PREFIX + "state"
+RATE_LIMIT_STATS = ("requests", "throttled_responses", "throttled_ms")
+
+
+class SpotifyRateLimited(Exception):
+    """
+    Spotify keeps throttling us, or the wait for a free slot is too long.
+    """
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__("Spotify rate limit, retry after {:.1f}s".format(retry_after))
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all workers through the cache.
+
+    Implemented as a generic cell rate algorithm: the only state is the
+    time at which the bucket is empty again (``tat``), plus the time until
+    which Spotify told us to back off with a 429 ``Retry-After``. Every
+    outbound request reserves a slot and waits until its slot comes.
+
+    The state and the counters share one cache key, so a reservation is
+    a lock, one get and one set. The lock is best effort and the db cache
+    may cull the key, so slots, and counts, can be lost between workers;
+    memcached makes both atomic and cheap.
+    """
+
+    def __init__(self, rate, burst, max_wait, jitter):
+        self.interval = 1 / rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.jitter = jitter
+
+    @contextmanager
+    def _lock(self, attempts=50):
+        # cache.add is atomic, a lock left behind by a dead worker expires
+        # after a second; without the lock the reservation is best effort.
+        acquired = False
+        for _ in range(attempts):
+            acquired = cache.add(RATE_LIMIT_PREFIX + "lock", 1, timeout=1)
+            if acquired:
+                break
+            time.sleep(0.002)
+        try:
+            yield
+        finally:
+            if acquired:
+                cache.delete(RATE_LIMIT_PREFIX + "lock")
+
+    def reserve(self):
+        """
+        Reserve a slot for one request and return the seconds to wait for it.
+        """
+        with self._lock():
+            now = time.time()
+            state = cache.get(RATE_LIMIT_STATE_KEY) or {}
+            tat = max(state.get("tat", now), now)
+            start = max(now, tat - (self.burst - 1) * self.interval)
+
+            blocked_until = state.get("blocked_until", 0)
+            if blocked_until > start:
+                start = blocked_until + random.uniform(0, self.jitter)
+                tat = max(tat, start)
+
+            wait = start - now
+            if wait > self.max_wait:
+                raise SpotifyRateLimited(wait)
+            state["tat"] = tat + self.interval
+            _count(state, "requests")
+            if wait > 0:
+                _count(state, "throttled_ms", int(wait * 1000))
+            cache.set(RATE_LIMIT_STATE_KEY, state, None)
+        return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def throttled(self, retry_after):
+        """
+        Block every worker for the time given in a 429 ``Retry-After``.
+        """
+        try:
+            retry_after = float(retry_after)
+        except (TypeError, ValueError):
+            retry_after = 1.0
+        LOG.warning("Spotify rate limit hit, backing off for %ss", retry_after)
+
+        with self._lock():
+            state = cache.get(RATE_LIMIT_STATE_KEY) or {}
+            state["blocked_until"] = max(state.get("blocked_until", 0), time.time() + retry_after)
+            _count(state, "throttled_responses")
+            cache.set(RATE_LIMIT_STATE_KEY, state, None)
+        return retry_after
+
+
+def _count(state, name, value=1):
+    state[name] = state.get(name, 0) + value
+
+
+def get_rate_limit_stats():
+    """
+    Approximate counters of the rate limiter, see ``RateLimiter``.
+    """
+    state = cache.get(RATE_LIMIT_STATE_KEY) or {}
+    return {name: state.get(name, 0) for name in RATE_LIMIT_STATS}
+
+
+rate_limiter = RateLimiter(
+    rate=settings.SPOTIFY_RATE_LIMIT,
+    burst=settings.SPOTIFY_RATE_LIMIT_BURST,
+    max_wait=settings.SPOTIFY_RATE_LIMIT_MAX_WAIT,
+    jitter=settings.SPOTIFY_RATE_LIMIT_JITTER,
+)
@@ -1,67 +1,249 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Max, Q
+
+from .analytics import feature_matrix, nearest_tracks
+from .fragments import FRAGMENT_VERSION, get_catalogue_version
+from .jobs import enqueue_ingestion
 from .models import (
+    FEATURES_NAMES,
     Album,
-    AlbumFeatures,
-    Track,
-    TrackFeatures
-)
-from .services import (
-    create_album_tracks_and_features,
-    create_track_and_features
+    IngestionJob,
+    Track
 )
 
+TABLE_PAGE_SIZE = 25
+
+
+def encode_cursor(key, values, offset):
+    data = json.dumps([key] + [str(value) for value in values] + [offset])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def key_field(model, key):
+    """
+    Return the model field read by a lookup such as ``artist__name``.
+    """
+    *relations, name = key.split("__")
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def decode_cursor(cursor, model, key, tiebreak):
+    """
+    Return the sort values of the last row of the previous page and the
+    number of rows up to it, or None for a missing or broken cursor, or
+    one made for another sort.
+    """
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if not isinstance(data, list) or len(data) != 4 or data[0] != key:
+        return None
+    _, *sort_values, offset = data
+    if not all(isinstance(value, str) for value in sort_values):
+        return None
+    # Not a bool either, which is an int too.
+    if type(offset) is not int or offset < 0:
+        return None
+    fields = [key_field(model, key), key_field(model, tiebreak)]
+    try:
+        # Values which the lookups would fail to take, e.g. "abc" for a feature.
+        values = [field.to_python(value) for field, value in zip(fields, sort_values)]
+        for field, value in zip(fields, values):
+            field.get_prep_value(value)
+    except (ValidationError, TypeError, ValueError, ArithmeticError):
+        return None
+    return values, offset
+
+
+def keyset_page(queryset, key, tiebreak, descending=False, after=None, size=25):
+    """
+    Return a page of rows ordered by ``key``, the cursor of the next page
+    and the number of rows before this one.
+
+    Rows are sought past the last row of the previous page instead of
+    being skipped with an offset, so every page costs as much as the first
+    one given an index on ``(key, tiebreak)``.
+    """
+    order = "-" if descending else ""
+    queryset = queryset.annotate(
+        sort_value=F(key), sort_tiebreak=F(tiebreak)
+    ).order_by(order + key, order + tiebreak)
+
+    last = decode_cursor(after, queryset.model, key, tiebreak)
+    offset = 0
+    if last is not None:
+        (value, last_tiebreak), offset = last
+        lookup = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"{key}__{lookup}": value})
+            | Q(**{key: value, f"{tiebreak}__{lookup}": last_tiebreak})
+        )
+
+    rows = list(queryset[:size + 1])
+    next_after = None
+    if len(rows) > size:
+        rows = rows[:size]
+        next_after = encode_cursor(key, [rows[-1].sort_value, rows[-1].sort_tiebreak], offset + size)
+    return rows, next_after, offset
+
+
+def table_sort(sort_keys, sort, direction, default):
+    """
+    Return the sort column and direction asked for, or the defaults.
+    """
+    if sort not in sort_keys:
+        sort = default
+    if direction not in ("asc", "desc"):
+        direction = "asc"
+    return sort, direction
+
+
+def features_sort_keys(name_label):
+    """
+    Sort columns of a catalogue table: (label, key, tiebreak) by name.
+    """
+    sort_keys = {
+        "artist": ("Artist", "artist_name", "id"),
+        "name": (name_label, "name", "id"),
+    }
+    for name in FEATURES_NAMES:
+        sort_keys[name] = (name.capitalize(), name, "id")
+    return sort_keys
+
+
+TRACKS_SORT_KEYS = features_sort_keys("Track")
+ALBUMS_SORT_KEYS = features_sort_keys("Album")
+
+
+def get_table(queryset, sort_keys, sort, direction, after):
+    sort, direction = table_sort(sort_keys, sort, direction, default="name")
+    _, key, tiebreak = sort_keys[sort]
+    rows, next_after, offset = keyset_page(
+        queryset, key, tiebreak, descending=direction == "desc", after=after, size=TABLE_PAGE_SIZE
+    )
+    return {
+        "rows": rows,
+        "columns": [(column, label) for column, (label, _, _) in sort_keys.items()],
+        "sort": sort,
+        "dir": direction,
+        "next_after": next_after,
+        "offset": offset,
+    }
+
 
 def get_album_details(request, album_id):
 
     try:
-        album = Album.objects.get(id=album_id)
+        album = Album.objects.select_related("artist").prefetch_related("tracks").get(id=album_id)
     except Album.DoesNotExist:
-        album = create_album_tracks_and_features(request, album_id)
-
-    album_features = album.albumfeatures_set.get()
-    features = album_features.features
+        return {"job": enqueue_ingestion(IngestionJob.ALBUM, album_id)}
 
-    chart_numbers = features.get_features_for_chart()
+    # None of the album's tracks has audio features yet.
+    chart_numbers = album.get_features_for_chart() if album.has_features else None
 
     ctx = {
         "album": album,
         "tracks": album.tracks.all(),
-        "features": features,
+        "features": album,
         "chart": chart_numbers,
     }
     return ctx
 
 
-def get_albums_table():
+def get_albums_table(sort=None, direction=None, after=None):
 
-    albums = Album.objects.all()[:10]
-    albums_features = AlbumFeatures.objects.filter(album__in=albums)
-    ctx = {"albums_features": albums_features}
+    albums = Album.objects.select_related("artist").filter(danceability__isnull=False)
+    ctx = get_table(albums, ALBUMS_SORT_KEYS, sort, direction, after)
+    ctx["albums"] = ctx.pop("rows")
     return ctx
 
 
 def get_track_details(request, track_id):
 
     try:
-        track = Track.objects.get(id=track_id)
+        track = Track.objects.select_related("artist").get(id=track_id)
     except Track.DoesNotExist:
-        track = create_track_and_features(request, track_id)
+        return {"job": enqueue_ingestion(IngestionJob.TRACK, track_id)}
 
-    track_features = track.trackfeatures_set.get()
-    features = track_features.features
-    chart_numbers = features.get_features_for_chart
+    # Spotify has no audio features for some tracks.
+    chart_numbers = track.get_features_for_chart() if track.has_features else None
     ctx = {
         "track": track,
-        "features": features,
+        "features": track,
         "chart": chart_numbers
     }
     return ctx
 
 
-def get_tracks_table():
+def get_tracks_table(sort=None, direction=None, after=None):
 
-    tracks = Track.objects.all()[:10]
-    tracks_features = TrackFeatures.objects.filter(track__in=tracks)
-    ctx = {"tracks_features": tracks_features}
+    tracks = Track.objects.select_related("artist").filter(danceability__isnull=False)
+    ctx = get_table(tracks, TRACKS_SORT_KEYS, sort, direction, after)
+    ctx["tracks"] = ctx.pop("rows")
     return ctx
 
 
+def get_table_validators(model):
+    """
+    Return the ETag and the Last-Modified time of the tracks/albums table.
+
+    Both come from the newest ``updated_at``, read from its index, and
+    the ETag also from the counter of deletes and artist renames.
+    """
+    last_modified = model.objects.aggregate(last_modified=Max("updated_at"))["last_modified"]
+    stamp = last_modified.timestamp() if last_modified else 0
+    etag = f"{model._meta.model_name}-{FRAGMENT_VERSION}-{get_catalogue_version()}-{stamp}"
+    return etag, last_modified
+
+
+def get_similar_tracks(track_id, k):
+    """
+    Return the ``k`` stored tracks whose audio features are the closest to
+    the track's, or None when the track is not stored.
+    """
+    track = Track.objects.filter(id=track_id).first()
+    if track is None:
+        return None
+    if not track.has_features:
+        return {"track": track.id, "similar": []}
+
+    feature_matrix.refresh_if_older(settings.SPOTIFY_SIMILAR_TRACKS_REFRESH)
+    vector = [float(value) for value in track.get_features.values()]
+    nearest = nearest_tracks.sync().query(vector, k, exclude=[track.id])
+
+    tracks = Track.objects.select_related("artist").in_bulk([track_id for track_id, _ in nearest])
+    similar = [
+        {
+            "id": track_id,
+            "name": tracks[track_id].name,
+            "artist": tracks[track_id].artist.name,
+            "distance": round(distance, 4),
+        }
+        for track_id, distance in nearest
+        if track_id in tracks
+    ]
+    return {"track": track.id, "similar": similar}
+
+
+def get_ingestion_status(kind, object_id):
+    """
+    Return how far collecting the album/track is, for the placeholder page.
+    """
+    model = Album if kind == IngestionJob.ALBUM else Track
+    if model.objects.filter(id=object_id).exists():
+        return {"status": IngestionJob.DONE, "ready": True}
+
+    job = IngestionJob.objects.filter(kind=kind, object_id=object_id).values("status", "attempts").first()
+    if job is None:
+        return {"status": "missing", "ready": False}
+    return {"status": job["status"], "attempts": job["attempts"], "ready": False}
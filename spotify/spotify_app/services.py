@@ -1,112 +1,305 @@
-from collections import defaultdict
+from decimal import Decimal
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .fetch import fetch_concurrently
+from .fragments import invalidate_fragments
 from .models import (
+    FEATURES_NAMES,
+    FEATURES_SUMS,
     Album,
-    AlbumFeatures,
     Artist,
-    Features,
-    Track,
-    TrackFeatures
+    Track
 )
+from .singleflight import SingleFlight
 from .tasks import (
+    ALBUM_TRACKS_LIMIT,
+    SEVERAL_AUDIO_FEATURES_LIMIT,
+    SEVERAL_TRACKS_LIMIT,
+    chunked,
     get_album,
+    get_album_tracks,
+    get_several_tracks,
+    get_several_tracks_audio_features,
     get_track,
     get_track_audio_features
 )
 
+ingestion_flight = SingleFlight(
+    "spotify:ingest:",
+    lease=settings.SPOTIFY_INGESTION_LEASE,
+    wait=settings.SPOTIFY_INGESTION_WAIT,
+)
+
 
-def get_or_create_artist(resp):
-    artist, _ = Artist.objects.get_or_create(
-        id=resp["artists"][0]["id"], name=resp["artists"][0]["name"]
+def save_artists(payloads):
+    """
+    Save the main artists of several tracks/albums with one insert.
+    Return their names by id, as stored.
+    """
+    artists = {
+        payload["artists"][0]["id"]: payload["artists"][0]["name"]
+        for payload in payloads
+    }
+    existing = Artist.objects.in_bulk(list(artists))
+    Artist.objects.bulk_create(
+        [Artist(id=artist_id, name=name) for artist_id, name in artists.items() if artist_id not in existing],
+        ignore_conflicts=True,
     )
-    return artist
+    artists.update((artist_id, artist.name) for artist_id, artist in existing.items())
+    return artists
 
 
-def create_track(request, track_id):
-    track_data = get_track(request, track_id)
-    artist = get_or_create_artist(track_data)
-    track = Track.objects.create(id=track_id, artist=artist, name=track_data["name"])
-    return track
+def set_features(obj, features):
+    for name in FEATURES_NAMES:
+        setattr(obj, name, obj._meta.get_field(name).to_python(features[name]))
 
 
-def create_track_audio_features(request, track):
-    features = get_track_audio_features(request, track.id)
-    track_features = Features.objects.create(
-        danceability=features["danceability"],
-        speechiness=features["speechiness"],
-        acousticness=features["acousticness"],
-        valence=features["valence"],
-        instrumentalness=features["instrumentalness"],
-        energy=features["energy"],
-        liveness=features["liveness"],
-    )
-    TrackFeatures.objects.create(track=track, features=track_features)
-    return track_features
+def save_tracks(tracks_data, audio_features=()):
+    """
+    Save the tracks, with their audio features where they are given.
+
+    Spotify has null features for some tracks, those are saved without
+    them, see ``has_features``.
+    """
+    artists = save_artists(tracks_data)
+    features_by_id = {features["id"]: features for features in audio_features if features}
+    tracks = []
+    for track_data in tracks_data:
+        artist_id = track_data["artists"][0]["id"]
+        track = Track(
+            id=track_data["id"], artist_id=artist_id, artist_name=artists[artist_id], name=track_data["name"]
+        )
+        if track.id in features_by_id:
+            set_features(track, features_by_id[track.id])
+        tracks.append(track)
+    return Track.objects.bulk_create(tracks)
+
+
+def fetch_tracks_and_audio_features(request, track_ids):
+    """
+    Fetch tracks and their audio features in batches, all at the same time.
+    """
+    calls = {}
+    for number, chunk in enumerate(chunked(track_ids, SEVERAL_TRACKS_LIMIT)):
+        calls[("tracks", number)] = (get_several_tracks, (request, chunk))
+    for number, chunk in enumerate(chunked(track_ids, SEVERAL_AUDIO_FEATURES_LIMIT)):
+        calls[("audio_features", number)] = (get_several_tracks_audio_features, (request, chunk))
+    results = fetch_concurrently(calls)
+
+    tracks_data, audio_features = [], []
+    for (kind, _), result in sorted(results.items()):
+        if kind == "tracks":
+            tracks_data.extend(result)
+        else:
+            audio_features.extend(result)
+    return tracks_data, audio_features
 
 
 def create_track_and_features(request, track_id):
 
-    track = create_track(request, track_id)
-    create_track_audio_features(request, track)
+    results = fetch_concurrently({
+        "track": (get_track, (request, track_id)),
+        "audio_features": (get_track_audio_features, (request, track_id)),
+    })
+    with transaction.atomic():
+        track, = save_tracks([results["track"]], [results["audio_features"]])
     return track
 
 
-def create_album_features(tracks, album):
+def create_tracks_and_features(request, track_ids):
+
+    tracks_data, audio_features = fetch_tracks_and_audio_features(request, track_ids)
+    with transaction.atomic():
+        tracks = save_tracks(tracks_data, audio_features)
+    return tracks
 
-    dict_of_features = defaultdict(list)
-    tracks_number = len(tracks)
 
-    for track in tracks:
-        tr_feat = TrackFeatures.objects.get(track=track)
-        feat = tr_feat.features.get_features
-        for key in feat.keys():
-            dict_of_features[key].append(feat[key])
+def set_features_from_sums(album):
+    """
+    Set the album features to the means behind its running sums.
+    """
+    count = album.features_count
+    for name in FEATURES_NAMES:
+        total = getattr(album, name + "_sum")
+        # Means rounded half up, in thousandths.
+        setattr(album, name, Decimal((2 * total + count) // (2 * count)).scaleb(-3) if count else None)
 
-    for key in dict_of_features.keys():
-        dict_of_features[key] = sum(dict_of_features[key]) / tracks_number
 
-    album_features = Features.objects.create(
-        danceability=dict_of_features["danceability"],
-        speechiness=dict_of_features["speechiness"],
-        acousticness=dict_of_features["acousticness"],
-        valence=dict_of_features["valence"],
-        instrumentalness=dict_of_features["instrumentalness"],
-        energy=dict_of_features["energy"],
-        liveness=dict_of_features["liveness"],
+def features_totals(prefix=""):
+    """
+    Aggregates counting the tracks with features and summing every feature
+    over them in thousandths.
+    """
+    has_features = Q(**{prefix + "danceability__isnull": False})
+    totals = {"features_count": Count(prefix + "id", filter=has_features)}
+    for name in FEATURES_NAMES:
+        totals[name + "_sum"] = Coalesce(
+            Sum(prefix + name, filter=has_features, output_field=BigIntegerField()),
+            0,
+            output_field=BigIntegerField(),
+        )
+    return totals
+
+
+def update_albums_totals(album_ids, track_ids, sign=1):
+    """
+    Add the features of the tracks to the running sums of the albums, or
+    take them away with ``sign=-1``, and update the albums' means.
+
+    Costs the same number of queries whatever the size of the albums.
+    """
+    totals = Track.objects.filter(id__in=track_ids).aggregate(**features_totals())
+    if not totals["features_count"]:
+        return
+
+    with transaction.atomic():
+        Album.objects.filter(id__in=album_ids).update(**{
+            field: F(field) + sign * value for field, value in totals.items()
+        })
+        albums = list(
+            Album.objects.select_for_update().filter(id__in=album_ids).only("id", "features_count", *FEATURES_SUMS)
+        )
+        now = timezone.now()
+        for album in albums:
+            set_features_from_sums(album)
+            album.updated_at = now
+        Album.objects.bulk_update(albums, FEATURES_NAMES + ("updated_at",))
+        invalidate_fragments("album", [album.id for album in albums])
+
+
+def reconcile_albums_features(fix=True):
+    """
+    Check the running sums of every album against its tracks with one
+    grouped query, and with ``fix`` set them and the features right.
+
+    Returns the number of albums which drifted.
+    """
+    drifted = (
+        Album.objects
+        .annotate(**{"actual_" + field: total for field, total in features_totals("tracks__").items()})
+        .exclude(features_count=F("actual_features_count"), **{
+            field: F("actual_" + field) for field in FEATURES_SUMS
+        })
+        .values("id", *("actual_" + field for field in ("features_count",) + FEATURES_SUMS))
     )
-    AlbumFeatures.objects.create(album=album, features=album_features)
-    return album_features
+    albums = []
+    now = timezone.now()
+    for row in drifted:
+        album = Album(id=row.pop("id"), updated_at=now)
+        for field, value in row.items():
+            setattr(album, field[len("actual_"):], value)
+        set_features_from_sums(album)
+        albums.append(album)
 
+    if fix:
+        with transaction.atomic():
+            Album.objects.bulk_update(
+                albums, ("features_count",) + FEATURES_SUMS + FEATURES_NAMES + ("updated_at",), batch_size=1000
+            )
+            invalidate_fragments("album", [album.id for album in albums])
+    return len(albums)
 
-def create_tracks_from_album(request, album_data):
 
-    tracks_list = []
-    for item in album_data["tracks"]["items"]:
-        try:
-            track = Track.objects.get(id=item["id"])
-        except Track.DoesNotExist:
-            track = create_track_and_features(request, item["id"])
-        tracks_list.append(track)
-    return tracks_list
+def fetch_album_track_items(request, album_data):
+    """
+    Return the items of every page of the album's tracks.
+
+    The album payload carries the first page only, the remaining pages
+    are fetched at the same time.
+    """
+    items = list(album_data["tracks"]["items"])
+    total = album_data["tracks"].get("total", len(items))
+    calls = {
+        offset: (get_album_tracks, (request, album_data["id"], offset))
+        for offset in range(len(items), total, ALBUM_TRACKS_LIMIT)
+    }
+    results = fetch_concurrently(calls)
+    for offset in sorted(results):
+        items.extend(results[offset])
+    return items
+
 
+def fetch_album(request, album_id):
+    """
+    Fetch everything needed to store the album, before anything is saved.
 
-def create_album(request, album_id):
+    Returns the album payload with all track items, plus tracks and audio
+    features for the tracks which are not in the db yet.
+    """
     album_data = get_album(request, album_id)
-    artist = get_or_create_artist(album_data)
+    album_data["tracks"]["items"] = fetch_album_track_items(request, album_data)
+
+    track_ids = [item["id"] for item in album_data["tracks"]["items"]]
+    existing_ids = set(Track.objects.filter(id__in=track_ids).values_list("id", flat=True))
+    missing_ids = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in existing_ids]
+
+    tracks_data, audio_features = fetch_tracks_and_audio_features(request, missing_ids)
+    return album_data, tracks_data, audio_features
+
+
+def save_album(album_data):
+    artists = save_artists([album_data])
+    artist_id = album_data["artists"][0]["id"]
     album = Album.objects.create(
         id=album_data['id'],
         name=album_data["name"],
-        artist=artist,
+        artist_id=artist_id,
+        artist_name=artists[artist_id],
         image=album_data["images"][1]["url"],
     )
-    return album, album_data
+    return album
 
 
-def create_album_tracks_and_features(request, album_id):
+def save_tracks_from_album(album, album_data, tracks_data, audio_features):
+
+    save_tracks(tracks_data, audio_features)
 
-    album, album_data = create_album(request, album_id)
-    tracks_list = create_tracks_from_album(request, album_data)
+    track_ids = list(dict.fromkeys(item["id"] for item in album_data["tracks"]["items"]))
+    tracks = Track.objects.in_bulk(track_ids)
+    tracks_list = [tracks[track_id] for track_id in track_ids if track_id in tracks]
     album.tracks.add(*tracks_list)
+    return tracks_list
+
+
+def create_album_tracks_and_features(request, album_id):
+
+    album_data, tracks_data, audio_features = fetch_album(request, album_id)
 
-    create_album_features(tracks_list, album)
+    with transaction.atomic():
+        album = save_album(album_data)
+        save_tracks_from_album(album, album_data, tracks_data, audio_features)
+    album.refresh_from_db()
     return album
+
+
+def get_or_create_track(request, track_id):
+    """
+    Return the track, collecting it from Spotify if it is not in the db.
+
+    Concurrent calls for the same track, in this process or any other,
+    share one build.
+    """
+    return ingestion_flight.do(
+        "track:" + track_id,
+        build=lambda: create_track_and_features(request, track_id),
+        ready=lambda: Track.objects.filter(id=track_id).first(),
+    )
+
+
+def get_or_create_album(request, album_id):
+    """
+    Return the album, collecting it from Spotify if it is not in the db.
+
+    Concurrent calls for the same album, in this process or any other,
+    share one build.
+    """
+    return ingestion_flight.do(
+        "album:" + album_id,
+        build=lambda: create_album_tracks_and_features(request, album_id),
+        ready=lambda: Album.objects.filter(id=album_id).first(),
+    )
@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .fragments import bump_catalogue_version, invalidate_fragments
+from .instrumentation import install_query_timer
+from .models import Album, Artist, Track
+
+
+@receiver(m2m_changed, sender=Album.tracks.through)
+def album_tracks_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep the albums' running feature sums in step with their tracks.
+
+    Rows of the through table deleted by a cascade send no signal, the
+    reconcile_album_features command fixes what they leave behind.
+    """
+    if action == "pre_clear":
+        related = "album_id" if reverse else "track_id"
+        owner = "track_id" if reverse else "album_id"
+        instance._cleared_pks = set(sender.objects.filter(**{owner: instance.pk}).values_list(related, flat=True))
+        return
+    if action == "post_clear":
+        pk_set = instance.__dict__.pop("_cleared_pks", None)
+    elif action not in ("post_add", "post_remove"):
+        return
+    if not pk_set:
+        return
+
+    # Imported here, services load the Spotify credentials.
+    from .services import update_albums_totals
+
+    album_ids, track_ids = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+    invalidate_fragments("album", album_ids)
+    update_albums_totals(album_ids, track_ids, sign=1 if action == "post_add" else -1)
+
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def album_changed(sender, instance, signal, **kwargs):
+    invalidate_fragments("album", [instance.pk])
+    if signal is post_delete:
+        bump_catalogue_version()
+
+
+@receiver(post_save, sender=Track)
+@receiver(pre_delete, sender=Track)
+def track_changed(sender, instance, signal, created=False, **kwargs):
+    """
+    Drop the cached track page and the pages of the albums listing it.
+
+    On delete the albums are looked up before the cascade unlinks them.
+    """
+    if created:
+        return
+    if signal is pre_delete:
+        bump_catalogue_version()
+    album_ids = Album.tracks.through.objects.filter(track_id=instance.pk).values_list("album_id", flat=True)
+    invalidate_fragments("track", [instance.pk])
+    invalidate_fragments("album", album_ids)
+
+
+@receiver(post_save, sender=Artist)
+def artist_changed(sender, instance, created, **kwargs):
+    if created:
+        return
+    instance.album_set.exclude(artist_name=instance.name).update(artist_name=instance.name)
+    instance.track_set.exclude(artist_name=instance.name).update(artist_name=instance.name)
+    bump_catalogue_version()
+    invalidate_fragments("album", instance.album_set.values_list("id", flat=True))
+    invalidate_fragments("track", instance.track_set.values_list("id", flat=True))
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    """
+    Count the queries of every connection, in any thread, in the timings
+    of the request running them.
+    """
+    if settings.SPOTIFY_REQUEST_TIMING:
+        install_query_timer(connection)
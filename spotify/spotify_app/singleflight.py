@@ -0,0 +1,91 @@
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+
+class SingleFlightTimeout(Exception):
+    """
+    Another worker holds the lease for too long and the result is not there.
+    """
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Build the same thing only once at a time.
+
+    Threads of one process asking for the same key wait for the build
+    already in flight and share its result. Between processes the build
+    is guarded by a lease taken with ``cache.add``: workers which do not
+    get it wait until ``ready()`` finds the result the lease holder saved,
+    for up to ``wait`` seconds. A lease left behind by a dead worker
+    expires after ``lease`` seconds.
+    """
+
+    def __init__(self, prefix, lease, wait, poll_interval=0.2):
+        self.prefix = prefix
+        self.lease = lease
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, build, ready):
+        """
+        Return ``ready()`` if it is not None, otherwise ``build()`` once.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.wait):
+                raise SingleFlightTimeout(key)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_leased(key, build, ready)
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _do_leased(self, key, build, ready):
+        lease_key = self.prefix + key
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait
+        while True:
+            result = ready()
+            if result is not None:
+                return result
+
+            if cache.add(lease_key, token, timeout=self.lease):
+                try:
+                    # The previous holder may have finished just before
+                    # the lease was released.
+                    result = ready()
+                    return build() if result is None else result
+                finally:
+                    if cache.get(lease_key) == token:
+                        cache.delete(lease_key)
+
+            if time.monotonic() >= deadline:
+                raise SingleFlightTimeout(key)
+            time.sleep(self.poll_interval)
@@ -1,50 +1,226 @@
+import hashlib
 import logging
-import requests
+import time
+
+from django.conf import settings
+from django.core.cache import cache
 
 from .api_endpoints import API_ENDPOINTS
+from .client import spotify_client
+from .tokens import TokenRefused, app_token, forget_token, token_manager
 
 LOG = logging.getLogger(__name__)
 
+RESPONSE_CACHE_PREFIX = "spotify:response:"
+CACHE_STATS_PREFIX = "spotify:cache-stats:"
+CACHE_STATS = ("hits", "misses", "revalidated")
+
+# Spotify limits on the number of items in a single request
+ALBUM_TRACKS_LIMIT = 50
+SEVERAL_TRACKS_LIMIT = 50
+SEVERAL_AUDIO_FEATURES_LIMIT = 100
+
 # TODO: create nice docs
 
 
-def requests_url(request, url):
-    access_token = request.session.get("access_token")
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def bearer_headers(access_token, headers=None):
     authorization_header = {"Authorization": "Bearer {}".format(access_token)}
-    resp = requests.get(url, headers=authorization_header)
+    if headers:
+        authorization_header.update(headers)
+    return authorization_header
+
+
+def authorization_headers(request, headers=None):
+    return bearer_headers(request.session.get("access_token"), headers)
+
+
+def get_response(request, url, headers=None):
+    """
+    GET url with the access token of the session, refreshed and sent
+    again once when Spotify answers 401. Raise TokenRefused, the token
+    dropped from the session, when Spotify still answers 401.
+    """
+    resp = spotify_client.get(url, headers=authorization_headers(request, headers))
+    if resp.status_code == 401 and token_manager.refresh(request.session):
+        resp = spotify_client.get(url, headers=authorization_headers(request, headers))
+    if resp.status_code == 401:
+        forget_token(request.session)
+        raise TokenRefused(url)
+    return resp
+
+
+def get_app_response(url, headers=None):
+    """
+    GET url with the app token, for the catalogue endpoints.
+    """
+    access_token = app_token.get()
+    resp = spotify_client.get(url, headers=bearer_headers(access_token, headers))
+    if resp.status_code == 401:
+        resp = spotify_client.get(url, headers=bearer_headers(app_token.get(stale_token=access_token), headers))
+    return resp
+
+
+def requests_url(request, url):
+    resp = get_response(request, url)
+    return resp.json()
+
+
+def app_requests_url(url):
+    resp = get_app_response(url)
     return resp.json()
 
 
+def count_cache_event(name):
+    key = CACHE_STATS_PREFIX + name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_cache_stats():
+    stats = cache.get_many([CACHE_STATS_PREFIX + name for name in CACHE_STATS])
+    return {name: stats.get(CACHE_STATS_PREFIX + name, 0) for name in CACHE_STATS}
+
+
+def response_cache_key(url):
+    return RESPONSE_CACHE_PREFIX + hashlib.md5(url.encode()).hexdigest()
+
+
+def lookup_cached_response(url):
+    """
+    Return the cached entry for url and whether it is still fresh.
+    """
+    entry = cache.get(response_cache_key(url))
+    fresh = entry is not None and entry["expires"] > time.time()
+    if fresh:
+        count_cache_event("hits")
+    return entry, fresh
+
+
+def revalidation_headers(entry):
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def update_cached_response(url, ttl, entry, resp):
+    """
+    Store the response for url in the cache and return its data.
+
+    A 304 answer to a revalidation keeps the cached data, and validators
+    the 304 does not replace, for another TTL.
+    Entries outlive their TTL by SPOTIFY_CACHE_STALE_TTL, so they can be
+    revalidated instead of downloaded again.
+    """
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+    if entry is not None and resp.status_code == 304:
+        count_cache_event("revalidated")
+        data = entry["data"]
+        # A 304 need not repeat the validators of the cached response.
+        etag = etag or entry["etag"]
+        last_modified = last_modified or entry["last_modified"]
+    else:
+        count_cache_event("misses")
+        data = resp.json()
+        if resp.status_code != 200:
+            return data
+    cache.set(
+        response_cache_key(url),
+        {
+            "data": data,
+            "etag": etag,
+            "last_modified": last_modified,
+            "expires": time.time() + ttl,
+        },
+        ttl + settings.SPOTIFY_CACHE_STALE_TTL,
+    )
+    return data
+
+
+def cached_requests_url(url, endpoint):
+    """
+    Like app_requests_url, but served from the cache for the TTL set
+    for endpoint in SPOTIFY_CACHE_TTL. The cache is shared by all users.
+    """
+    ttl = settings.SPOTIFY_CACHE_TTL.get(endpoint)
+    if not ttl:
+        return app_requests_url(url)
+
+    entry, fresh = lookup_cached_response(url)
+    if fresh:
+        return entry["data"]
+    resp = get_app_response(url, revalidation_headers(entry))
+    return update_cached_response(url, ttl, entry, resp)
+
+
+# Only get_user_recently_played needs the user's token. The catalogue
+# functions are sent with the app token and take the request just to be
+# called the same way.
 def get_new_releases(request):  # pragma: no cover
     url = API_ENDPOINTS["new_releases"]
-    results = requests_url(request, url)
+    results = cached_requests_url(url, "new_releases")
     return results["albums"]["items"]
 
 
 def get_user_recently_played(request):  # pragma: no cover
     url = API_ENDPOINTS["user_recently_played"]
     results = requests_url(request, url)
-    return results["items"]["track"]
+    return [item["track"] for item in results["items"]]
 
 
 def get_album(request, album_id):  # pragma: no cover
     url = API_ENDPOINTS["album"] + album_id
-    return requests_url(request, url)
+    return cached_requests_url(url, "album")
+
+
+def get_album_tracks(request, album_id, offset):
+    url = API_ENDPOINTS["album_tracks"][0] + album_id + API_ENDPOINTS["album_tracks"][1] + str(offset)
+    results = app_requests_url(url)
+    return results["items"]
 
 
 def get_track(request, track_id):  # pragma: no cover
     url = API_ENDPOINTS["track"] + track_id
-    return requests_url(request, url)
+    return app_requests_url(url)
 
 
 def get_track_audio_features(request, track_id):  # pragma: no cover
     url = API_ENDPOINTS["track_audio_feature"] + track_id
-    return requests_url(request, url)
+    return app_requests_url(url)
+
+
+def get_several_tracks(request, track_ids):
+    tracks = []
+    for chunk in chunked(track_ids, SEVERAL_TRACKS_LIMIT):
+        url = API_ENDPOINTS["several_tracks"] + ",".join(chunk)
+        results = app_requests_url(url)
+        tracks.extend(track for track in results["tracks"] if track)
+    return tracks
+
+
+def get_several_tracks_audio_features(request, track_ids):
+    audio_features = []
+    for chunk in chunked(track_ids, SEVERAL_AUDIO_FEATURES_LIMIT):
+        url = API_ENDPOINTS["several_audio_features"] + ",".join(chunk)
+        results = app_requests_url(url)
+        audio_features.extend(features for features in results["audio_features"] if features)
+    return audio_features
 
 
 def get_search_results(request, searching):  # pragma: no cover
     url = API_ENDPOINTS["search"][0] + searching + API_ENDPOINTS["search"][1]
-    results = requests_url(request, url)
+    results = cached_requests_url(url, "search")
     artists = results['artists']['items']
     found_total = results['artists']['total']
     return artists, found_total
@@ -52,11 +228,11 @@ def get_search_results(request, searching):  # pragma: no cover
 
 def get_artist(request, artist_id):  # pragma: no cover
     url = API_ENDPOINTS['artist'] + artist_id
-    return requests_url(request, url)
+    return cached_requests_url(url, "artist")
 
 
 def get_artist_and_albums(request, artist_id):  # pragma: no cover
     url = API_ENDPOINTS["artist_albums"][0] + artist_id + API_ENDPOINTS["artist_albums"][1]
     artist_name = get_artist(request, artist_id)['name']
-    results = requests_url(request, url)
+    results = cached_requests_url(url, "artist_albums")
     return artist_name, results["items"]
@@ -8,6 +8,17 @@ from spotify_app import models
 CHAR_SET = string.ascii_letters + string.digits
 
 
+def feature():
+    return factory.Faker(
+        'pydecimal',
+        left_digits=1,
+        right_digits=3,
+        positive=True,
+        min_value=0,
+        max_value=1
+    )
+
+
 class ArtistFactory(factory.django.DjangoModelFactory):
     class Meta:
         model = models.Artist
@@ -32,6 +43,15 @@ class TrackFactory(factory.django.DjangoModelFactory):
     name = factory.Faker('sentence', nb_words=6, variable_nb_words=True, ext_word_list=None)
 
     artist = factory.SubFactory(ArtistFactory)
+    artist_name = factory.SelfAttribute('artist.name')
+
+    danceability = feature()
+    speechiness = feature()
+    acousticness = feature()
+    valence = feature()
+    instrumentalness = feature()
+    energy = feature()
+    liveness = feature()
 
 
 class AlbumFactory(factory.django.DjangoModelFactory):
@@ -43,89 +63,22 @@ class AlbumFactory(factory.django.DjangoModelFactory):
     image = factory.Faker('image_url')
 
     artist = factory.SubFactory(ArtistFactory)
+    artist_name = factory.SelfAttribute('artist.name')
+
+    danceability = feature()
+    speechiness = feature()
+    acousticness = feature()
+    valence = feature()
+    instrumentalness = feature()
+    energy = feature()
+    liveness = feature()
+
     @factory.post_generation
     def tracks(self, create, extracted, **kwargs):
         if not create:
             return
 
         if extracted:
-            for track in extracted:
-                self.tracks.add(track)
-
-
-class FeaturesFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = models.Features
-
-    danceability = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-    speechiness = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-    acousticness = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-    valence = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-    instrumentalness = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-    energy = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-    liveness = factory.Faker(
-        'pydecimal',
-        left_digits=1,
-        right_digits=3,
-        positive=True,
-        min_value=0,
-        max_value=1
-    )
-
-
-class TrackFeaturesFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = models.TrackFeatures
-
-    track = factory.SubFactory(TrackFactory)
-    features = factory.SubFactory(FeaturesFactory)
-
-
-class AlbumFeaturesFactory(factory.django.DjangoModelFactory):
-    class Meta:
-        model = models.AlbumFeatures
-
-    album = factory.SubFactory(AlbumFactory)
-    features = factory.SubFactory(FeaturesFactory)
+            self.tracks.add(*extracted)
+            # The features now come from the tracks.
+            self.refresh_from_db()
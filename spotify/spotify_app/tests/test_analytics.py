@@ -0,0 +1,157 @@
+from decimal import Decimal
+
+import numpy as np
+from django.test import TestCase
+
+from spotify_app.analytics import FeatureMatrix, NearestTracks
+from spotify_app.models import FEATURES_NAMES, Track
+from .factories import AlbumFactory, TrackFactory
+
+
+def _features(value):
+    return {name: Decimal(value) for name in FEATURES_NAMES}
+
+
+class TestFeatureMatrix(TestCase):
+
+    def setUp(self):
+        self.first = TrackFactory(**_features('0.2'))
+        self.second = TrackFactory(**_features('0.6'))
+        TrackFactory(**{name: None for name in FEATURES_NAMES})
+        self.album = AlbumFactory(tracks=[self.first, self.second])
+        self.matrix = FeatureMatrix(chunk_size=1).load()
+
+    def test_load(self):
+
+        self.assertEqual(len(self.matrix), 2)
+        self.assertEqual(self.matrix.values.dtype, np.float32)
+        self.assertEqual(self.matrix.values.shape, (2, len(FEATURES_NAMES)))
+        np.testing.assert_allclose(self.matrix.vector(self.first.id), [0.2] * len(FEATURES_NAMES))
+        self.assertIsNone(self.matrix.vector('missing'))
+
+    def test_load_in_one_query(self):
+
+        with self.assertNumQueries(2):
+            FeatureMatrix(chunk_size=1).load()
+
+    def test_stats(self):
+
+        stats = self.matrix.stats()
+
+        self.assertEqual(stats['count'], 2)
+        self.assertAlmostEqual(stats['mean']['energy'], 0.4, places=6)
+        self.assertAlmostEqual(stats['min']['valence'], 0.2, places=6)
+        self.assertAlmostEqual(stats['max']['liveness'], 0.6, places=6)
+
+    def test_empty_stats(self):
+        Track.objects.all().delete()
+
+        self.assertEqual(FeatureMatrix().load().stats(), {'count': 0})
+
+    def test_zscores(self):
+
+        np.testing.assert_allclose(self.matrix.zscores([self.second.id]), [[1] * len(FEATURES_NAMES)], rtol=1e-5)
+
+    def test_zscores_of_constant_feature(self):
+        Track.objects.update(energy=Decimal('0.5'))
+
+        zscores = FeatureMatrix().load().zscores()
+
+        np.testing.assert_array_equal(zscores[:, FEATURES_NAMES.index('energy')], [0, 0])
+
+    def test_album_means(self):
+
+        means = self.matrix.album_means()
+
+        np.testing.assert_allclose(means[self.album.id], [0.4] * len(FEATURES_NAMES), rtol=1e-6)
+
+    def test_refresh_adds_new_tracks(self):
+        new = TrackFactory(**_features('0.9'))
+        album = AlbumFactory(tracks=[new, self.first])
+
+        with self.assertNumQueries(2):
+            self.matrix.refresh()
+
+        self.assertEqual(len(self.matrix), 3)
+        np.testing.assert_allclose(self.matrix.vector(new.id), [0.9] * len(FEATURES_NAMES), rtol=1e-6)
+        np.testing.assert_allclose(self.matrix.album_means()[album.id], [0.55] * len(FEATURES_NAMES), rtol=1e-6)
+
+    def test_refresh_updates_changed_tracks(self):
+        values = self.matrix.values
+        self.first.energy = Decimal('0.7')
+        self.first.save()
+
+        self.matrix.refresh()
+
+        self.assertEqual(len(self.matrix), 2)
+        self.assertAlmostEqual(float(self.matrix.vector(self.first.id)[FEATURES_NAMES.index('energy')]), 0.7, places=6)
+        self.assertAlmostEqual(float(values[0, FEATURES_NAMES.index('energy')]), 0.2, places=6)
+
+
+class StaticMatrix:
+
+    def __init__(self, values):
+        self.values = values
+        self.ids = ['track-{}'.format(number) for number in range(len(values))]
+
+
+class TestNearestTracks(TestCase):
+
+    def setUp(self):
+        self.matrix = StaticMatrix(np.random.default_rng(0).random((500, len(FEATURES_NAMES)), dtype=np.float32))
+        self.index = NearestTracks(self.matrix, leaf_size=16, rebuild_ratio=0.1).sync()
+
+    def brute_force(self, vector, k):
+        distances = ((self.matrix.values - vector) ** 2).sum(axis=1)
+        return [self.matrix.ids[row] for row in np.argsort(distances, kind='stable')[:k]]
+
+    def test_same_tracks_as_brute_force(self):
+        for vector in np.random.default_rng(1).random((20, len(FEATURES_NAMES)), dtype=np.float32):
+
+            nearest = self.index.query(vector, 5)
+
+            self.assertEqual([track_id for track_id, _ in nearest], self.brute_force(vector, 5))
+
+    def test_distances_closest_first(self):
+
+        nearest = self.index.query(self.matrix.values[0], 3)
+
+        self.assertEqual(nearest[0], ('track-0', 0.0))
+        self.assertEqual([distance for _, distance in nearest], sorted(distance for _, distance in nearest))
+
+    def test_excluded_tracks_left_out(self):
+
+        nearest = self.index.query(self.matrix.values[0], 3, exclude=['track-0'])
+
+        self.assertEqual([track_id for track_id, _ in nearest], self.brute_force(self.matrix.values[0], 4)[1:])
+
+    def test_added_and_changed_tracks_found_before_rebuild(self):
+        values = np.concatenate([self.matrix.values, np.full((1, len(FEATURES_NAMES)), 2, dtype=np.float32)])
+        values[3] = 3
+        self.matrix.values = values
+        self.matrix.ids.append('track-new')
+        leaves = self.index._state[1]
+
+        self.index.sync()
+
+        self.assertIs(self.index._state[1], leaves)
+        self.assertEqual(self.index.query(np.full(len(FEATURES_NAMES), 2), 1)[0], ('track-new', 0.0))
+        self.assertEqual(self.index.query(np.full(len(FEATURES_NAMES), 3), 1)[0], ('track-3', 0.0))
+        every_track = [track_id for track_id, _ in self.index.query(self.matrix.values[0], len(values))]
+        self.assertEqual(sorted(every_track), sorted(self.matrix.ids))
+
+    def test_rebuilt_after_many_changes(self):
+        self.matrix.values = self.matrix.values + np.float32(0.5)
+        leaves = self.index._state[1]
+
+        self.index.sync()
+
+        self.assertIsNot(self.index._state[1], leaves)
+        self.assertEqual(self.index._state[-1].size, 0)
+        vector = self.matrix.values[7]
+        self.assertEqual([track_id for track_id, _ in self.index.query(vector, 5)], self.brute_force(vector, 5))
+
+    def test_empty_matrix(self):
+        index = NearestTracks(StaticMatrix(np.empty((0, len(FEATURES_NAMES)), dtype=np.float32)))
+
+        self.assertEqual(index.query(np.zeros(len(FEATURES_NAMES)), 5), [])
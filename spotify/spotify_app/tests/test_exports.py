@@ -0,0 +1,160 @@
+import csv
+from decimal import Decimal
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from spotify_app.exports import ExportFilterError, export_catalogue, export_filters
+from spotify_app.models import FEATURES_NAMES
+from .factories import AlbumFactory, ArtistFactory, TrackFactory
+
+
+def _features(value):
+    return {name: Decimal(value) for name in FEATURES_NAMES}
+
+
+def _content(response):
+    return b''.join(response.streaming_content).decode()
+
+
+class TestExportFilters(TestCase):
+
+    def test_artist_and_feature_ranges(self):
+
+        filters = export_filters({'artist': 'artist-1', 'energy_min': '0.5', 'valence_max': '0.25', 'liveness_min': ''})
+
+        self.assertEqual(filters, {
+            'artist_id': 'artist-1',
+            'energy__gte': Decimal('0.5'),
+            'valence__lte': Decimal('0.25'),
+        })
+
+    def test_invalid_values(self):
+        for params in ({'energy_min': 'loud'}, {'energy_max': '1.5'}):
+            with self.assertRaises(ExportFilterError):
+                export_filters(params)
+
+
+class TestExportCatalogue(TestCase):
+
+    def setUp(self):
+        self.artist = ArtistFactory(name='Artist, "quoted"')
+        self.quiet = TrackFactory(id='a-quiet', artist=self.artist, **_features('0.1'))
+        self.loud = TrackFactory(id='b-loud', **_features('1'))
+        self.unknown = TrackFactory(id='c-unknown', **dict.fromkeys(FEATURES_NAMES))
+
+    def export(self, kind, export_format, filters=None):
+        _, chunks = export_catalogue(kind, export_format, filters or {}, chunk_size=2)
+        return ''.join(chunks)
+
+    def test_tracks_csv(self):
+
+        rows = list(csv.reader(io.StringIO(self.export('tracks', 'csv'))))
+
+        self.assertEqual(rows[0], ['id', 'name', 'artist_id', 'artist'] + list(FEATURES_NAMES))
+        self.assertEqual([row[0] for row in rows[1:]], ['a-quiet', 'b-loud', 'c-unknown'])
+        self.assertEqual(rows[1][2:5], [self.artist.id, 'Artist, "quoted"', '0.100'])
+        self.assertEqual(rows[2][4:], ['1.000'] * len(FEATURES_NAMES))
+        self.assertEqual(rows[3][4:], [''] * len(FEATURES_NAMES))
+
+    def test_tracks_ndjson(self):
+
+        rows = [json.loads(line) for line in self.export('tracks', 'ndjson').splitlines()]
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['artist'], 'Artist, "quoted"')
+        self.assertEqual(rows[0]['energy'], 0.1)
+        self.assertIsNone(rows[2]['energy'])
+
+    def test_albums(self):
+        album = AlbumFactory(tracks=[self.quiet, self.loud])
+
+        rows = [json.loads(line) for line in self.export('albums', 'ndjson').splitlines()]
+
+        self.assertEqual(rows, [dict(
+            id=album.id, name=album.name, artist_id=album.artist.id, artist=album.artist.name, image=album.image,
+            **{name: 0.55 for name in FEATURES_NAMES}
+        )])
+
+    def test_filtered(self):
+
+        export = self.export('tracks', 'csv', {'energy__gte': Decimal('0.5')})
+
+        self.assertEqual([row[0] for row in csv.reader(io.StringIO(export))][1:], ['b-loud'])
+
+    def test_read_a_chunk_at_a_time(self):
+        _, chunks = export_catalogue('tracks', 'csv', {}, chunk_size=2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(chunks)), 2)
+
+
+class TestExportViews(TestCase):
+
+    def setUp(self):
+        self.artist = ArtistFactory()
+        TrackFactory(artist=self.artist, **_features('0.2'))
+        TrackFactory(**_features('0.8'))
+
+    def test_streamed_csv(self):
+
+        response = self.client.get(reverse('export_tracks_csv'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('filename="tracks.csv"', response['Content-Disposition'])
+        self.assertEqual(len(_content(response).splitlines()), 3)
+
+    def test_filtered_ndjson(self):
+
+        response = self.client.get(reverse('export_tracks_ndjson'), {'artist': self.artist.id, 'energy_max': '0.5'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['artist_id'] for line in _content(response).splitlines()], [self.artist.id])
+
+    def test_albums_csv(self):
+        AlbumFactory(tracks=[])
+
+        response = self.client.get(reverse('export_albums_csv'))
+
+        self.assertEqual(len(_content(response).splitlines()), 2)
+
+    def test_bad_filter(self):
+
+        response = self.client.get(reverse('export_tracks_csv'), {'energy_min': 'loud'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TestExportCommand(TestCase):
+
+    def setUp(self):
+        TrackFactory(**_features('0.2'))
+        TrackFactory(**_features('0.8'))
+
+    def test_to_stdout(self):
+        out = io.StringIO()
+
+        call_command('export_catalogue', 'tracks', 'ndjson', '--min', 'energy', '0.5', stdout=out)
+
+        self.assertEqual([json.loads(line)['energy'] for line in out.getvalue().splitlines()], [0.8])
+
+    def test_to_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tracks.csv')
+
+            call_command('export_catalogue', 'tracks', 'csv', '--output', path, '--chunk-size', '1')
+
+            with open(path) as output:
+                self.assertEqual(len(list(csv.reader(output))), 3)
+
+    def test_unknown_feature(self):
+
+        with self.assertRaises(CommandError):
+            call_command('export_catalogue', 'tracks', 'csv', '--max', 'loudness', '0.5')
@@ -0,0 +1,159 @@
+from decimal import Decimal
+from io import StringIO
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from spotify_app import fragments
+from spotify_app.fragments import cached_fragment, fragment_flight, fragment_key, get_fragment_stats
+from spotify_app.models import FEATURES_NAMES, Album, Track
+from spotify_app.services import reconcile_albums_features
+from .factories import AlbumFactory, TrackFactory
+
+
+class TestCachedFragment(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rendered_once(self):
+        render = Mock(return_value='<p>album</p>')
+
+        first = cached_fragment('album', 'album-1', render)
+        second = cached_fragment('album', 'album-1', render)
+
+        self.assertEqual((first, second), ('<p>album</p>', '<p>album</p>'))
+        render.assert_called_once()
+        self.assertEqual(get_fragment_stats(), {'hits': 1, 'misses': 1, 'timeouts': 0})
+
+    def test_nothing_to_cache(self):
+        render = Mock(return_value=None)
+
+        self.assertIsNone(cached_fragment('album', 'album-1', render))
+        self.assertIsNone(cached_fragment('album', 'album-1', render))
+        self.assertEqual(render.call_count, 2)
+
+    def test_new_version_not_served_old_fragments(self):
+        cached_fragment('album', 'album-1', Mock(return_value='old'))
+
+        with patch.object(fragments, 'FRAGMENT_VERSION', fragments.FRAGMENT_VERSION + 1):
+            self.assertEqual(cached_fragment('album', 'album-1', Mock(return_value='new')), 'new')
+
+    def test_concurrent_misses_render_once(self):
+        def render():
+            time.sleep(0.1)
+            return 'album'
+        render_mock = Mock(side_effect=render)
+        results = []
+
+        threads = [
+            threading.Thread(target=lambda: results.append(cached_fragment('album', 'album-1', render_mock)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['album'] * 5)
+        render_mock.assert_called_once()
+
+    def test_render_after_waiting_too_long(self):
+        cache.add(fragment_flight.prefix + fragment_key('album', 'album-1'), 'other worker')
+
+        with patch.object(fragment_flight, 'wait', 0.1):
+            html = cached_fragment('album', 'album-1', Mock(return_value='album'))
+
+        self.assertEqual(html, 'album')
+        self.assertEqual(get_fragment_stats()['timeouts'], 1)
+
+    def test_stats_command(self):
+        cached_fragment('album', 'album-1', Mock(return_value='album'))
+        out = StringIO()
+
+        call_command('cache_stats', stdout=out)
+
+        self.assertIn('Album and track pages: hits 0, misses 1, timeouts 0', out.getvalue())
+
+
+class TestFragmentsInvalidation(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        session = self.client.session
+        session['access_token'] = '12345'
+        session.save()
+        self.track = TrackFactory(name='First name', **{name: Decimal('0.2') for name in FEATURES_NAMES})
+        self.album = AlbumFactory(name='Album name', tracks=[self.track])
+
+    def album_page(self):
+        return self.client.get(reverse('album', args=[self.album.id]))
+
+    def track_page(self):
+        return self.client.get(reverse('track', args=[self.track.id]))
+
+    def test_album_served_from_cache(self):
+        self.album_page()
+        Album.objects.filter(id=self.album.id).update(name='Changed behind the signals')
+
+        self.assertContains(self.album_page(), 'Album name')
+
+    def test_album_changed(self):
+        self.album_page()
+
+        self.album.name = 'New album name'
+        self.album.save()
+
+        self.assertContains(self.album_page(), 'New album name')
+
+    def test_track_added(self):
+        self.album_page()
+
+        self.album.tracks.add(TrackFactory(name='Added track'))
+
+        self.assertContains(self.album_page(), 'Added track')
+
+    def test_track_renamed(self):
+        self.album_page()
+        self.track_page()
+
+        self.track.name = 'Second name'
+        self.track.save()
+
+        self.assertContains(self.album_page(), 'Second name')
+        self.assertContains(self.track_page(), 'Second name')
+
+    def test_track_deleted(self):
+        self.album_page()
+
+        self.track.delete()
+
+        self.assertNotContains(self.album_page(), 'First name')
+
+    def test_artist_renamed(self):
+        self.album_page()
+        self.track_page()
+
+        artist = self.album.artist
+        artist.name = 'Renamed artist'
+        artist.save()
+        self.track.artist.name = 'Renamed track artist'
+        self.track.artist.save()
+
+        self.assertContains(self.album_page(), 'Renamed artist')
+        self.assertContains(self.track_page(), 'Renamed track artist')
+        self.assertEqual(Album.objects.get(id=self.album.id).artist_name, 'Renamed artist')
+        self.assertEqual(Track.objects.get(id=self.track.id).artist_name, 'Renamed track artist')
+
+    def test_features_reconciled(self):
+        Album.objects.filter(id=self.album.id).update(features_count=0, danceability=Decimal('0.9'))
+        self.assertContains(self.album_page(), '0.200', count=len(FEATURES_NAMES) - 1)
+
+        reconcile_albums_features()
+
+        self.assertContains(self.album_page(), '0.200', count=len(FEATURES_NAMES))
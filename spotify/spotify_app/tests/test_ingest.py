@@ -0,0 +1,149 @@
+import io
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from spotify_app import services
+from spotify_app.client import spotify_client
+from spotify_app.ingest import ALBUMS, TRACKS, Checkpoint, IngestStats, ingest, missing_ids, read_ids
+from spotify_app.models import Artist
+from .factories import AlbumFactory, TrackFactory
+
+
+class TestReadIds(TestCase):
+
+    def test_ids_uris_and_links(self):
+        lines = [
+            'album-1\n',
+            'spotify:album:album-2\n',
+            'https://open.spotify.com/album/album-3?si=abc\n',
+            '\n',
+            '# seeded by hand\n',
+            'album-1\n',
+        ]
+
+        self.assertEqual(read_ids(lines), ['album-1', 'album-2', 'album-3'])
+
+    def test_existing_ids_left_out(self):
+        AlbumFactory(id='album-2')
+
+        self.assertEqual(missing_ids(ALBUMS, ['album-1', 'album-2', 'album-3']), ['album-1', 'album-3'])
+
+
+class TestCheckpoint(TestCase):
+
+    def test_resumed_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ids.checkpoint')
+
+            Checkpoint(path).mark(['album-1', 'album-2'])
+            Checkpoint(path).mark(['album-3'])
+
+            self.assertEqual(Checkpoint(path).done, {'album-1', 'album-2', 'album-3'})
+
+    def test_without_file(self):
+        checkpoint = Checkpoint(None)
+
+        checkpoint.mark(['album-1'])
+
+        self.assertEqual(checkpoint.done, {'album-1'})
+
+
+class TestIngestStats(TestCase):
+
+    def test_db_rows_counted(self):
+        stats = IngestStats(1)
+
+        with connection.execute_wrapper(stats.count_rows):
+            Artist.objects.bulk_create([Artist(id=str(number), name='Artist') for number in range(3)])
+            Artist.objects.update(name='Renamed')
+            Artist.objects.count()
+
+        self.assertEqual(stats.rows, 6)
+
+    def test_api_calls_counted(self):
+        stats = IngestStats(1)
+
+        spotify_client._count_request()
+
+        self.assertEqual(stats.api_calls, 1)
+        self.assertIn('0/1 ids', stats.report())
+
+
+class TestIngest(TestCase):
+
+    @patch.object(services, 'get_or_create_album')
+    def test_albums(self, get_or_create_album_mock):
+        AlbumFactory(id='album-2')
+        checkpoint = Checkpoint(None)
+        checkpoint.mark(['album-3'])
+
+        stats, errors = ingest(ALBUMS, ['album-1', 'album-2', 'album-3', 'album-4'], checkpoint)
+
+        collected = sorted(call[0][1] for call in get_or_create_album_mock.call_args_list)
+        self.assertEqual(collected, ['album-1', 'album-4'])
+        self.assertEqual((stats.total, stats.ids, errors), (2, 2, {}))
+        self.assertEqual(checkpoint.done, {'album-1', 'album-3', 'album-4'})
+
+    @patch.object(services, 'create_tracks_and_features')
+    def test_tracks_in_batches(self, create_tracks_mock):
+        TrackFactory(id='track-0')
+        ids = ['track-{}'.format(number) for number in range(121)]
+
+        stats, _ = ingest(TRACKS, ids, Checkpoint(None), concurrency=2)
+
+        batches = sorted((call[0][1] for call in create_tracks_mock.call_args_list), key=len)
+        self.assertEqual([len(batch) for batch in batches], [20, 50, 50])
+        self.assertNotIn('track-0', sum(batches, []))
+        self.assertEqual(stats.ids, 120)
+
+    @patch.object(services, 'get_or_create_album')
+    def test_failed_ids_left_for_the_next_run(self, get_or_create_album_mock):
+        def collect(request, album_id):
+            if album_id == 'album-2':
+                raise KeyError('tracks')
+        get_or_create_album_mock.side_effect = collect
+        checkpoint = Checkpoint(None)
+
+        stats, errors = ingest(ALBUMS, ['album-1', 'album-2'], checkpoint)
+
+        self.assertEqual(list(errors), ['album-2'])
+        self.assertEqual(stats.failed, 1)
+        self.assertEqual(checkpoint.done, {'album-1'})
+
+    @patch.object(services, 'get_or_create_album')
+    def test_progress_reported(self, get_or_create_album_mock):
+        reports = []
+
+        ingest(ALBUMS, ['album-1', 'album-2'], Checkpoint(None), report=reports.append, report_interval=0)
+
+        self.assertGreaterEqual(len(reports), 2)
+        self.assertEqual(reports[-1].ids, 2)
+
+
+class TestIngestCommand(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'albums.txt')
+        with open(self.path, 'w') as ids:
+            ids.write('album-1\nalbum-2\n')
+
+    @patch.object(services, 'get_or_create_album')
+    def test_resumed_run(self, get_or_create_album_mock):
+        out = io.StringIO()
+
+        call_command('ingest', 'albums', self.path, stdout=out)
+        call_command('ingest', 'albums', self.path, stdout=out)
+
+        self.assertEqual(get_or_create_album_mock.call_count, 2)
+        self.assertIn('Ingested 2 albums', out.getvalue())
+        self.assertIn('ids/s', out.getvalue())
+        self.assertIn('Skipped 2 ids already collected', out.getvalue())
+        with open(self.path + '.checkpoint') as checkpoint:
+            self.assertEqual(sorted(checkpoint.read().split()), ['album-1', 'album-2'])
@@ -0,0 +1,124 @@
+import responses
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from spotify_app.client import spotify_client
+from spotify_app.fetch import fetch_concurrently
+from spotify_app.instrumentation import ViewMetrics, finish_request, start_request, view_metrics
+from spotify_app.models import Track
+from spotify_app.tests.factories import TrackFactory
+from spotify_app.tests.test_tasks import patch_app_token
+
+TRACK_URL = 'https://api.spotify.com/v1/tracks/track-1'
+
+
+class TestRequestTimings(TestCase):
+
+    def tearDown(self):
+        finish_request()
+
+    @responses.activate
+    def test_spotify_calls_counted(self):
+        responses.add(responses.GET, TRACK_URL, json={'id': 'track-1'})
+
+        start_request()
+        spotify_client.get(TRACK_URL)
+        fetch_concurrently({key: (spotify_client.get, [TRACK_URL]) for key in range(3)}, max_workers=3)
+        timings = finish_request()
+
+        self.assertEqual(timings.spotify_calls, 4)
+        self.assertGreater(timings.spotify_time, 0)
+
+    @responses.activate
+    def test_nothing_counted_outside_of_requests(self):
+        responses.add(responses.GET, TRACK_URL, json={'id': 'track-1'})
+
+        spotify_client.get(TRACK_URL)
+
+        self.assertIsNone(finish_request())
+
+    def test_queries_counted(self):
+        TrackFactory()
+
+        start_request()
+        list(Track.objects.all())
+        timings = finish_request()
+
+        self.assertEqual(timings.db_queries, 1)
+
+
+class TestViewMetrics(TestCase):
+
+    def test_histogram_and_counters(self):
+        metrics = ViewMetrics(buckets=(0.1, 1))
+        for total, status in [(0.05, 200), (0.5, 200), (5, 500)]:
+            timings = start_request()
+            timings.db_queries = 2
+            finish_request()
+            timings.total = total
+            metrics.record('album', status, timings)
+
+        exposition = metrics.exposition()
+
+        for line in [
+            'spotify_app_request_duration_seconds_bucket{view="album",le="0.1"} 1',
+            'spotify_app_request_duration_seconds_bucket{view="album",le="1"} 2',
+            'spotify_app_request_duration_seconds_bucket{view="album",le="+Inf"} 3',
+            'spotify_app_request_duration_seconds_count{view="album"} 3',
+            'spotify_app_responses_total{view="album",status="500"} 1',
+            'spotify_app_db_queries_total{view="album"} 6',
+        ]:
+            self.assertIn(line + '\n', exposition)
+
+
+class TestRequestTimingMiddleware(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        view_metrics.clear()
+        TrackFactory()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('tracks_table'))
+
+        names = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(names, ['db', 'spotify', 'template', 'total'])
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+        self.assertNotIn('template;dur=0.0', response['Server-Timing'])
+
+    @responses.activate
+    def test_spotify_calls_in_header(self):
+        patch_app_token(self)
+        responses.add(responses.GET, 'https://api.spotify.com/v1/browse/new-releases', json={'albums': {'items': []}})
+        session = self.client.session
+        session['access_token'] = '12345'
+        session.save()
+
+        response = self.client.get(reverse('index'))
+
+        self.assertIn('desc="1 calls"', response['Server-Timing'])
+
+    def test_logged(self):
+        with self.assertLogs('spotify_app.middleware', 'INFO') as logs:
+            self.client.get(reverse('tracks_table'))
+
+        self.assertRegex(logs.output[0], r'view=tracks_table method=GET status=200 total_ms=[\d.]+ db_queries=\d+')
+
+    def test_metrics_by_view(self):
+        self.client.get(reverse('tracks_table'))
+        self.client.get(reverse('tracks_table'))
+        self.client.get('/not-a-page/')
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertContains(response, 'spotify_app_request_duration_seconds_count{view="tracks_table"} 2\n')
+        self.assertContains(response, 'spotify_app_responses_total{view="unresolved",status="404"} 1\n')
+
+    @override_settings(SPOTIFY_REQUEST_TIMING=0)
+    def test_disabled(self):
+        response = self.client.get(reverse('tracks_table'))
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('tracks_table', view_metrics.exposition())
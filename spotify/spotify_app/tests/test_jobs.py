@@ -0,0 +1,168 @@
+from datetime import timedelta
+from io import StringIO
+import time
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from spotify_app import services
+from spotify_app.jobs import (
+    JobTimeout,
+    claim_job,
+    enqueue_ingestion,
+    run_next_job,
+    time_limit
+)
+from spotify_app.models import IngestionJob
+from spotify_app.ratelimit import SpotifyRateLimited
+from .factories import AlbumFactory
+
+
+class TestEnqueueIngestion(TestCase):
+
+    def test_one_job_per_object(self):
+
+        first = enqueue_ingestion(IngestionJob.ALBUM, 'album-1')
+        second = enqueue_ingestion(IngestionJob.ALBUM, 'album-1')
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(IngestionJob.objects.count(), 1)
+
+    def test_failed_job_queued_again(self):
+        job = enqueue_ingestion(IngestionJob.TRACK, 'track-1')
+        IngestionJob.objects.filter(pk=job.pk).update(status=IngestionJob.FAILED, attempts=3, error='boom')
+
+        enqueue_ingestion(IngestionJob.TRACK, 'track-1')
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (IngestionJob.PENDING, 0, ''))
+
+
+@override_settings(SPOTIFY_INGESTION_MAX_ATTEMPTS=2, SPOTIFY_INGESTION_RETRY_DELAY=10)
+class TestRunJobs(TestCase):
+
+    def setUp(self):
+        self.job = enqueue_ingestion(IngestionJob.ALBUM, 'album-1')
+
+    def test_empty_queue(self):
+        IngestionJob.objects.all().delete()
+
+        self.assertIsNone(run_next_job())
+
+    def test_claimed_job_locked(self):
+
+        job = claim_job()
+
+        self.assertEqual((job.status, job.attempts), (IngestionJob.RUNNING, 1))
+        self.assertIsNone(claim_job())
+
+    def test_job_with_expired_lock_claimed_again(self):
+        claim_job()
+        IngestionJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        job = claim_job()
+
+        self.assertEqual(job.attempts, 2)
+
+    @patch.object(services, 'create_album_tracks_and_features')
+    def test_run_job(self, create_album_mock):
+
+        job = run_next_job()
+
+        create_album_mock.assert_called_once()
+        request, album_id = create_album_mock.call_args[0]
+        self.assertNotIn('access_token', request.session)
+        self.assertEqual(album_id, 'album-1')
+        self.assertEqual(job.status, IngestionJob.DONE)
+        self.assertIsNone(job.locked_until)
+
+    @patch.object(services, 'create_album_tracks_and_features')
+    def test_album_already_collected(self, create_album_mock):
+        AlbumFactory(id='album-1')
+
+        job = run_next_job()
+
+        create_album_mock.assert_not_called()
+        self.assertEqual(job.status, IngestionJob.DONE)
+
+    @patch.object(services, 'create_album_tracks_and_features', side_effect=KeyError('tracks'))
+    def test_failed_job_retried_later(self, create_album_mock):
+
+        job = run_next_job()
+
+        self.assertEqual(job.status, IngestionJob.PENDING)
+        self.assertIn('KeyError', job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=9))
+        self.assertIsNone(run_next_job())
+
+        IngestionJob.objects.update(run_after=timezone.now())
+        job = run_next_job()
+
+        self.assertEqual(job.status, IngestionJob.FAILED)
+        self.assertEqual(create_album_mock.call_count, 2)
+
+    @patch.object(services, 'create_album_tracks_and_features', side_effect=SpotifyRateLimited(30))
+    def test_rate_limited_job_waits_for_spotify(self, create_album_mock):
+
+        job = run_next_job()
+
+        self.assertEqual(job.status, IngestionJob.PENDING)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=29))
+
+    @patch.object(services, 'get_track_audio_features', return_value={})
+    @patch.object(services, 'get_track', side_effect=SpotifyRateLimited(30))
+    def test_job_throttled_in_concurrent_fetch_waits_for_spotify(self, get_track_mock, get_features_mock):
+        IngestionJob.objects.all().delete()
+        enqueue_ingestion(IngestionJob.TRACK, 'track-1')
+
+        job = run_next_job()
+
+        self.assertEqual(job.status, IngestionJob.PENDING)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=29))
+
+    def test_job_lost_by_every_worker_fails(self):
+        IngestionJob.objects.update(
+            status=IngestionJob.RUNNING, attempts=2, locked_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        job = run_next_job()
+
+        self.assertEqual(job.status, IngestionJob.FAILED)
+
+    @override_settings(SPOTIFY_INGESTION_TIME_LIMIT=0.05)
+    @patch.object(services, 'create_album_tracks_and_features', side_effect=lambda *args: time.sleep(1))
+    def test_job_over_time_limit(self, create_album_mock):
+
+        start = time.monotonic()
+        job = run_next_job()
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(job.status, IngestionJob.PENDING)
+        self.assertIn('JobTimeout', job.error)
+
+    @patch.object(services, 'create_album_tracks_and_features')
+    def test_worker_command(self, create_album_mock):
+        enqueue_ingestion(IngestionJob.TRACK, 'track-1')
+
+        out = StringIO()
+        with patch.object(services, 'create_track_and_features'):
+            call_command('ingestion_worker', '--once', stdout=out)
+
+        self.assertIn('Processed 2 jobs', out.getvalue())
+        self.assertEqual(IngestionJob.objects.filter(status=IngestionJob.DONE).count(), 2)
+
+
+class TestTimeLimit(TestCase):
+
+    def test_block_within_limit(self):
+
+        with time_limit(1):
+            pass
+
+    def test_block_over_limit(self):
+
+        with self.assertRaises(JobTimeout):
+            with time_limit(0.01):
+                time.sleep(1)
@@ -35,3 +35,6 @@ class TestSessionAccessToken(TestCase):
 
         self.assertEqual(session["access_token"], self.response["access_token"])
         self.assertEqual(session["refresh_token"], self.response["refresh_token"])
+        self.assertIn("token_expires_at", session)
+        # The session outlives the token, which is refreshed.
+        self.assertGreater(session.get_expiry_age(), self.response["expires_in"])
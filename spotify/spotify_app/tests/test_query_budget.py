@@ -0,0 +1,120 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.urls import reverse
+
+from spotify_app import analytics, selectors
+from .factories import (
+    AlbumFactory,
+    TrackFactory,
+)
+
+# Queries every view may run, whatever the number of rows it shows. The
+# session is read once by the views validating the access token.
+SESSION_QUERIES = 1
+# The catalogue tables look up their newest row and the catalogue version
+# for the ETag/Last-Modified.
+VALIDATOR_QUERIES = 2
+
+
+def _add_access_token_to_client_session(client):
+    session = client.session
+    session['access_token'] = '12345'
+    session.save()
+
+
+class QueryBudgetTestCase(TestCase):
+
+    def setUp(self):
+        _add_access_token_to_client_session(self.client)
+
+    def assertQueryBudget(self, queries, url, data=None, **headers):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, data, **headers)
+        self.assertIn(response.status_code, (200, 202, 304))
+        return response
+
+
+class TablesQueryBudget(QueryBudgetTestCase):
+
+    def test_tracks_table(self):
+        for rows in (1, 20):
+            TrackFactory.create_batch(rows)
+            for sort in ('name', 'artist', 'energy'):
+                self.assertQueryBudget(VALIDATOR_QUERIES + 1, reverse('tracks_table'), {'sort': sort})
+
+    def test_tracks_table_next_page(self):
+        TrackFactory.create_batch(30)
+        response = self.client.get(reverse('tracks_table'))
+
+        self.assertQueryBudget(VALIDATOR_QUERIES + 1, reverse('tracks_table'), {'after': response.context['next_after']})
+
+    def test_not_modified(self):
+        TrackFactory.create_batch(20)
+        response = self.client.get(reverse('tracks_table'))
+
+        response = self.assertQueryBudget(
+            VALIDATOR_QUERIES, reverse('tracks_table'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_albums_table(self):
+        for rows in (1, 20):
+            AlbumFactory.create_batch(rows)
+            for sort in ('name', 'artist', 'valence'):
+                self.assertQueryBudget(VALIDATOR_QUERIES + 1, reverse('albums_table'), {'sort': sort})
+
+
+class DetailsQueryBudget(QueryBudgetTestCase):
+
+    def test_album_detail(self):
+        for tracks_number in (1, 30):
+            album = AlbumFactory(tracks=TrackFactory.create_batch(tracks_number))
+
+            self.assertQueryBudget(SESSION_QUERIES + 2, reverse('album', args=[album.id]))
+            # Served from the cached fragment.
+            self.assertQueryBudget(SESSION_QUERIES, reverse('album', args=[album.id]))
+
+    def test_track_detail(self):
+        track = TrackFactory()
+
+        response = self.assertQueryBudget(SESSION_QUERIES + 1, reverse('track', args=[track.id]))
+        self.assertQueryBudget(SESSION_QUERIES, reverse('track', args=[track.id]))
+        response = self.assertQueryBudget(
+            SESSION_QUERIES, reverse('track', args=[track.id]), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_album_queued(self):
+        # Album lookup, job lookup and insert inside a savepoint.
+        self.assertQueryBudget(SESSION_QUERIES + 5, reverse('album', args=['missing']))
+
+    def test_ingestion_status(self):
+        self.assertQueryBudget(2, reverse('album_status', args=['missing']))
+
+    def test_similar_tracks(self):
+        track = TrackFactory()
+        TrackFactory.create_batch(20)
+        matrix = analytics.FeatureMatrix()
+
+        with patch.multiple(selectors, feature_matrix=matrix, nearest_tracks=analytics.NearestTracks(matrix)):
+            # Track, then its neighbours, with the matrix loaded in between.
+            self.assertQueryBudget(4, reverse('similar_tracks', args=[track.id]))
+            self.assertQueryBudget(2, reverse('similar_tracks', args=[track.id]))
+
+
+class SpotifyViewsQueryBudget(QueryBudgetTestCase):
+
+    @patch('spotify_app.views.get_new_releases', return_value=[])
+    def test_index(self, mock_func):
+        self.assertQueryBudget(SESSION_QUERIES, reverse('index'))
+
+    @patch('spotify_app.views.get_user_recently_played', return_value=[])
+    def test_recently_played(self, mock_func):
+        self.assertQueryBudget(SESSION_QUERIES, reverse('recently_played'))
+
+    @patch('spotify_app.views.get_artist_and_albums', return_value=('Artist', []))
+    def test_artist(self, mock_func):
+        self.assertQueryBudget(SESSION_QUERIES, reverse('artist', args=['artist-1']))
+
+    @patch('spotify_app.views.get_search_results', return_value=([], 0))
+    def test_search(self, mock_func):
+        self.assertQueryBudget(SESSION_QUERIES, reverse('search'), {'q': 'artist'})
@@ -1,41 +1,61 @@
 from decimal import Decimal
+from io import StringIO
+import json
 import random
+import threading
+import time
 from unittest.mock import Mock, patch
 
+import httpx
 import responses
 
-from django.test import RequestFactory, TestCase
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
 
 from spotify_app.api_endpoints import API_ENDPOINTS
+from spotify_app import async_tasks
+from spotify_app import client as client_module
+from spotify_app import ratelimit
 from spotify_app import tasks
-from spotify_app import services
+from spotify_app.ratelimit import RateLimiter, SpotifyRateLimited, get_rate_limit_stats
 from spotify_app.models import (
+    FEATURES_NAMES,
     Album,
-    AlbumFeatures,
     Artist,
-    Features,
-    Track,
-    TrackFeatures
+    Track
 )
+from spotify_app.fetch import FetchError, fetch_concurrently
+from spotify_app.singleflight import SingleFlight, SingleFlightTimeout
 from spotify_app.services import (
-    create_album,
-    create_album_features,
     create_album_tracks_and_features,
-    create_tracks_from_album,
-    create_track,
-    create_track_audio_features,
     create_track_and_features,
-    get_or_create_artist,
+    create_tracks_and_features,
+    fetch_album,
+    fetch_album_track_items,
+    get_or_create_album,
+    reconcile_albums_features,
+    save_album,
+    save_artists,
+    save_tracks,
+    update_albums_totals,
 )
+from spotify_app.client import AsyncSpotifyClient, SpotifyClient
 from spotify_app.tasks import requests_url
+from spotify_app.tokens import app_token
 from .factories import (
     AlbumFactory,
-    FeaturesFactory,
     TrackFactory,
-    TrackFeaturesFactory
 )
 
 
+def patch_app_token(test_case):
+    patcher = patch.object(app_token, 'get', return_value='app-token')
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+
+
 def get_request_factory_with_session():
     request_factory = RequestFactory()
     access_token = '12345'
@@ -48,16 +68,297 @@ class TestRequestsURL(TestCase):
     def setUp(self):
         self.request_factory = get_request_factory_with_session()
 
-    @patch.object(tasks, 'requests', Mock(get=Mock()))
+    @patch.object(tasks, 'spotify_client', Mock(get=Mock()))
     def test_simply_requests_get(self):
 
         requests_url(self.request_factory, 'https://api.spotify.com/v1/me')
-        tasks.requests.get.assert_called_once_with(
+        tasks.spotify_client.get.assert_called_once_with(
             'https://api.spotify.com/v1/me',
             headers={'Authorization': 'Bearer {}'.format('12345')}
         )
 
 
+class TestSpotifyClient(TestCase):
+
+    def setUp(self):
+        self.client = SpotifyClient(pool_size=4, timeout=(1, 2), retries=2)
+
+    def test_session_is_reused_between_calls(self):
+
+        self.assertIs(self.client.session, self.client.session)
+
+    def test_session_is_rebuilt_after_fork(self):
+
+        session = self.client.session
+        with patch.object(client_module.os, 'getpid', Mock(return_value=-1)):
+            self.assertIsNot(self.client.session, session)
+
+    def test_adapter_pool_and_retries(self):
+
+        adapter = self.client.session.get_adapter('https://api.spotify.com')
+
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+
+    @responses.activate
+    def test_default_timeout(self):
+
+        responses.add(responses.GET, 'https://api.spotify.com/v1/me', json={}, status=200)
+
+        with patch.object(self.client.session, 'get', wraps=self.client.session.get) as mock_get:
+            self.client.get('https://api.spotify.com/v1/me')
+
+        mock_get.assert_called_once_with(
+            'https://api.spotify.com/v1/me', headers=None, timeout=(1, 2)
+        )
+
+
+@patch.object(ratelimit.time, 'sleep', Mock())
+@patch.object(ratelimit.random, 'uniform', Mock(return_value=0))
+@patch.object(ratelimit.time, 'time', Mock(return_value=1000.0))
+class TestRateLimiter(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.rate_limiter = RateLimiter(rate=10, burst=2, max_wait=5, jitter=1)
+
+    def test_burst_then_wait_for_slot(self):
+
+        waits = [self.rate_limiter.reserve() for _ in range(4)]
+
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.1)
+        self.assertAlmostEqual(waits[3], 0.2)
+        self.assertEqual(get_rate_limit_stats()['requests'], 4)
+        self.assertEqual(get_rate_limit_stats()['throttled_ms'], 300)
+
+    def test_one_get_and_set_per_reservation(self):
+
+        with patch.object(ratelimit, 'cache', Mock(wraps=ratelimit.cache)) as cache_mock:
+            self.rate_limiter.reserve()
+
+        self.assertEqual(cache_mock.get.call_count, 1)
+        self.assertEqual(cache_mock.set.call_count, 1)
+        self.assertFalse(cache_mock.incr.called)
+
+    def test_retry_after_blocks_requests(self):
+
+        self.rate_limiter.throttled('3')
+
+        self.assertAlmostEqual(self.rate_limiter.reserve(), 3)
+        self.assertEqual(get_rate_limit_stats()['throttled_responses'], 1)
+
+    def test_too_long_wait_raises(self):
+
+        self.rate_limiter.throttled('30')
+
+        with self.assertRaises(SpotifyRateLimited):
+            self.rate_limiter.reserve()
+
+    @responses.activate
+    def test_client_retries_throttled_request(self):
+
+        url = 'https://api.spotify.com/v1/me'
+        responses.add(responses.GET, url, json={}, status=429, headers={'Retry-After': '1'})
+        responses.add(responses.GET, url, json={'id': 'me'}, status=200)
+        client = SpotifyClient(rate_limiter=self.rate_limiter)
+
+        resp = client.get(url)
+
+        self.assertEqual(resp.json(), {'id': 'me'})
+        ratelimit.time.sleep.assert_called_with(1.0)
+
+    @responses.activate
+    def test_client_gives_up_when_still_throttled(self):
+
+        url = 'https://api.spotify.com/v1/me'
+        responses.add(responses.GET, url, json={}, status=429, headers={'Retry-After': '1'})
+        client = SpotifyClient(rate_limiter=self.rate_limiter, throttle_retries=1)
+
+        with self.assertRaises(SpotifyRateLimited):
+            client.get(url)
+
+        self.assertEqual(len(responses.calls), 2)
+
+
+class TestResponseCache(TestCase):
+
+    def setUp(self):
+        self.request_factory = get_request_factory_with_session()
+        patch_app_token(self)
+        self.url = API_ENDPOINTS["new_releases"]
+        self.response = {'albums': {'items': [{'id': 'album'}]}}
+
+    def _expire_cache(self):
+        return patch.object(tasks.time, 'time', Mock(return_value=time.time() + 2 * 60 * 60))
+
+    @responses.activate
+    def test_fresh_response_served_from_cache(self):
+
+        responses.add(responses.GET, self.url, json=self.response, status=200)
+
+        first = tasks.get_new_releases(self.request_factory)
+        second = tasks.get_new_releases(self.request_factory)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(tasks.get_cache_stats(), {'hits': 1, 'misses': 1, 'revalidated': 0})
+
+    @responses.activate
+    def test_not_modified_response_served_from_cache(self):
+
+        responses.add(responses.GET, self.url, json=self.response, status=200, headers={'ETag': '"v1"'})
+        tasks.get_new_releases(self.request_factory)
+
+        responses.replace(responses.GET, self.url, body='', status=304)
+        with self._expire_cache():
+            releases = tasks.get_new_releases(self.request_factory)
+
+        self.assertEqual(releases, self.response['albums']['items'])
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"v1"')
+        self.assertEqual(tasks.get_cache_stats()['revalidated'], 1)
+
+    @responses.activate
+    def test_validators_kept_after_not_modified_response(self):
+
+        responses.add(
+            responses.GET, self.url, json=self.response, status=200,
+            headers={'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        )
+        tasks.get_new_releases(self.request_factory)
+
+        responses.replace(responses.GET, self.url, body='', status=304)
+        with self._expire_cache():
+            tasks.get_new_releases(self.request_factory)
+        with patch.object(tasks.time, 'time', Mock(return_value=time.time() + 4 * 60 * 60)):
+            tasks.get_new_releases(self.request_factory)
+
+        self.assertEqual(responses.calls[2].request.headers['If-None-Match'], '"v1"')
+        self.assertEqual(responses.calls[2].request.headers['If-Modified-Since'], 'Wed, 21 Oct 2015 07:28:00 GMT')
+        self.assertEqual(tasks.get_cache_stats()['revalidated'], 2)
+
+    @responses.activate
+    def test_modified_response_replaces_cache(self):
+
+        responses.add(
+            responses.GET, self.url, json=self.response, status=200,
+            headers={'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        )
+        tasks.get_new_releases(self.request_factory)
+
+        new_response = {'albums': {'items': [{'id': 'new album'}]}}
+        responses.replace(responses.GET, self.url, json=new_response, status=200)
+        with self._expire_cache():
+            releases = tasks.get_new_releases(self.request_factory)
+
+        self.assertEqual(releases, new_response['albums']['items'])
+        self.assertEqual(
+            responses.calls[1].request.headers['If-Modified-Since'],
+            'Wed, 21 Oct 2015 07:28:00 GMT'
+        )
+        self.assertEqual(tasks.get_cache_stats()['misses'], 2)
+
+    @responses.activate
+    def test_error_response_not_cached(self):
+
+        responses.add(responses.GET, self.url, json={'error': {'status': 503}}, status=503)
+        responses.add(responses.GET, self.url, json=self.response, status=200)
+
+        tasks.cached_requests_url(self.url, 'new_releases')
+        result = tasks.cached_requests_url(self.url, 'new_releases')
+
+        self.assertEqual(result, self.response)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    @override_settings(SPOTIFY_CACHE_TTL={})
+    def test_endpoint_without_ttl_not_cached(self):
+
+        responses.add(responses.GET, self.url, json=self.response, status=200)
+
+        tasks.get_new_releases(self.request_factory)
+        tasks.get_new_releases(self.request_factory)
+
+        self.assertEqual(len(responses.calls), 2)
+
+
+class TestAsyncTasks(TestCase):
+
+    def setUp(self):
+        self.request_factory = get_request_factory_with_session()
+        patch_app_token(self)
+        self.requests = []
+
+    def _async_client(self, handler):
+        def record(request):
+            self.requests.append(request)
+            return handler(request)
+        return AsyncSpotifyClient(transport=httpx.MockTransport(record), backoff_factor=0)
+
+    def test_requests_url_with_bearer_token(self):
+        client = self._async_client(lambda request: httpx.Response(200, json={'id': 'me'}))
+
+        with patch.object(async_tasks, 'async_spotify_client', client):
+            result = async_to_sync(async_tasks.requests_url)(
+                self.request_factory, 'https://api.spotify.com/v1/me'
+            )
+
+        self.assertEqual(result, {'id': 'me'})
+        self.assertEqual(self.requests[0].headers['Authorization'], 'Bearer 12345')
+
+    def test_retry_server_errors(self):
+        statuses = iter([503, 502, 200])
+        client = self._async_client(lambda request: httpx.Response(next(statuses), json={}))
+
+        resp = async_to_sync(client.get)('https://api.spotify.com/v1/me')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_client_closed_with_its_loop(self):
+        client = self._async_client(lambda request: httpx.Response(200, json={}))
+        clients = []
+
+        async def call():
+            await client.get('https://api.spotify.com/v1/me')
+            clients.append(await client.get_client())
+
+        async_to_sync(call)()
+        async_to_sync(call)()
+
+        self.assertIsNot(clients[0], clients[1])
+        self.assertTrue(all(http_client.is_closed for http_client in clients))
+        self.assertEqual(client._clients, {})
+
+    def test_get_several_tracks_in_chunks(self):
+        def handler(request):
+            ids = request.url.params['ids'].split(',')
+            return httpx.Response(200, json={'tracks': [{'id': track_id} for track_id in ids]})
+        client = self._async_client(handler)
+        track_ids = [str(x) for x in range(120)]
+
+        with patch.object(async_tasks, 'async_spotify_client', client):
+            tracks = async_to_sync(async_tasks.get_several_tracks)(self.request_factory, track_ids)
+
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual([track['id'] for track in tracks], track_ids)
+
+    def test_get_artist_and_albums(self):
+        def handler(request):
+            if request.url.path.endswith('/albums'):
+                return httpx.Response(200, json={'items': [{'id': 'album'}]})
+            return httpx.Response(200, json={'name': 'Ozzy Osbourne'})
+        client = self._async_client(handler)
+
+        with patch.object(async_tasks, 'async_spotify_client', client):
+            artist, albums = async_to_sync(async_tasks.get_artist_and_albums)(
+                self.request_factory, '6ZLTlhejhndI4Rh53vYhrY'
+            )
+
+        self.assertEqual(artist, 'Ozzy Osbourne')
+        self.assertEqual(albums, [{'id': 'album'}])
+
+
 class TestCreateArtist(TestCase):
 
     def setUp(self):
@@ -76,11 +377,11 @@ class TestCreateArtist(TestCase):
         self.assertFalse(Artist.objects.exists())
 
         # create Artist
-        artist = get_or_create_artist(self.response)
+        save_artists([self.response])
 
         self.assertTrue(Artist.objects.exists())
-        self.assertEqual(Artist.objects.first().id, artist.id)
-        self.assertEqual(Artist.objects.first().name, artist.name)
+        self.assertEqual(Artist.objects.first().id, self.response['artists'][0]['id'])
+        self.assertEqual(Artist.objects.first().name, self.response['artists'][0]['name'])
 
     def test_not_create_same_artist_if_exists(self):
 
@@ -92,7 +393,14 @@ class TestCreateArtist(TestCase):
         self.assertEqual(Artist.objects.first().id, self.response['artists'][0]['id'])
 
         # create Artist and check if exists
-        get_or_create_artist(self.response)
+        save_artists([self.response])
+
+        self.assertEqual(Artist.objects.count(), 1)
+
+    def test_create_same_artist_once(self):
+
+        with self.assertNumQueries(2):
+            save_artists([self.response, self.response])
 
         self.assertEqual(Artist.objects.count(), 1)
 
@@ -116,45 +424,31 @@ class TestCreateTrack(TestCase):
                     'name': self.artist['name']
                 }
             ],
+            'id': self.track['id'],
             'name': self.track['name']
         }
 
-    @responses.activate
     def test_create_track_for_existing_artist(self):
 
-        responses.add(
-            responses.GET,
-            API_ENDPOINTS["track"] + self.track["id"],
-            json=self.response,
-            status=200
-        )
-
         # create Artist
         artist = Artist.objects.create(**self.artist)
         self.assertTrue(Artist.objects.get(id=self.artist['id']))
 
-        track = create_track(self.request_factory, self.track['id'])
+        track, = save_tracks([self.response])
 
         self.assertEqual(Track.objects.first(), track)
         self.assertEqual(Track.objects.first().id, self.track['id'])
         self.assertEqual(Track.objects.first().name, self.track['name'])
         self.assertEqual(Track.objects.first().artist.name, artist.name)
+        self.assertEqual(Track.objects.first().artist_name, artist.name)
 
-    @responses.activate
     def test_create_track_for_new_artist(self):
 
-        responses.add(
-            responses.GET,
-            API_ENDPOINTS["track"] + self.track["id"],
-            json=self.response,
-            status=200
-        )
-
         # assure Artist and Track tables are empty
         self.assertFalse(Artist.objects.exists())
         self.assertFalse(Track.objects.exists())
 
-        track = create_track(self.request_factory, self.track['id'])
+        track, = save_tracks([self.response])
 
         self.assertEqual(Track.objects.first(), track)
         self.assertEqual(Track.objects.first().id, self.track['id'])
@@ -162,11 +456,24 @@ class TestCreateTrack(TestCase):
         self.assertEqual(Artist.objects.first().id, self.artist['id'])
         self.assertEqual(Track.objects.first().artist.name, self.artist['name'])
 
+    def test_create_several_tracks_in_bulk(self):
+
+        tracks_data = [
+            dict(self.response, id=str(number), name=f'track {number}')
+            for number in range(20)
+        ]
+
+        # select and insert artists, insert tracks
+        with self.assertNumQueries(3):
+            tracks = save_tracks(tracks_data)
+
+        self.assertEqual(len(tracks), 20)
+        self.assertEqual(Track.objects.count(), 20)
+
 
 class TestCreateAlbum(TestCase):
 
     def setUp(self):
-        self.request_factory = get_request_factory_with_session()
         self.artist = {
             'id': '08GQAI4eElDnROBrJRGE0X',
             'name': 'Fleetwood Mac'
@@ -192,41 +499,25 @@ class TestCreateAlbum(TestCase):
             ]
         }
 
-    @responses.activate
     def test_create_album_for_existing_artist(self):
 
-        responses.add(
-            responses.GET,
-            API_ENDPOINTS["album"] + self.album["id"],
-            json=self.response,
-            status=200
-        )
-
         # create Artist
         Artist.objects.create(**self.artist)
         self.assertTrue(Artist.objects.get(id=self.artist['id']))
 
-        album, _ = create_album(self.request_factory, self.album['id'])
+        album = save_album(self.response)
 
         self.assertEqual(Album.objects.first(), album)
         self.assertEqual(Album.objects.first().id, self.album['id'])
         self.assertEqual(Album.objects.first().name, self.album['name'])
         self.assertEqual(Album.objects.first().artist.name, self.artist['name'])
 
-    @responses.activate
     def test_create_album_for_new_artist(self):
 
-        responses.add(
-            responses.GET,
-            API_ENDPOINTS["album"] + self.album["id"],
-            json=self.response,
-            status=200
-        )
-
         # assure Artist table is empty
         self.assertFalse(Artist.objects.exists())
 
-        album, _ = create_album(self.request_factory, self.album['id'])
+        album = save_album(self.response)
 
         self.assertEqual(Album.objects.first(), album)
         self.assertEqual(Album.objects.first().id, self.album['id'])
@@ -239,9 +530,13 @@ class TestCreateAlbum(TestCase):
 class TestCreateTrackFeatures(TestCase):
 
     def setUp(self):
-        self.request_factory = get_request_factory_with_session()
-        self.track = TrackFactory()
+        self.track = {
+            'artists': [{'id': '6ZLTlhejhndI4Rh53vYhrY', 'name': 'Ozzy Osbourne'}],
+            'id': '0LagWpYHMaQjbCeAIoOKVg',
+            'name': 'Under the Graveyard'
+        }
         self.response = {
+            "id": self.track['id'],
             "danceability": random.random(),
             "speechiness": random.random(),
             "acousticness": random.random(),
@@ -251,151 +546,572 @@ class TestCreateTrackFeatures(TestCase):
             "liveness": random.random()
         }
 
-    @responses.activate
     def test_create_track_audio_features(self):
 
+        save_tracks([self.track], [self.response])
+
+        track = Track.objects.get()
+        for name in FEATURES_NAMES:
+            self.assertEqual(getattr(track, name), Decimal(str(self.response[name])).quantize(Decimal('0.001')))
+
+    def test_track_without_audio_features(self):
+
+        track, = save_tracks([self.track])
+
+        self.assertFalse(track.has_features)
+        self.assertFalse(Track.objects.get().has_features)
+
+    def test_features_stored_as_thousandths(self):
+        self.response['danceability'] = 0.7355
+
+        save_tracks([self.track], [self.response])
+
+        self.assertEqual(Track.objects.get().danceability, Decimal('0.736'))
+        self.assertEqual(Track.objects.filter(danceability__gt='0.735').count(), 1)
+        self.assertEqual(Track.objects.values_list('danceability', flat=True).get(), Decimal('0.736'))
+
+
+class TestCreateTrackAndFeatures(TestCase):
+
+    def setUp(self):
+        self.request_factory = get_request_factory_with_session()
+        patch_app_token(self)
+        self.track_id = '0LagWpYHMaQjbCeAIoOKVg'
+        self.response = {
+            'artists': [{'id': '6ZLTlhejhndI4Rh53vYhrY', 'name': 'Ozzy Osbourne'}],
+            'id': self.track_id,
+            'name': 'Under the Graveyard'
+        }
+        self.features = dict(
+            id=self.track_id,
+            **{name: 0.5 for name in FEATURES_NAMES}
+        )
+
+    @responses.activate
+    def test_create_track_and_features(self):
+
+        responses.add(responses.GET, API_ENDPOINTS["track"] + self.track_id, json=self.response)
         responses.add(
-            responses.GET,
-            API_ENDPOINTS["track_audio_feature"] + self.track.id,
-            json=self.response,
-            status=200
+            responses.GET, API_ENDPOINTS["track_audio_feature"] + self.track_id, json=self.features
         )
 
-        track_features = create_track_audio_features(self.request_factory, self.track)
+        track = create_track_and_features(self.request_factory, self.track_id)
 
-        self.assertTrue(TrackFeatures.objects.exists())
-        self.assertTrue(Features.objects.exists())
-        self.assertEqual(TrackFeatures.objects.first().track, self.track)
-        self.assertEqual(TrackFeatures.objects.first().features, track_features)
+        self.assertEqual(Track.objects.get(), track)
+        self.assertEqual(Track.objects.get().get_features_for_chart(), [50] * 7)
 
+    @responses.activate
+    def test_failed_request_does_not_save_track(self):
 
-class TestCreateTrackAndFeatures(TestCase):
+        responses.add(responses.GET, API_ENDPOINTS["track"] + self.track_id, json=self.response)
+        responses.add(
+            responses.GET, API_ENDPOINTS["track_audio_feature"] + self.track_id,
+            json={'error': {'status': 404}}, status=404
+        )
+
+        with self.assertRaises(KeyError):
+            create_track_and_features(self.request_factory, self.track_id)
+
+        self.assertFalse(Track.objects.exists())
+
+    def test_track_with_null_features_saved_without_them(self):
+
+        track, = save_tracks([self.response], [None])
+
+        track = Track.objects.get(id=track.id)
+        self.assertFalse(track.has_features)
+        self.assertEqual(track.get_features_for_chart(), [])
+        self.assertEqual(set(track.get_features.values()), {None})
+
+
+class TestCreateSeveralTracksAndFeatures(TestCase):
 
     def setUp(self):
         self.request_factory = get_request_factory_with_session()
-        self.track = TrackFactory()
-        self.track_features = TrackFeaturesFactory(track=self.track)
+        patch_app_token(self)
+        self.artist = {
+            'id': '6ZLTlhejhndI4Rh53vYhrY',
+            'name': 'Ozzy Osbourne'
+        }
+        self.track_ids = [str(x) for x in range(120)]
+
+    def _tracks_callback(self, request):
+        ids = request.url.split('ids=')[1].split(',')
+        body = {
+            'tracks': [
+                {'id': track_id, 'name': f'track {track_id}', 'artists': [self.artist]}
+                for track_id in ids
+            ]
+        }
+        return 200, {}, json.dumps(body)
+
+    def _audio_features_callback(self, request):
+        ids = request.url.split('ids=')[1].split(',')
+        body = {
+            'audio_features': [
+                dict(id=track_id, **{name: 0.5 for name in FEATURES_NAMES})
+                for track_id in ids
+            ] + [None]
+        }
+        return 200, {}, json.dumps(body)
 
-    @patch.object(services, 'create_track_audio_features')
-    @patch.object(services, 'create_track')
-    def test_create_track_and_features(self, mock_create_track, mock_create_track_audio_features):
-        mock_create_track.return_value = self.track
-        mock_create_track_audio_features.return_value = self.track_features
+    @responses.activate
+    def test_get_several_tracks_in_chunks(self):
 
-        response = create_track_and_features(self.request_factory, self.track.id)
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_tracks"],
+            callback=self._tracks_callback
+        )
 
-        mock_create_track.assert_called_once_with(
-            self.request_factory,
-            self.track.id
+        tracks = tasks.get_several_tracks(self.request_factory, self.track_ids)
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual([track['id'] for track in tracks], self.track_ids)
+
+    @responses.activate
+    def test_get_several_audio_features_in_chunks_skips_empty(self):
+
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_audio_features"],
+            callback=self._audio_features_callback
         )
-        mock_create_track_audio_features.assert_called_once_with(
-            self.request_factory,
-            self.track
+
+        audio_features = tasks.get_several_tracks_audio_features(
+            self.request_factory, self.track_ids
         )
-        self.assertEqual(response, self.track)
 
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual([features['id'] for features in audio_features], self.track_ids)
 
-class TestCreateAlbumFeatures(TestCase):
+    @responses.activate
+    def test_create_tracks_and_features(self):
 
-    def setUp(self):
-        self.album = AlbumFactory()
-        self.tracks = [
-            TrackFactory()
-            for _ in range(10)
-        ]
-        feature_value = Decimal(
-            '{:.3f}'.format(random.randrange(0, 100) / 100)
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_tracks"],
+            callback=self._tracks_callback
         )
-        self.features_values = dict(
-            danceability=feature_value,
-            speechiness=feature_value,
-            acousticness=feature_value,
-            valence=feature_value,
-            instrumentalness=feature_value,
-            energy=feature_value,
-            liveness=feature_value
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_audio_features"],
+            callback=self._audio_features_callback
         )
-        self.features = FeaturesFactory(**self.features_values)
-        self.tracks_features = [
-            TrackFeaturesFactory(track=track, features=self.features)
-            for track in self.tracks
-        ]
 
-    def test_create_album_features(self):
+        tracks = create_tracks_and_features(self.request_factory, self.track_ids[:20])
+
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(len(tracks), 20)
+        self.assertEqual(Track.objects.count(), 20)
+        self.assertEqual(Artist.objects.count(), 1)
+        self.assertEqual(Track.objects.filter(danceability__isnull=False).count(), 20)
+        self.assertEqual(
+            Track.objects.get(id='7').danceability,
+            Decimal('0.5')
+        )
+
+
+def _features(value):
+    return {name: Decimal(value) for name in FEATURES_NAMES}
+
+
+class TestAlbumFeaturesTotals(TestCase):
+
+    def setUp(self):
+        self.album = AlbumFactory(**dict.fromkeys(FEATURES_NAMES))
+        self.tracks = [TrackFactory(**_features(value)) for value in ('0.100', '0.300', '0.301')]
+
+    def assertAlbumFeatures(self, value):
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.get_features, dict.fromkeys(FEATURES_NAMES, value))
+
+    def test_tracks_added(self):
+
+        self.album.tracks.add(*self.tracks[:2])
+
+        self.assertAlbumFeatures(Decimal('0.200'))
+        self.assertEqual((self.album.features_count, self.album.danceability_sum), (2, 400))
+
+    def test_tracks_added_one_by_one(self):
+        for track in self.tracks:
+            self.album.tracks.add(track)
+
+        # 701 / 3 rounded half up.
+        self.assertAlbumFeatures(Decimal('0.234'))
+
+    def test_tracks_without_features_left_out(self):
+
+        self.album.tracks.add(self.tracks[0], TrackFactory(**dict.fromkeys(FEATURES_NAMES)))
+
+        self.assertAlbumFeatures(Decimal('0.100'))
+        self.assertEqual(self.album.features_count, 1)
+
+    def test_track_added_from_the_track_side(self):
+
+        self.tracks[0].album_set.add(self.album)
+
+        self.assertAlbumFeatures(Decimal('0.100'))
+
+    def test_tracks_removed(self):
+        self.album.tracks.add(*self.tracks)
+
+        self.album.tracks.remove(self.tracks[2])
+
+        self.assertAlbumFeatures(Decimal('0.200'))
+
+    def test_tracks_cleared(self):
+        self.album.tracks.add(*self.tracks)
+
+        self.album.tracks.clear()
+
+        self.assertAlbumFeatures(None)
+        self.assertEqual((self.album.features_count, self.album.danceability_sum), (0, 0))
+
+    def test_album_cleared_from_the_track_side(self):
+        self.album.tracks.add(*self.tracks[:2])
+
+        self.tracks[1].album_set.clear()
+
+        self.assertAlbumFeatures(Decimal('0.100'))
+
+    def test_same_queries_whatever_the_album_size(self):
+        self.album.tracks.add(*TrackFactory.create_batch(30))
+
+        # Tracks totals, then sums update, albums read and means update
+        # inside a savepoint.
+        with self.assertNumQueries(6):
+            update_albums_totals([self.album.id], [track.id for track in self.tracks])
+
+
+class TestReconcileAlbumsFeatures(TestCase):
+
+    def setUp(self):
+        self.album = AlbumFactory(tracks=[TrackFactory(**_features(value)) for value in ('0.100', '0.300')])
+        self.in_step = AlbumFactory(tracks=[TrackFactory()])
+
+    def drift(self):
+        Album.objects.filter(id=self.album.id).update(features_count=5, energy_sum=1, danceability=None)
+
+    def test_nothing_drifted(self):
+
+        self.assertEqual(reconcile_albums_features(), 0)
+
+    def test_drifted_album_fixed(self):
+        self.drift()
+
+        self.assertEqual(reconcile_albums_features(), 1)
+
+        self.album.refresh_from_db()
+        self.assertEqual((self.album.features_count, self.album.energy_sum), (2, 400))
+        self.assertEqual(self.album.get_features, dict.fromkeys(FEATURES_NAMES, Decimal('0.200')))
+        self.assertEqual(reconcile_albums_features(), 0)
+
+    def test_track_deleted_by_cascade(self):
+        self.in_step.tracks.get().delete()
+
+        self.assertEqual(reconcile_albums_features(), 1)
+
+        self.in_step.refresh_from_db()
+        self.assertFalse(self.in_step.has_features)
 
-        album_features = create_album_features(self.tracks, self.album)
+    def test_check_only(self):
+        self.drift()
 
-        self.assertEqual(album_features.get_features, self.features_values)
-        self.assertEqual(AlbumFeatures.objects.first().album, self.album)
-        self.assertEqual(AlbumFeatures.objects.first().features.get_features, self.features_values)
+        self.assertEqual(reconcile_albums_features(fix=False), 1)
+        self.assertEqual(reconcile_albums_features(fix=False), 1)
 
+    def test_reconcile_command(self):
+        self.drift()
+        out = StringIO()
 
-class TestCreateTracksForAlbum(TestCase):
+        call_command('reconcile_album_features', '--check', stdout=out)
+        call_command('reconcile_album_features', stdout=out)
+
+        self.assertIn('1 albums drifted', out.getvalue())
+        self.assertIn('Fixed 1 drifted albums', out.getvalue())
+
+
+class TestFetchConcurrently(TestCase):
+
+    def test_results_under_call_keys(self):
+
+        calls = {
+            key: (lambda value: value * 2, (key,))
+            for key in range(10)
+        }
+
+        results = fetch_concurrently(calls, max_workers=4)
+
+        self.assertEqual(results, {key: key * 2 for key in range(10)})
+
+    def test_calls_run_at_the_same_time(self):
+
+        barrier = threading.Barrier(3, timeout=5)
+        calls = {key: (barrier.wait, ()) for key in range(3)}
+
+        results = fetch_concurrently(calls, max_workers=3)
+
+        self.assertEqual(len(results), 3)
+
+    @patch('spotify_app.fetch.connection')
+    def test_worker_connections_closed(self, connection_mock):
+
+        calls = {key: (lambda value: value, (key,)) for key in range(3)}
+
+        fetch_concurrently(calls, max_workers=3)
+        self.assertEqual(connection_mock.close.call_count, 3)
+
+        fetch_concurrently(calls, max_workers=1)
+        self.assertEqual(connection_mock.close.call_count, 3)
+
+    def test_errors_are_collected(self):
+
+        def fail(key):
+            raise KeyError(key)
+
+        finished = []
+        calls = {
+            'first': (fail, ('first',)),
+            'second': (finished.append, ('second',)),
+            'third': (fail, ('third',)),
+        }
+
+        with self.assertRaises(FetchError) as error:
+            fetch_concurrently(calls, max_workers=2)
+
+        self.assertEqual(set(error.exception.errors), {'first', 'third'})
+        self.assertEqual(finished, ['second'])
+
+    def test_throttled_call_raises_rate_limit(self):
+
+        def throttled(retry_after):
+            raise SpotifyRateLimited(retry_after)
+
+        calls = {
+            'first': (throttled, (2,)),
+            'second': (throttled, (30,)),
+            'third': (lambda: 1 / 0, ()),
+        }
+
+        for max_workers in (1, 3):
+            with self.assertRaises(SpotifyRateLimited) as error:
+                fetch_concurrently(calls, max_workers=max_workers)
+
+            self.assertEqual(error.exception.retry_after, 30)
+            self.assertEqual(set(error.exception.__cause__.errors), {'first', 'second', 'third'})
+
+
+class TestCreateAlbumTracksAndFeatures(TestCase):
 
     def setUp(self):
-        self.request = RequestFactory()
-        self.tracks = [
-            TrackFactory(id=str(id))
-            for id in range(1, 6)
+        self.request_factory = get_request_factory_with_session()
+        patch_app_token(self)
+        self.artist = {
+            'id': '08GQAI4eElDnROBrJRGE0X',
+            'name': 'Fleetwood Mac'
+        }
+        self.album_id = '1bt6q2SruMsBtcerNVtpZB'
+        self.track_ids = [str(x) for x in range(60)]
+        self.existing_tracks = [
+            TrackFactory(id=track_id)
+            for track_id in self.track_ids[:5]
         ]
-        self.album_data = {
+        self.response = {
+            'artists': [self.artist],
+            'id': self.album_id,
+            'name': 'Rumours',
+            'images': [{}, {'url': 'https://dummy.url.com'}],
             'tracks': {
-                'items': []
+                'items': [{'id': track_id} for track_id in self.track_ids[:50]],
+                'total': 60
             }
         }
+        self.features = {name: 0.5 for name in FEATURES_NAMES}
+
+    def _tracks_callback(self, request):
+        ids = request.url.split('ids=')[1].split(',')
+        body = {
+            'tracks': [
+                {'id': track_id, 'name': f'track {track_id}', 'artists': [self.artist]}
+                for track_id in ids
+            ]
+        }
+        return 200, {}, json.dumps(body)
 
-    def test_get_tracks_already_in_db(self):
+    def _audio_features_callback(self, request):
+        ids = request.url.split('ids=')[1].split(',')
+        body = {
+            'audio_features': [dict(id=track_id, **self.features) for track_id in ids]
+        }
+        return 200, {}, json.dumps(body)
 
-        self.album_data['tracks']['items'].extend([{'id': track.id} for track in self.tracks])
+    def _add_responses(self):
+        responses.add(
+            responses.GET,
+            API_ENDPOINTS["album"] + self.album_id,
+            json=self.response,
+            status=200
+        )
+        responses.add(
+            responses.GET,
+            API_ENDPOINTS["album_tracks"][0] + self.album_id + API_ENDPOINTS["album_tracks"][1] + '50',
+            json={'items': [{'id': track_id} for track_id in self.track_ids[50:]]},
+            status=200
+        )
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_tracks"],
+            callback=self._tracks_callback
+        )
 
-        tracks_list = create_tracks_from_album(self.request, self.album_data)
+    def test_fetch_all_album_pages(self):
 
-        self.assertEqual(tracks_list, self.tracks)
+        with responses.RequestsMock() as mocked:
+            mocked.add(
+                responses.GET,
+                API_ENDPOINTS["album_tracks"][0] + self.album_id + API_ENDPOINTS["album_tracks"][1] + '50',
+                json={'items': [{'id': track_id} for track_id in self.track_ids[50:]]},
+                status=200
+            )
+            items = fetch_album_track_items(self.request_factory, self.response)
 
-    @patch.object(services, 'create_track_and_features')
-    def test_create_new_tracks(self, mock_create_track_and_features):
+        self.assertEqual([item['id'] for item in items], self.track_ids)
 
-        self.album_data['tracks']['items'].extend([{'id': str(x) for x in range(6, 10)}])
+    @responses.activate
+    def test_fetch_album_only_missing_tracks(self):
 
-        create_tracks_from_album(self.request, self.album_data)
+        self._add_responses()
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_audio_features"],
+            callback=self._audio_features_callback
+        )
 
-        mock_create_track_and_features.assert_called()
+        album_data, tracks_data, audio_features = fetch_album(self.request_factory, self.album_id)
 
-    @patch.object(services, 'create_track_and_features')
-    def test_get_tracks_and_create_new_tracks(self, mock_create_track_and_features):
+        self.assertEqual(len(album_data['tracks']['items']), 60)
+        self.assertEqual([track['id'] for track in tracks_data], self.track_ids[5:])
+        self.assertEqual([features['id'] for features in audio_features], self.track_ids[5:])
+        # album, next page, two chunks of tracks and one of audio features
+        self.assertEqual(len(responses.calls), 5)
 
-        self.album_data['tracks']['items'].extend([{'id': track.id} for track in self.tracks])
-        self.album_data['tracks']['items'].extend([{'id': '11'}])
+    @responses.activate
+    def test_create_album_tracks_and_features(self):
 
-        tracks_list = create_tracks_from_album(self.request, self.album_data)
+        self._add_responses()
+        responses.add_callback(
+            responses.GET,
+            API_ENDPOINTS["several_audio_features"],
+            callback=self._audio_features_callback
+        )
 
-        self.assertEqual(len(tracks_list), 6)
-        self.assertEqual(tracks_list[:5], self.tracks)
-        mock_create_track_and_features.assert_called_once_with(self.request, '11')
+        album = create_album_tracks_and_features(self.request_factory, self.album_id)
 
+        self.assertEqual(album.id, self.album_id)
+        self.assertEqual(album.tracks.count(), 60)
+        self.assertEqual(Track.objects.count(), 60)
+        self.assertEqual(Track.objects.filter(danceability__isnull=False).count(), 60)
+        self.assertTrue(Album.objects.get().has_features)
 
-class TestCreateAlbumTracksAndFeatures(TestCase):
+    @responses.activate
+    def test_failed_request_does_not_save_album(self):
+
+        self._add_responses()
+        responses.add(
+            responses.GET,
+            API_ENDPOINTS["several_audio_features"],
+            json={'error': {'status': 500, 'message': 'Server error'}},
+            status=500
+        )
+
+        with self.assertRaises(FetchError):
+            create_album_tracks_and_features(self.request_factory, self.album_id)
+
+        self.assertFalse(Album.objects.exists())
+        self.assertEqual(Track.objects.count(), 5)
+
+
+class TestSingleFlight(TestCase):
 
     def setUp(self):
-        self.request = RequestFactory()
+        self.flight = SingleFlight("test:flight:", lease=60, wait=1, poll_interval=0.01)
 
-    @patch.object(services, 'create_album_features')
-    @patch.object(services, 'create_tracks_from_album')
-    @patch.object(services, 'create_album')
-    def test_create_album_tracks_and_features(self,
-                                              mock_create_album,
-                                              mock_create_tracks_from_album,
-                                              mock_create_album_features):
+    def test_concurrent_calls_share_one_build(self):
+        started = threading.Event()
+        results = []
 
-        album = AlbumFactory()
-        album_data = {'dummy': 'data'}
-        album_id = '123'
-        mock_create_album.return_value = album, album_data
-        tracks = [TrackFactory() for _ in range(5)]
-        mock_create_tracks_from_album.return_value = tracks
+        def build():
+            started.set()
+            time.sleep(0.1)
+            return "album"
+
+        def call():
+            results.append(self.flight.do("album:1", build=build_mock, ready=lambda: None))
+
+        build_mock = Mock(side_effect=build)
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        build_mock.assert_called_once()
+        self.assertEqual(results, ["album"] * 5)
+
+    def test_waiters_share_failure(self):
+        started = threading.Event()
+        errors = []
+
+        def build():
+            started.set()
+            time.sleep(0.1)
+            raise KeyError("tracks")
+
+        def call():
+            try:
+                self.flight.do("album:1", build=build, ready=lambda: None)
+            except KeyError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
-        create_album_tracks_and_features(self.request, album_id)
+        self.assertEqual(len(errors), 3)
+        self.assertIsNone(cache.get("test:flight:album:1"))
+
+    def test_wait_for_other_worker(self):
+        cache.add("test:flight:album:1", "other-worker", 60)
+        ready = Mock(side_effect=[None, None, "album"])
+        build = Mock()
+
+        result = self.flight.do("album:1", build=build, ready=ready)
+
+        self.assertEqual(result, "album")
+        build.assert_not_called()
+
+    def test_other_worker_takes_too_long(self):
+        cache.add("test:flight:album:1", "other-worker", 60)
+
+        with self.assertRaises(SingleFlightTimeout):
+            self.flight.do("album:1", build=Mock(), ready=lambda: None)
+
+    def test_lease_released_after_build(self):
+
+        self.flight.do("album:1", build=lambda: "album", ready=lambda: None)
+
+        self.assertIsNone(cache.get("test:flight:album:1"))
+
+    @patch('spotify_app.services.create_album_tracks_and_features')
+    def test_album_in_db_not_built(self, create_album_mock):
+        album = AlbumFactory()
 
-        mock_create_album.assert_called_once_with(self.request, album_id)
-        mock_create_tracks_from_album.assert_called_once_with(self.request, album_data)
-        mock_create_album_features.called_once_with(tracks, album)
+        self.assertEqual(get_or_create_album(Mock(), album.id), album)
+        create_album_mock.assert_not_called()
@@ -0,0 +1,234 @@
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import responses
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from spotify_app import tasks
+from spotify_app.api_endpoints import API_ENDPOINTS, SPOTIFY_TOKEN_URL
+from spotify_app.tokens import AppToken, TokenManager, TokenRefused, app_token, token_manager
+
+
+def _token_answer(access_token, **extra):
+    return dict(access_token=access_token, token_type='Bearer', expires_in=3600, **extra)
+
+
+class TestTokenManager(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.manager = TokenManager(margin=300, lease=5, wait=2)
+
+    def session(self, expires_in=60, refresh_token='refresh-1'):
+        return {
+            'access_token': 'old',
+            'refresh_token': refresh_token,
+            'token_expires_at': time.time() + expires_in,
+        }
+
+    @responses.activate
+    def test_fresh_token_kept(self):
+        session = self.session(expires_in=3600)
+
+        self.assertTrue(self.manager.ensure_fresh(session))
+
+        self.assertEqual(session['access_token'], 'old')
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_refreshed_ahead_of_expiry(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('new'))
+        session = self.session()
+
+        self.assertTrue(self.manager.ensure_fresh(session))
+
+        self.assertEqual(session['access_token'], 'new')
+        self.assertEqual(session['refresh_token'], 'refresh-1')
+        self.assertGreater(session['token_expires_at'], time.time() + 3000)
+        self.assertIn('grant_type=refresh_token', responses.calls[0].request.body)
+
+    @responses.activate
+    def test_new_refresh_token_saved(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('new', refresh_token='refresh-2'))
+        session = self.session()
+
+        self.manager.refresh(session)
+
+        self.assertEqual(session['refresh_token'], 'refresh-2')
+
+    @responses.activate
+    def test_refused_refresh_drops_the_token(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json={'error': 'invalid_grant'}, status=400)
+        session = self.session(expires_in=-1)
+
+        self.assertFalse(self.manager.ensure_fresh(session))
+
+        self.assertEqual(session, {})
+
+    @responses.activate
+    def test_refused_refresh_ahead_of_expiry(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json={'error': 'invalid_grant'}, status=400)
+        session = self.session()
+
+        self.assertFalse(self.manager.ensure_fresh(session))
+
+        self.assertEqual(session, {})
+
+    @responses.activate
+    def test_without_refresh_token(self):
+        session = self.session(refresh_token=None)
+
+        self.assertFalse(self.manager.refresh(session))
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_refreshes_of_one_login_coalesced(self):
+        def slow_grant(request):
+            time.sleep(0.2)
+            return 200, {}, '{"access_token": "new", "expires_in": 3600}'
+        responses.add_callback(responses.POST, SPOTIFY_TOKEN_URL, callback=slow_grant)
+        sessions = [self.session() for _ in range(4)]
+
+        threads = [threading.Thread(target=self.manager.refresh, args=[session]) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # A request which loaded its session before the refresh.
+        late_session = self.session()
+        self.manager.refresh(late_session)
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual([session['access_token'] for session in sessions + [late_session]], ['new'] * 5)
+
+
+class TestTokenRefreshInRequests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        session = self.client.session
+        session['access_token'] = 'old'
+        session['refresh_token'] = 'refresh-1'
+        session['token_expires_at'] = time.time() - 1
+        session.save()
+
+    @responses.activate
+    @patch('spotify_app.views.get_user_recently_played', return_value=[])
+    def test_expired_token_refreshed_instead_of_redirect(self, mock_func):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('new'))
+
+        response = self.client.get(reverse('recently_played'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['access_token'], 'new')
+
+    @responses.activate
+    def test_redirected_when_refresh_refused(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json={'error': 'invalid_grant'}, status=400)
+
+        response = self.client.get(reverse('recently_played'))
+
+        self.assertRedirects(response, reverse('callback'))
+        self.assertNotIn('access_token', self.client.session)
+
+    @responses.activate
+    def test_redirected_when_refused_ahead_of_expiry(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json={'error': 'invalid_grant'}, status=400)
+        session = self.client.session
+        session['token_expires_at'] = time.time() + 60
+        session.save()
+
+        response = self.client.get(reverse('recently_played'))
+
+        self.assertRedirects(response, reverse('callback'))
+        self.assertRedirects(self.client.get(reverse('recently_played')), reverse('callback'))
+
+    @responses.activate
+    def test_redirected_when_401_and_refresh_refused(self):
+        responses.add(responses.GET, API_ENDPOINTS['user_recently_played'], json={'error': {'status': 401}}, status=401)
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json={'error': 'invalid_grant'}, status=400)
+        session = self.client.session
+        session['token_expires_at'] = time.time() + 3600
+        session.save()
+
+        response = self.client.get(reverse('recently_played'))
+
+        self.assertRedirects(response, reverse('callback'))
+        self.assertNotIn('access_token', self.client.session)
+
+    @patch.object(token_manager, 'refresh', return_value=True)
+    def test_still_401_after_refresh(self, refresh_mock):
+        request = Mock(session={'access_token': 'old'})
+        client = Mock(get=Mock(return_value=Mock(status_code=401)))
+
+        with patch.object(tasks, 'spotify_client', client), self.assertRaises(TokenRefused):
+            tasks.get_response(request, 'https://api.spotify.com/v1/me')
+
+        self.assertEqual(client.get.call_count, 2)
+        self.assertEqual(request.session, {})
+
+    @patch.object(token_manager, 'refresh')
+    def test_sent_again_after_401(self, refresh_mock):
+        request = Mock(session={'access_token': 'old'})
+        refresh_mock.side_effect = lambda session: session.update(access_token='new') or True
+        client = Mock(get=Mock(side_effect=[Mock(status_code=401), Mock(status_code=200)]))
+
+        with patch.object(tasks, 'spotify_client', client):
+            resp = tasks.get_response(request, 'https://api.spotify.com/v1/me')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            client.get.call_args[1]['headers'], {'Authorization': 'Bearer new'})
+
+
+class TestAppToken(TestCase):
+
+    def setUp(self):
+        self.token = AppToken(margin=300)
+
+    @responses.activate
+    def test_client_credentials_grant_kept_in_the_process(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('app-1'))
+
+        self.assertEqual([self.token.get(), self.token.get()], ['app-1', 'app-1'])
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertIn('grant_type=client_credentials', responses.calls[0].request.body)
+        self.assertTrue(responses.calls[0].request.headers['Authorization'].startswith('Basic '))
+
+    @responses.activate
+    def test_refreshed_ahead_of_expiry(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('app-1'))
+        self.token.get()
+
+        responses.replace(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('app-2'))
+        with patch.object(time, 'time', return_value=time.time() + 3400):
+            self.assertEqual(self.token.get(), 'app-2')
+
+    @responses.activate
+    def test_refused_token_replaced(self):
+        responses.add(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('app-1'))
+        self.token.get()
+
+        responses.replace(responses.POST, SPOTIFY_TOKEN_URL, json=_token_answer('app-2'))
+
+        self.assertEqual(self.token.get(stale_token='app-1'), 'app-2')
+        self.assertEqual(self.token.get(stale_token='app-1'), 'app-2')
+        self.assertEqual(len(responses.calls), 2)
+
+    @patch.object(app_token, 'get')
+    def test_catalogue_requests_sent_with_app_token(self, get_mock):
+        get_mock.side_effect = lambda stale_token=None: 'app-2' if stale_token else 'app-1'
+        client = Mock(get=Mock(side_effect=[Mock(status_code=401), Mock(status_code=200)]))
+        request = Mock(session={'access_token': 'user'})
+
+        with patch.object(tasks, 'spotify_client', client):
+            tasks.get_track(request, 'track-1')
+
+        self.assertEqual(
+            [call[1]['headers'] for call in client.get.call_args_list],
+            [{'Authorization': 'Bearer app-1'}, {'Authorization': 'Bearer app-2'}],
+        )
@@ -1,21 +1,33 @@
-from unittest.mock import patch
-
-from django.urls import reverse
-from django.test import TestCase
-
-from spotify_app.models import Features
+import base64
+import json
+from decimal import Decimal
+from unittest.mock import AsyncMock, patch
+
+from django.core.cache import cache
+from django.urls import path, reverse
+from django.test import TestCase, override_settings
+from django.utils.http import http_date
+
+from spotify_app.fetch import fetch_concurrently
+from spotify_app.models import FEATURES_NAMES, IngestionJob, Track
+from spotify_app.ratelimit import SpotifyRateLimited
+from spotify_app import analytics
 from spotify_app import api_endpoints
+from spotify_app import async_tasks
 from spotify_app import selectors
 from spotify_app import tasks
+from spotify_app import urls
+from spotify_app import views
+from spotify_project import urls as project_urls
 from .factories import (
     AlbumFactory,
-    AlbumFeaturesFactory,
     ArtistFactory,
     SearchArtistFactory,
     TrackFactory,
-    TrackFeaturesFactory,
 )
 
+NO_FEATURES = {name: None for name in FEATURES_NAMES}
+
 
 def _add_access_token_to_client_session(client):
     session = client.session
@@ -106,6 +118,39 @@ class HomePageView(TestCase):
             self.assertContains(response, album_url)
 
 
+class RateLimitedView(TestCase):
+
+    @patch('spotify_app.views.get_new_releases')
+    def test_service_unavailable_while_throttled(self, get_new_releases_mock):
+        _add_access_token_to_client_session(self.client)
+        get_new_releases_mock.side_effect = SpotifyRateLimited(2.5)
+
+        response = self.client.get(
+            reverse('index')
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertTemplateUsed(response, 'rate_limited.html')
+
+    @patch('spotify_app.views.get_new_releases')
+    def test_service_unavailable_while_throttled_in_concurrent_fetch(self, get_new_releases_mock):
+        _add_access_token_to_client_session(self.client)
+
+        def throttled():
+            raise SpotifyRateLimited(4.2)
+
+        get_new_releases_mock.side_effect = lambda request: fetch_concurrently(
+            {'first': (throttled, ()), 'second': (list, ())}, max_workers=2)
+
+        response = self.client.get(
+            reverse('index')
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+
+
 class UserRecentlyPlayedView(TestCase):
 
     def setUp(self):
@@ -150,18 +195,11 @@ class UserRecentlyPlayedView(TestCase):
 class TrackTableView(TestCase):
 
     def setUp(self):
-        self.tracks_and_features = [
-            TrackFeaturesFactory()
-            for _ in range(10)
-        ]
         self.tracks = [
-            x.track
-            for x in self.tracks_and_features
-        ]
-        self.features = [
-            x.features
-            for x in self.tracks_and_features
+            TrackFactory()
+            for _ in range(10)
         ]
+        self.features = self.tracks
 
         _add_access_token_to_client_session(self.client)
 
@@ -190,7 +228,7 @@ class TrackTableView(TestCase):
             self.assertContains(response, track.artist.name)
 
     def test_all_features_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('tracks_table')
@@ -200,7 +238,7 @@ class TrackTableView(TestCase):
             self.assertContains(response, feat_name.capitalize())
 
     def test_all_features_values_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('tracks_table')
@@ -211,22 +249,81 @@ class TrackTableView(TestCase):
                 x_feat = getattr(feature, feat_name)
                 self.assertContains(response, x_feat)
 
+    def test_sorted_by_feature(self):
+        response = self.client.get(
+            reverse('tracks_table'), {'sort': 'energy', 'dir': 'desc'}
+        )
+
+        energies = [track.energy for track in response.context['tracks']]
+        self.assertEqual(energies, sorted(energies, reverse=True))
+        self.assertEqual(response.context['sort'], 'energy')
+        self.assertEqual(response.context['dir'], 'desc')
+
+    def test_unknown_sort_falls_back_to_name(self):
+        response = self.client.get(
+            reverse('tracks_table'), {'sort': 'id; drop table', 'dir': 'up', 'after': 'garbage'}
+        )
+
+        names = [track.name for track in response.context['tracks']]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual((response.context['sort'], response.context['dir']), ('name', 'asc'))
+
+    def test_broken_or_foreign_cursor_gives_first_page(self):
+        first_page = [track.pk for track in self.client.get(
+            reverse('tracks_table'), {'sort': 'energy'}).context['tracks']]
+        name_cursor = selectors.encode_cursor('name', ['Some name', 'some-id'], 25)
+        cursors = [
+            base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            for values in (
+                ['energy', 'abc', 'x', 25], ['energy', {'a': 1}, 'x', 25], ['energy', None, 'x', 25],
+                ['energy', 'NaN', 'x', 25], ['energy', '0.5', None, 25], ['energy', '0.5', 'x'],
+                ['energy', '0.5', 'x', '25'], ['energy', '0.5', 'x', -1], ['energy', '0.5', 'x', True],
+                ['abc', 'x'], [None, 'x'],
+            )
+        ] + [name_cursor]
+
+        for cursor in cursors:
+            for sort in ('energy', 'name', 'artist'):
+                response = self.client.get(reverse('tracks_table'), {'sort': sort, 'after': cursor})
+
+                self.assertEqual(response.status_code, 200)
+                if sort == 'energy':
+                    self.assertEqual([track.pk for track in response.context['tracks']], first_page)
+
+    @patch.object(selectors, 'TABLE_PAGE_SIZE', 3)
+    def test_pages_follow_each_other(self):
+        # Ties on the sort column are broken by the track id.
+        for _ in range(5):
+            TrackFactory(danceability=Decimal('0.500'))
+
+        rows, after = [], None
+        while True:
+            params = {'sort': 'danceability', 'dir': 'desc'}
+            if after:
+                params['after'] = after
+            response = self.client.get(reverse('tracks_table'), params)
+            rows.extend(response.context['tracks'])
+            after = response.context['next_after']
+            if after is None:
+                break
+            self.assertContains(response, 'after=' + after)
+
+        expected = sorted(
+            Track.objects.all(),
+            key=lambda track: (track.danceability, track.id),
+            reverse=True,
+        )
+        self.assertEqual([row.pk for row in rows], [row.pk for row in expected])
+
 
 class AlbumTableView(TestCase):
 
     def setUp(self):
-        self.albums_and_features = [
-            AlbumFeaturesFactory()
-            for _ in range(10)
-        ]
         self.albums = [
-            x.album
-            for x in self.albums_and_features
-        ]
-        self.features = [
-            x.features
-            for x in self.albums_and_features
+            AlbumFactory()
+            for _ in range(10)
         ]
+        self.features = self.albums
 
         _add_access_token_to_client_session(self.client)
 
@@ -255,7 +352,7 @@ class AlbumTableView(TestCase):
             self.assertContains(response, album.artist.name)
 
     def test_all_features_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('albums_table')
@@ -265,7 +362,7 @@ class AlbumTableView(TestCase):
             self.assertContains(response, feat_name.capitalize())
 
     def test_all_features_values_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('albums_table')
@@ -276,16 +373,60 @@ class AlbumTableView(TestCase):
                 x_feat = getattr(feature, feat_name)
                 self.assertContains(response, x_feat)
 
+    def test_sorted_by_artist(self):
+        response = self.client.get(
+            reverse('albums_table'), {'sort': 'artist'}
+        )
+
+        artists = [album.artist.name for album in response.context['albums']]
+        self.assertEqual(artists, sorted(artists))
+
+    @patch.object(selectors, 'TABLE_PAGE_SIZE', 4)
+    def test_next_page_link(self):
+        response = self.client.get(
+            reverse('albums_table'), {'sort': 'valence'}
+        )
+
+        self.assertEqual(len(response.context['albums']), 4)
+        self.assertContains(response, 'Next page')
+
+        response = self.client.get(
+            reverse('albums_table'), {'sort': 'valence', 'after': response.context['next_after']}
+        )
+
+        self.assertContains(response, 'First page')
+        self.assertContains(response, '<td scope="row">5</td>')
+        self.assertNotContains(response, '<td scope="row">1</td>')
+
+    def test_artist_renamed_moves_in_the_artist_sort(self):
+        artist = self.albums[0].artist
+        artist.name = 'zzz last'
+        artist.save()
+
+        response = self.client.get(reverse('albums_table'), {'sort': 'artist'})
+
+        self.assertEqual(response.context['albums'][-1].pk, self.albums[0].pk)
+
 
 class TrackDetailView(TestCase):
 
     def setUp(self):
-        self.track_and_features = TrackFeaturesFactory()
-        self.track = self.track_and_features.track
-        self.features = self.track_and_features.features
+        self.track = TrackFactory()
+        self.features = self.track
 
         _add_access_token_to_client_session(self.client)
 
+    def test_track_without_features(self):
+        track = TrackFactory(**NO_FEATURES)
+
+        response = self.client.get(
+            reverse('track', args=[track.id])
+        )
+
+        self.assertContains(response, track.name)
+        self.assertContains(response, 'Spotify has no audio features for this track.')
+        self.assertNotContains(response, 'Chart - track features')
+
     def test_url_and_template(self):
         response = self.client.get(
             reverse('track', args=[self.track.id])
@@ -309,7 +450,7 @@ class TrackDetailView(TestCase):
         self.assertContains(response, self.track.artist.name)
 
     def test_all_features_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('track', args=[self.track.id])
@@ -319,7 +460,7 @@ class TrackDetailView(TestCase):
             self.assertContains(response, feat_name.capitalize())
 
     def test_all_features_values_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('track', args=[self.track.id])
@@ -339,36 +480,113 @@ class TrackDetailView(TestCase):
         for numb in features_values:
             self.assertContains(response, numb)
 
-    @patch.object(selectors, 'create_track_and_features')
-    def test_create_track_when_does_not_exist(self, create_track_and_features_mock):
+    def test_enqueue_track_when_does_not_exist(self):
         track_id = 'x233Ffs34kskzz'
 
-        self.client.get(
+        response = self.client.get(
             reverse('track', args=[track_id])
         )
 
-        track = TrackFactory(id=track_id)
-        track_and_features = TrackFeaturesFactory(track=track)
-        create_track_and_features_mock.return_value = track_and_features
+        self.assertEqual(response.status_code, 202)
+        self.assertTemplateUsed(response, 'ingestion_pending.html')
+        self.assertContains(response, reverse('track_status', args=[track_id]), status_code=202)
+        job = IngestionJob.objects.get()
+        self.assertEqual((job.kind, job.object_id), (IngestionJob.TRACK, track_id))
 
-        create_track_and_features_mock.assert_called_once()
+        track = TrackFactory(id=track_id)
 
         response = self.client.get(
             reverse('track', args=[track_id])
         )
         self.assertContains(response, track.name)
 
+    def test_pending_page_script_leaves_window_status_alone(self):
+        # A global `status` is window.status, which browsers turn into a string.
+        response = self.client.get(
+            reverse('track', args=['x233Ffs34kskzz'])
+        )
+
+        script = response.content.decode().split('<script>')[-1]
+        self.assertIn('(function() {', script)
+        self.assertNotRegex(script, r'var status\b')
+        self.assertIn('statusElement.dataset.statusUrl', script)
+
+    def test_status_of_track_being_collected(self):
+        track_id = 'x233Ffs34kskzz'
+        self.client.get(reverse('track', args=[track_id]))
+
+        response = self.client.get(reverse('track_status', args=[track_id]))
+        self.assertEqual(response.json(), {"status": "pending", "attempts": 0, "ready": False})
+
+        response = self.client.get(reverse('track_status', args=[self.track.id]))
+        self.assertEqual(response.json(), {"status": "done", "ready": True})
+
+
+class SimilarTracksView(TestCase):
+
+    def setUp(self):
+        self.track = TrackFactory(**{name: Decimal('0.5') for name in FEATURES_NAMES})
+        self.close = TrackFactory(**{name: Decimal('0.6') for name in FEATURES_NAMES})
+        self.far = TrackFactory(**{name: Decimal('0.9') for name in FEATURES_NAMES})
+        matrix = analytics.FeatureMatrix()
+        patcher = patch.multiple(
+            selectors, feature_matrix=matrix, nearest_tracks=analytics.NearestTracks(matrix)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_closest_tracks_first(self):
+
+        response = self.client.get(reverse('similar_tracks', args=[self.track.id]))
+
+        self.assertEqual(response.status_code, 200)
+        similar = response.json()['similar']
+        self.assertEqual([row['id'] for row in similar], [self.close.id, self.far.id])
+        self.assertEqual(similar[0]['name'], self.close.name)
+        self.assertEqual(similar[0]['artist'], self.close.artist.name)
+        self.assertAlmostEqual(similar[0]['distance'], 0.1 * 7 ** 0.5, places=3)
+
+    def test_number_of_tracks(self):
+
+        response = self.client.get(reverse('similar_tracks', args=[self.track.id]), {'k': 1})
+
+        self.assertEqual([row['id'] for row in response.json()['similar']], [self.close.id])
+
+    def test_track_without_features(self):
+        track = TrackFactory(**{name: None for name in FEATURES_NAMES})
+
+        response = self.client.get(reverse('similar_tracks', args=[track.id]))
+
+        self.assertEqual(response.json()['similar'], [])
+
+    def test_missing_track(self):
+
+        response = self.client.get(reverse('similar_tracks', args=['missing']))
+
+        self.assertEqual(response.status_code, 404)
+
 
 class AlbumDetailView(TestCase):
 
     def setUp(self):
         self.tracks = [TrackFactory() for _ in range(13)]
         self.album = AlbumFactory.create(tracks=self.tracks)
-        self.album_and_features = AlbumFeaturesFactory.create(album=self.album)
-        self.features = self.album_and_features.features
+        self.features = self.album
 
         _add_access_token_to_client_session(self.client)
 
+    def test_album_without_features(self):
+        tracks = [TrackFactory(**NO_FEATURES) for _ in range(2)]
+        album = AlbumFactory.create(tracks=tracks, **NO_FEATURES)
+
+        response = self.client.get(
+            reverse('album', args=[album.id])
+        )
+
+        self.assertContains(response, tracks[0].name)
+        self.assertContains(response, 'Spotify has no audio features for the tracks of this album.')
+        self.assertNotContains(response, 'Chart - album features')
+
     def test_url_and_template(self):
         response = self.client.get(
             reverse('album', args=[self.album.id])
@@ -416,7 +634,7 @@ class AlbumDetailView(TestCase):
             self.assertContains(response, track_url)
 
     def test_all_features_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('album', args=[self.album.id])
@@ -426,7 +644,7 @@ class AlbumDetailView(TestCase):
             self.assertContains(response, feat_name.capitalize())
 
     def test_all_features_values_in_html(self):
-        features_names = Features().get_fields_names
+        features_names = list(FEATURES_NAMES)
 
         response = self.client.get(
             reverse('album', args=[self.album.id])
@@ -446,25 +664,121 @@ class AlbumDetailView(TestCase):
         for feature_value in features_values:
             self.assertContains(response, feature_value)
 
-    @patch.object(selectors, 'create_album_tracks_and_features')
-    def test_create_album_when_does_not_exist(self, create_album_tracks_and_features_mock):
+    def test_enqueue_album_when_does_not_exist(self):
         album_id = '123hkaCXX123kk'
 
-        self.client.get(
-            reverse('album', args=[album_id])
-        )
+        for _ in range(2):
+            response = self.client.get(
+                reverse('album', args=[album_id])
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertTemplateUsed(response, 'ingestion_pending.html')
 
-        album = AlbumFactory(id=album_id)
-        album_and_features = AlbumFeaturesFactory(album=album)
-        create_album_tracks_and_features_mock.return_value = album_and_features
+        job = IngestionJob.objects.get()
+        self.assertEqual((job.kind, job.object_id), (IngestionJob.ALBUM, album_id))
 
-        create_album_tracks_and_features_mock.assert_called_once()
+        album = AlbumFactory(id=album_id)
 
         response = self.client.get(
             reverse('album', args=[album_id])
         )
         self.assertContains(response, album.name)
 
+    def test_status_of_album_never_requested(self):
+        response = self.client.get(reverse('album_status', args=['123hkaCXX123kk']))
+
+        self.assertEqual(response.json(), {"status": "missing", "ready": False})
+
+
+class ConditionalGetViews(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.track = TrackFactory()
+        self.album = AlbumFactory(tracks=[self.track])
+
+        _add_access_token_to_client_session(self.client)
+
+    def assertRevalidated(self, url, **headers):
+        response = self.client.get(url, **headers)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return response
+
+    def test_tables_validators(self):
+        for url in (reverse('tracks_table'), reverse('albums_table')):
+            response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'].startswith('"'))
+            self.assertIn('Last-Modified', response)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+            self.assertRevalidated(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertRevalidated(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+    def test_tables_modified_since(self):
+        response = self.client.get(reverse('tracks_table'), HTTP_IF_MODIFIED_SINCE=http_date(0))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_table_etag_changes_with_the_catalogue(self):
+        def etag():
+            return self.client.get(reverse('tracks_table'))['ETag']
+
+        etags = [etag()]
+        TrackFactory()
+        etags.append(etag())
+        Track.objects.filter(pk=self.track.pk).delete()
+        etags.append(etag())
+        artist = Track.objects.first().artist
+        artist.name = 'Renamed'
+        artist.save()
+        etags.append(etag())
+
+        self.assertEqual(len(set(etags)), 4)
+        response = self.client.get(reverse('tracks_table'), HTTP_IF_NONE_MATCH=etags[0])
+        self.assertEqual(response.status_code, 200)
+
+    def test_table_etag_survives_the_cache(self):
+        TrackFactory()
+        etag = self.client.get(reverse('tracks_table'))['ETag']
+        Track.objects.filter(pk=self.track.pk).delete()
+        cache.clear()
+
+        response = self.client.get(reverse('tracks_table'), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_details_validators(self):
+        for url in (reverse('track', args=[self.track.id]), reverse('album', args=[self.album.id])):
+            response = self.client.get(url)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('private', response['Cache-Control'])
+            self.assertIn('max-age=300', response['Cache-Control'])
+
+            self.assertRevalidated(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_detail_etag_changes_with_the_album(self):
+        url = reverse('album', args=[self.album.id])
+        etag = self.client.get(url)['ETag']
+
+        self.album.name = 'Renamed'
+        self.album.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_pending_detail_not_cached(self):
+        response = self.client.get(reverse('album', args=['missing']))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn('ETag', response)
+
 
 class ArtistDetailView(TestCase):
 
@@ -572,3 +886,85 @@ class SearchView(TestCase):
         )
         self.assertContains(response, searching_artist)
         self.assertContains(response, '0')
+
+
+class AsyncURLConf:
+    urlpatterns = [
+        path("", views.AsyncIndex.as_view(), name="index"),
+        path("recently_played/", views.AsyncUserRecentlyPlayedView.as_view(), name="recently_played"),
+        path("artist/<slug:artist_id>/", views.AsyncArtistDetailView.as_view(), name="artist"),
+        path("search/", views.AsyncSearchView.as_view(), name="search"),
+    ] + urls.urlpatterns + project_urls.urlpatterns
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncViews(TestCase):
+
+    def setUp(self):
+        self.artist = ArtistFactory()
+        self.albums = [
+            AlbumFactory(artist=self.artist)
+            for _ in range(6)
+        ]
+
+    def test_redirect_to_callback_without_token(self):
+
+        response = self.client.get(
+            reverse('index')
+        )
+
+        self.assertRedirects(response, '/callback/q')
+
+    @patch.object(async_tasks, 'get_new_releases', new_callable=AsyncMock)
+    def test_index(self, get_new_releases_mock):
+        _add_access_token_to_client_session(self.client)
+        get_new_releases_mock.return_value = self.albums
+
+        response = self.client.get(
+            reverse('index')
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'index.html')
+        for album in self.albums:
+            self.assertContains(response, reverse('album', args=[album.id]))
+
+    @patch.object(async_tasks, 'get_user_recently_played', new_callable=AsyncMock)
+    def test_recently_played(self, mock_func):
+        _add_access_token_to_client_session(self.client)
+        tracks = [TrackFactory() for _ in range(5)]
+        mock_func.return_value = tracks
+
+        response = self.client.get(
+            reverse('recently_played')
+        )
+
+        self.assertTemplateUsed(response, 'recently_played.html')
+        for track in tracks:
+            self.assertContains(response, track.name)
+
+    @patch.object(async_tasks, 'get_artist_and_albums', new_callable=AsyncMock)
+    def test_artist(self, mock_artist_albums):
+        _add_access_token_to_client_session(self.client)
+        mock_artist_albums.return_value = self.artist.name, self.albums
+
+        response = self.client.get(
+            reverse('artist', args=[self.artist.id])
+        )
+
+        self.assertTemplateUsed(response, 'artist.html')
+        self.assertContains(response, self.artist.name)
+        mock_artist_albums.assert_awaited_once()
+
+    @patch.object(async_tasks, 'get_search_results', new_callable=AsyncMock)
+    def test_search(self, mock_search_results):
+        _add_access_token_to_client_session(self.client)
+        mock_search_results.return_value = [self.artist], '1'
+
+        response = self.client.get(
+            '{}{}'.format(reverse('search'), '?q=found')
+        )
+
+        self.assertTemplateUsed(response, 'search.html')
+        self.assertContains(response, reverse('artist', args=[self.artist.id]))
+        self.assertEqual(mock_search_results.await_args.args[1], 'found')
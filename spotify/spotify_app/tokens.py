@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .api_endpoints import TokenRequestError, request_token, save_token_to_session
+from .singleflight import SingleFlight, SingleFlightTimeout
+
+LOG = logging.getLogger(__name__)
+
+TOKEN_PREFIX = "spotify:token:"
+TOKEN_SESSION_KEYS = ("access_token", "refresh_token", "token_expires_at")
+
+
+class TokenRefused(Exception):
+    """
+    Spotify refused the access token of the session and it could not be
+    refreshed, the user has to log in again.
+    """
+
+
+def forget_token(session):
+    for session_key in TOKEN_SESSION_KEYS:
+        session.pop(session_key, None)
+
+
+class TokenManager:
+    """
+    Keeps the Spotify access token of a session valid with the
+    refresh-token grant, instead of sending the user through the
+    authorize page again.
+
+    The token is refreshed ``margin`` seconds ahead of its expiry, or when
+    Spotify answers 401. Requests of one session refreshing at the same
+    time share a single grant: the new token is kept in the cache under
+    the refresh token, and requests still holding the old access token
+    pick it up from there.
+    """
+
+    def __init__(self, margin, lease, wait):
+        self.margin = margin
+        self.flight = SingleFlight("spotify:token-lease:", lease=lease, wait=wait, poll_interval=0.05)
+
+    def ensure_fresh(self, session):
+        """
+        Refresh the token when it is about to expire. Return False when it
+        has expired and could not be refreshed, or Spotify refused to
+        refresh it, the user has to log in.
+        """
+        expires_at = session.get("token_expires_at")
+        if expires_at is None or expires_at - self.margin > time.time():
+            return True
+        return self.refresh(session) or (expires_at > time.time() and "access_token" in session)
+
+    def refresh(self, session):
+        """
+        Replace the access token in the session. Return whether it was.
+        """
+        refresh_token = session.get("refresh_token")
+        if not refresh_token:
+            return False
+        key = hashlib.md5(str(refresh_token).encode()).hexdigest()
+        stale_token = session.get("access_token")
+
+        def ready():
+            token = cache.get(TOKEN_PREFIX + key)
+            if token is not None and token["access_token"] != stale_token:
+                return token
+            return None
+
+        def build():
+            token = request_token({"grant_type": "refresh_token", "refresh_token": refresh_token})
+            cache.set(TOKEN_PREFIX + key, token, token["expires_in"])
+            return token
+
+        try:
+            token = self.flight.do(key, build, ready)
+        except TokenRequestError as exc:
+            LOG.warning("Spotify refused to refresh an access token: %r", exc)
+            forget_token(session)
+            return False
+        except SingleFlightTimeout:
+            LOG.warning("Gave up waiting for an access token refresh")
+            return False
+        save_token_to_session(session, token)
+        return True
+
+
+class AppToken:
+    """
+    Access token of the app itself, from the client-credentials grant,
+    for the catalogue endpoints which need no user.
+
+    One token per process, refreshed ``margin`` seconds ahead of its
+    expiry; threads needing a new one wait for a single grant.
+    """
+
+    def __init__(self, margin):
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._token = (None, 0)
+
+    def _valid(self, stale_token):
+        access_token, expires_at = self._token
+        return access_token is not None and access_token != stale_token and expires_at - self.margin > time.time()
+
+    def get(self, stale_token=None):
+        """
+        Return the token, a new one when it is about to expire or is
+        ``stale_token``, which Spotify refused.
+        """
+        if not self._valid(stale_token):
+            with self._lock:
+                if not self._valid(stale_token):
+                    token = request_token({"grant_type": "client_credentials"})
+                    self._token = (token["access_token"], token["expires_at"])
+        return self._token[0]
+
+
+token_manager = TokenManager(
+    margin=settings.SPOTIFY_TOKEN_REFRESH_MARGIN,
+    lease=settings.SPOTIFY_TOKEN_REFRESH_LEASE,
+    wait=settings.SPOTIFY_TOKEN_REFRESH_WAIT,
+)
+
+app_token = AppToken(margin=settings.SPOTIFY_TOKEN_REFRESH_MARGIN)
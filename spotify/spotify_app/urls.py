@@ -1,15 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
 from spotify_app import views
+from spotify_app.exports import EXPORT_FORMATS, EXPORTS
+from spotify_app.models import IngestionJob
 
 
 # TODO: search/callback q?
 
+# Views calling Spotify only, served from the event loop under ASGI.
+if settings.SPOTIFY_ASYNC_VIEWS:
+    IndexView = views.AsyncIndex
+    UserRecentlyPlayedView = views.AsyncUserRecentlyPlayedView
+    ArtistDetailView = views.AsyncArtistDetailView
+    SearchView = views.AsyncSearchView
+else:
+    IndexView = views.Index
+    UserRecentlyPlayedView = views.UserRecentlyPlayedView
+    ArtistDetailView = views.ArtistDetailView
+    SearchView = views.SearchView
+
 urlpatterns = [
-    path("", views.Index.as_view(), name="index"),
+    path("", IndexView.as_view(), name="index"),
     path(
         "recently_played/",
-        views.UserRecentlyPlayedView.as_view(),
+        UserRecentlyPlayedView.as_view(),
         name="recently_played",
     ),
     path(
@@ -17,9 +32,33 @@ urlpatterns = [
         views.TrackDetailView.as_view(),
         name="track",
     ),
+    path(
+        "track/<slug:object_id>/status/",
+        views.IngestionStatusView.as_view(kind=IngestionJob.TRACK),
+        name="track_status",
+    ),
+    path(
+        "track/<slug:track_id>/similar/",
+        views.SimilarTracksView.as_view(),
+        name="similar_tracks",
+    ),
     path("tracks_table/", views.TracksTableView.as_view(), name="tracks_table"),
     path("album/<slug:album_id>/", views.AlbumDetailView.as_view(), name="album"),
+    path(
+        "album/<slug:object_id>/status/",
+        views.IngestionStatusView.as_view(kind=IngestionJob.ALBUM),
+        name="album_status",
+    ),
     path("albums_table/", views.AlbumTableView.as_view(), name="albums_table"),
-    path("artist/<slug:artist_id>/", views.ArtistDetailView.as_view(), name="artist"),
-    path("search/", views.SearchView.as_view(), name="search"),
+    path("artist/<slug:artist_id>/", ArtistDetailView.as_view(), name="artist"),
+    path("search/", SearchView.as_view(), name="search"),
+    path("metrics/", views.MetricsView.as_view(), name="metrics"),
+] + [
+    path(
+        f"export/{kind}.{export_format}",
+        views.ExportView.as_view(kind=kind, export_format=export_format),
+        name=f"export_{kind}_{export_format}",
+    )
+    for kind in EXPORTS
+    for export_format in EXPORT_FORMATS
 ]
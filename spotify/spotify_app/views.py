@@ -1,12 +1,30 @@
+import asyncio
+import functools
+import hashlib
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
-from django.utils.decorators import method_decorator
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.decorators import classonlymethod, method_decorator
+from django.utils.http import http_date, quote_etag
 from django.views import View
 
+from . import async_tasks
 from .api_endpoints import save_access_token_to_client_session
-from .decorators import token_validation
+from .decorators import async_token_validation, token_validation
+from .exports import ExportFilterError, export_catalogue, export_filters
+from .fragments import FRAGMENT_VERSION, cached_fragment
+from .instrumentation import view_metrics
+from .models import Album, Track
 from .selectors import (
     get_album_details,
     get_albums_table,
+    get_ingestion_status,
+    get_similar_tracks,
+    get_table_validators,
     get_track_details,
     get_tracks_table,
 )
@@ -42,6 +60,65 @@ class UserRecentlyPlayedView(View):
         )
 
 
+def render_ingestion_pending(request, job, status_url):
+    """
+    Placeholder page polling ``status_url`` until the worker collected the object.
+    """
+    ctx = {"job": job, "status_url": status_url}
+    return render(request, "ingestion_pending.html", ctx, status=202)
+
+
+def conditional_response(request, respond, etag, last_modified=None, **cache_control):
+    """
+    Answer 304 when the client has this version of the page already,
+    otherwise ``respond()``. Both carry the validators and Cache-Control.
+    """
+    etag = quote_etag(etag)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = respond()
+    response["ETag"] = etag
+    if timestamp:
+        response["Last-Modified"] = http_date(timestamp)
+    patch_cache_control(response, **cache_control)
+    return response
+
+
+def render_details(request, kind, object_id, get_details):
+    """
+    Render the album/track page around its cached details, or the
+    placeholder page while it is being collected.
+    """
+    details = {}
+
+    def render_fragment():
+        details.update(get_details(request, object_id))
+        if "job" in details:
+            return None
+        return render_to_string(f"{kind}_content.html", details)
+
+    content = cached_fragment(kind, object_id, render_fragment)
+    if content is None:
+        # Nothing was cached: the album/track is missing, or was found
+        # missing by the thread rendering it for this one.
+        if not details:
+            details.update(get_details(request, object_id))
+        if "job" not in details:
+            content = render_to_string(f"{kind}_content.html", details)
+    if content is None:
+        return render_ingestion_pending(request, details["job"], reverse(f"{kind}_status", args=[object_id]))
+
+    etag = f"{kind}-{FRAGMENT_VERSION}-{hashlib.md5(content.encode()).hexdigest()}"
+    return conditional_response(
+        request,
+        lambda: render(request, f"{kind}.html", {"content": content}),
+        etag,
+        private=True,
+        max_age=settings.SPOTIFY_DETAILS_MAX_AGE,
+    )
+
+
 @method_decorator(token_validation, name="dispatch")
 class TrackDetailView(View):
     """
@@ -50,18 +127,48 @@ class TrackDetailView(View):
     """
 
     def get(self, request, track_id):
-        ctx = get_track_details(request, track_id)
-        return render(request, "track.html", ctx)
+        return render_details(request, "track", track_id, get_track_details)
+
+
+class SimilarTracksView(View):
+    """
+    Return as JSON the ``k`` stored tracks sounding the most like the track,
+    by the distance between their audio features.
+    """
+
+    def get(self, request, track_id):
+        try:
+            k = int(request.GET.get("k", settings.SPOTIFY_SIMILAR_TRACKS_DEFAULT))
+        except ValueError:
+            k = settings.SPOTIFY_SIMILAR_TRACKS_DEFAULT
+        k = min(max(k, 1), settings.SPOTIFY_SIMILAR_TRACKS_MAX)
+
+        ctx = get_similar_tracks(track_id, k)
+        if ctx is None:
+            raise Http404("Track not collected yet.")
+        return JsonResponse(ctx)
 
 
 class TracksTableView(View):
     """
     Display table with all tracks saved in the  db.
+    Sorted by ``sort`` in ``dir`` order, a page at a time after ``after``.
     """
 
     def get(self, request):
-        ctx = get_tracks_table()
-        return render(request, "tracks_table.html", ctx)
+        etag, last_modified = get_table_validators(Track)
+        return conditional_response(
+            request,
+            lambda: render(request, "tracks_table.html", get_tracks_table(
+                sort=request.GET.get("sort"),
+                direction=request.GET.get("dir"),
+                after=request.GET.get("after"),
+            )),
+            etag,
+            last_modified,
+            public=True,
+            max_age=settings.SPOTIFY_TABLES_MAX_AGE,
+        )
 
 
 @method_decorator(token_validation, name="dispatch")
@@ -72,18 +179,68 @@ class AlbumDetailView(View):
     """
 
     def get(self, request, album_id):
-        ctx = get_album_details(request, album_id)
-        return render(request, "album.html", ctx)
+        return render_details(request, "album", album_id, get_album_details)
+
+
+class IngestionStatusView(View):
+    """
+    Tell the placeholder page whether the album/track is collected already.
+    """
+    kind = None
+
+    def get(self, request, object_id):
+        return JsonResponse(get_ingestion_status(self.kind, object_id))
 
 
 class AlbumTableView(View):
     """
     Display table with all albums saved in the  db.
+    Sorted by ``sort`` in ``dir`` order, a page at a time after ``after``.
+    """
+
+    def get(self, request):
+        etag, last_modified = get_table_validators(Album)
+        return conditional_response(
+            request,
+            lambda: render(request, "albums_table.html", get_albums_table(
+                sort=request.GET.get("sort"),
+                direction=request.GET.get("dir"),
+                after=request.GET.get("after"),
+            )),
+            etag,
+            last_modified,
+            public=True,
+            max_age=settings.SPOTIFY_TABLES_MAX_AGE,
+        )
+
+
+class ExportView(View):
+    """
+    Stream every stored track/album as CSV or NDJSON.
+    Filtered by ``artist`` id and ``<feature>_min`` / ``<feature>_max``.
+    """
+    kind = None
+    export_format = None
+
+    def get(self, request):
+        try:
+            filters = export_filters(request.GET)
+        except ExportFilterError as exc:
+            return HttpResponseBadRequest(str(exc))
+
+        content_type, chunks = export_catalogue(self.kind, self.export_format, filters)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{self.kind}.{self.export_format}"'
+        return response
+
+
+class MetricsView(View):
+    """
+    Per-view request timings of this process, for Prometheus.
     """
 
     def get(self, request):
-        ctx = get_albums_table()
-        return render(request, "albums_table.html", ctx)
+        return HttpResponse(view_metrics.exposition(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @method_decorator(token_validation, name="dispatch")
@@ -123,3 +280,76 @@ class Callback(View):
             return redirect("/")
         else:
             return render(request, "callback.html")
+
+
+class AsyncView(View):
+    """
+    Base for views with ``async def`` handlers.
+
+    Django only runs a view natively in the event loop when the callable
+    returned by ``as_view()`` is a coroutine function.
+    """
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        functools.update_wrapper(async_view, view)
+        return async_view
+
+
+@method_decorator(async_token_validation, name="dispatch")
+class AsyncIndex(AsyncView):
+    """
+    Display new releases in Spotify.
+    """
+
+    async def get(self, request):
+        new_releases = await async_tasks.get_new_releases(request)
+        return render(request, "index.html", {"new_releases": new_releases})
+
+
+@method_decorator(async_token_validation, name="dispatch")
+class AsyncUserRecentlyPlayedView(AsyncView):
+    """
+    Display a list with user recently played tracks.
+    """
+
+    async def get(self, request):
+        recently_played_tracks = await async_tasks.get_user_recently_played(request)
+        return render(
+            request, "recently_played.html", {"recently_played_tracks": recently_played_tracks}
+        )
+
+
+@method_decorator(async_token_validation, name="dispatch")
+class AsyncArtistDetailView(AsyncView):
+    """
+    Display a list with all artist's albums
+    """
+    async def get(self, request, artist_id):
+        artist, albums = await async_tasks.get_artist_and_albums(request, artist_id)
+        ctx = {"artist": artist, 'albums': albums}
+        return render(request, "artist.html", ctx)
+
+
+@method_decorator(async_token_validation, name="dispatch")
+class AsyncSearchView(AsyncView):
+    """
+    Display a list of artists that matches searching word.
+    """
+    async def get(self, request):
+        searching = request.GET.get("q")
+        result_list, total = await async_tasks.get_search_results(request, searching)
+        ctx = {
+            'searching': searching,
+            "result_list": result_list,
+            'total': total
+        }
+        return render(request, "search.html", ctx)
@@ -0,0 +1,21 @@
+"""
+ASGI config for spotify_project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Views calling only the Spotify API are served by their async versions, run it
+with uvicorn workers, e.g.::
+
+    gunicorn spotify_project.asgi:application -k uvicorn.workers.UvicornWorker
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings.base")
+os.environ.setdefault("SPOTIFY_ASYNC_VIEWS", "1")
+
+application = get_asgi_application()